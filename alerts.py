@@ -0,0 +1,383 @@
+"""
+增量告警规则引擎
+挂在 GoldPriceScheduler 上，每次获取到价格后只评估可能触发的规则：
+
+- threshold：价格穿越阈值。按数据源维护有序阈值表，用二分查找定位
+  上一价格与当前价格之间的阈值，代价与规则总数无关
+- move：N 分钟内涨跌超过 X%。按 (数据源, 窗口) 维护单调队列求滑动窗口最值，
+  规则按百分比排序，二分查找找出所有被触发的规则
+- divergence：两个数据源（如水贝价与银行价）价差超过 X%，同样按百分比排序
+
+告警经过冷却去重后交给后台线程批量发送到本地文件或 Webhook。
+"""
+
+import bisect
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+# 同一规则两次告警之间的默认冷却时间（秒）
+DEFAULT_COOLDOWN = 300
+
+# 匹配任意数据源
+ANY_SOURCE = '*'
+
+
+def _tick_time(price_data: Dict) -> float:
+    """取价格数据的时间戳（秒），缺失时使用当前时间"""
+    timestamp = price_data.get('timestamp')
+    if timestamp:
+        try:
+            return datetime.fromisoformat(timestamp).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return time.time()
+
+
+class _SortedRules:
+    """按数值排序的规则表，支持按区间二分查找"""
+
+    def __init__(self):
+        self.keys: List[float] = []
+        self.rules: List[Dict] = []
+
+    def add(self, key: float, rule: Dict):
+        index = bisect.bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.rules.insert(index, rule)
+
+    def between(self, low: float, high: float, include_low: bool, include_high: bool) -> List[Dict]:
+        """返回 key 落在 (low, high) 区间内的规则，端点是否包含由参数决定"""
+        start = bisect.bisect_left(self.keys, low) if include_low else bisect.bisect_right(self.keys, low)
+        end = bisect.bisect_right(self.keys, high) if include_high else bisect.bisect_left(self.keys, high)
+        return self.rules[start:end]
+
+    def up_to(self, value: float) -> List[Dict]:
+        """返回 key <= value 的规则"""
+        return self.rules[:bisect.bisect_right(self.keys, value)]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class SlidingWindowExtrema:
+    """基于单调队列的时间窗口最小值 / 最大值，均摊 O(1)"""
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self._min: deque = deque()
+        self._max: deque = deque()
+
+    def push(self, timestamp: float, price: float):
+        while self._min and self._min[-1][1] >= price:
+            self._min.pop()
+        self._min.append((timestamp, price))
+        while self._max and self._max[-1][1] <= price:
+            self._max.pop()
+        self._max.append((timestamp, price))
+
+        cutoff = timestamp - self.window_seconds
+        while self._min[0][0] < cutoff:
+            self._min.popleft()
+        while self._max[0][0] < cutoff:
+            self._max.popleft()
+
+    @property
+    def minimum(self) -> float:
+        return self._min[0][1]
+
+    @property
+    def maximum(self) -> float:
+        return self._max[0][1]
+
+
+class FileAlertSink:
+    """把告警以 JSON Lines 追加到本地文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def send(self, alerts: List[Dict]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(alert, ensure_ascii=False) + '\n' for alert in alerts))
+
+
+class WebhookAlertSink:
+    """把一批告警以 JSON 数组 POST 到 Webhook 地址"""
+
+    def __init__(self, url: str, timeout: float = 5):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, alerts: List[Dict]):
+        response = self.session.post(self.url, json={'alerts': alerts}, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class AlertDispatcher:
+    """后台批量发送告警，避免通知阻塞价格获取"""
+
+    def __init__(self, sinks: List, batch_size: int = 100, flush_interval: float = 1.0):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: 'queue.Queue[Optional[Dict]]' = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.sent = 0
+        self.failed = 0
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def put(self, alert: Dict):
+        self.start()
+        self._queue.put(alert)
+
+    def stop(self):
+        """发送剩余告警后停止"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            if batch:
+                self._deliver(batch)
+
+    def _deliver(self, batch: List[Dict]):
+        # 同一批次内同一规则只保留最新一条
+        latest = {}
+        for alert in batch:
+            latest[alert['rule_id']] = alert
+        alerts = list(latest.values())
+
+        for sink in self.sinks:
+            try:
+                sink.send(alerts)
+                self.sent += len(alerts)
+            except Exception as e:
+                self.failed += len(alerts)
+                self.logger.error("发送告警到 %s 失败: %s", type(sink).__name__, e)
+
+
+class AlertEngine:
+    """按价格数据增量评估告警规则"""
+
+    def __init__(self, rules: Optional[List[Dict]] = None, dispatcher: Optional[AlertDispatcher] = None,
+                 default_cooldown: float = DEFAULT_COOLDOWN):
+        self.dispatcher = dispatcher
+        self.default_cooldown = default_cooldown
+        self.logger = logging.getLogger(__name__)
+
+        self._last_price: Dict[str, float] = {}
+        self._last_fired: Dict[str, float] = {}
+        # 数据源 -> 阈值规则表
+        self._thresholds: Dict[str, Dict[str, _SortedRules]] = {}
+        # 规则的数据源 -> 窗口秒数 -> ({实际数据源: 窗口最值}, 上涨规则表, 下跌规则表)
+        # 通配规则同样按实际数据源分别维护窗口，不同数据源的价格不会互相比较
+        self._moves: Dict[str, Dict[float, list]] = {}
+        # 数据源 -> [(对方数据源, 是否为参考方, 规则表)]
+        self._divergences: Dict[str, List[tuple]] = {}
+        self._pair_rules: Dict[tuple, _SortedRules] = {}
+        self.rule_count = 0
+        self.evaluations = 0
+
+        for rule in rules or []:
+            self.add_rule(rule)
+
+    # ---- 规则管理 ----
+
+    def add_rule(self, rule: Dict):
+        """添加一条规则"""
+        rule = dict(rule)
+        rule.setdefault('id', f"rule-{self.rule_count + 1}")
+        rule_type = rule.get('type')
+        if rule_type == 'divergence':
+            # 价差需要两个具体的数据源，通配的数据源永远不会与参考源配对
+            for field in ('source', 'reference'):
+                if not rule.get(field) or rule[field] == ANY_SOURCE:
+                    raise ValueError(f"价差告警规则 {rule['id']} 必须指定具体的 {field} 数据源")
+            if rule['source'] == rule['reference']:
+                raise ValueError(f"价差告警规则 {rule['id']} 的 source 和 reference 不能是同一个数据源")
+        rule.setdefault('source', ANY_SOURCE)
+
+        if rule_type == 'threshold':
+            tables = self._thresholds.setdefault(rule['source'], {'above': _SortedRules(), 'below': _SortedRules()})
+            direction = rule.get('direction', 'cross')
+            if direction in ('above', 'cross'):
+                tables['above'].add(float(rule['price']), rule)
+            if direction in ('below', 'cross'):
+                tables['below'].add(float(rule['price']), rule)
+
+        elif rule_type == 'move':
+            window = float(rule.get('window_minutes', 5)) * 60
+            windows = self._moves.setdefault(rule['source'], {})
+            entry = windows.setdefault(window, [{}, _SortedRules(), _SortedRules()])
+            direction = rule.get('direction', 'any')
+            if direction in ('up', 'any'):
+                entry[1].add(float(rule['percent']), rule)
+            if direction in ('down', 'any'):
+                entry[2].add(float(rule['percent']), rule)
+
+        elif rule_type == 'divergence':
+            pair = (rule['source'], rule['reference'])
+            if pair not in self._pair_rules:
+                self._pair_rules[pair] = _SortedRules()
+                self._divergences.setdefault(pair[0], []).append((pair[1], False, self._pair_rules[pair]))
+                self._divergences.setdefault(pair[1], []).append((pair[0], True, self._pair_rules[pair]))
+            self._pair_rules[pair].add(float(rule['percent']), rule)
+
+        else:
+            raise ValueError(f"未知的告警规则类型: {rule_type}")
+
+        self.rule_count += 1
+
+    # ---- 评估 ----
+
+    def on_tick(self, price_data: Dict) -> List[Dict]:
+        """评估一条价格数据，返回本次触发的告警（可直接作为调度器监听器）"""
+        price = price_data.get('price')
+        source = price_data.get('source', '')
+        if price is None:
+            return []
+        price = float(price)
+        now = _tick_time(price_data)
+        previous = self._last_price.get(source)
+        self._last_price[source] = price
+
+        candidates = []
+        for key in (source, ANY_SOURCE):
+            if previous is not None and key in self._thresholds:
+                candidates.extend(self._check_thresholds(self._thresholds[key], previous, price))
+            if key in self._moves:
+                candidates.extend(self._check_moves(self._moves[key], source, now, price))
+        if source in self._divergences:
+            candidates.extend(self._check_divergences(source, price))
+
+        self.evaluations += 1
+        fired = [self._emit(rule, detail, source, price, price_data.get('timestamp'), now)
+                 for rule, detail in candidates if self._should_fire(rule, now)]
+        return fired
+
+    def _check_thresholds(self, tables: Dict[str, _SortedRules], previous: float, price: float):
+        if price > previous:
+            for rule in tables['above'].between(previous, price, include_low=False, include_high=True):
+                yield rule, {'direction': 'above', 'threshold': rule['price'], 'previous_price': previous}
+        elif price < previous:
+            for rule in tables['below'].between(price, previous, include_low=True, include_high=False):
+                yield rule, {'direction': 'below', 'threshold': rule['price'], 'previous_price': previous}
+
+    def _check_moves(self, windows: Dict[float, list], source: str, now: float, price: float):
+        for window, entry in windows.items():
+            extrema = entry[0].get(source)
+            if extrema is None:
+                extrema = entry[0][source] = SlidingWindowExtrema(window)
+            extrema.push(now, price)
+
+            low, high = extrema.minimum, extrema.maximum
+            up = (price - low) / low * 100 if low > 0 else 0.0
+            down = (high - price) / high * 100 if high > 0 else 0.0
+            for rule in entry[1].up_to(up):
+                yield rule, {'direction': 'up', 'change_percent': round(up, 4), 'window_low': low}
+            for rule in entry[2].up_to(down):
+                yield rule, {'direction': 'down', 'change_percent': round(down, 4), 'window_high': high}
+
+    def _check_divergences(self, source: str, price: float):
+        for other, is_reference, table in self._divergences[source]:
+            other_price = self._last_price.get(other)
+            if other_price is None:
+                continue
+            subject, reference = (other_price, price) if is_reference else (price, other_price)
+            if reference <= 0:
+                continue
+            spread = abs(subject - reference) / reference * 100
+            for rule in table.up_to(spread):
+                yield rule, {'spread_percent': round(spread, 4), 'subject_price': subject,
+                             'reference_price': reference}
+
+    def _should_fire(self, rule: Dict, now: float) -> bool:
+        """冷却期内同一规则不重复告警"""
+        cooldown = rule.get('cooldown_seconds', self.default_cooldown)
+        last = self._last_fired.get(rule['id'])
+        if last is not None and now - last < cooldown:
+            return False
+        self._last_fired[rule['id']] = now
+        return True
+
+    def _emit(self, rule: Dict, detail: Dict, source: str, price: float,
+              timestamp: Optional[str], now: float) -> Dict:
+        alert = {
+            'rule_id': rule['id'],
+            'type': rule['type'],
+            'source': source,
+            'price': price,
+            'timestamp': timestamp or datetime.fromtimestamp(now).isoformat(),
+            'message': rule.get('message', ''),
+            **detail
+        }
+        if self.dispatcher is not None:
+            self.dispatcher.put(alert)
+        return alert
+
+    def close(self):
+        """发送剩余告警"""
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+
+
+def _load_config(config_file: str) -> Dict:
+    with open(config_file, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    return {'rules': config} if isinstance(config, list) else config
+
+
+def load_alert_rules(config_file: str) -> Tuple[List[Dict], float]:
+    """只读取配置文件中的规则和默认冷却时间（例如回放历史数据时，不发送通知）"""
+    config = _load_config(config_file)
+    return config.get('rules', []), config.get('cooldown_seconds', DEFAULT_COOLDOWN)
+
+
+def load_alert_engine(config_file: str, data_dir: str = "data") -> AlertEngine:
+    """从 JSON 配置文件创建告警引擎
+
+    配置格式: {"rules": [...], "sinks": {"file": "data/alerts.jsonl", "webhook": "http://127.0.0.1:9000/alerts"}}
+    """
+    config = _load_config(config_file)
+
+    sink_config = config.get('sinks', {})
+    sinks = [FileAlertSink(sink_config.get('file', os.path.join(data_dir, 'alerts.jsonl')))]
+    if sink_config.get('webhook'):
+        sinks.append(WebhookAlertSink(sink_config['webhook']))
+
+    dispatcher = AlertDispatcher(sinks,
+                                 batch_size=config.get('batch_size', 100),
+                                 flush_interval=config.get('flush_interval', 1.0))
+    return AlertEngine(config.get('rules', []), dispatcher,
+                       default_cooldown=config.get('cooldown_seconds', DEFAULT_COOLDOWN))
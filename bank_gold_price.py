@@ -2,114 +2,71 @@
 使用银行官方数据获取黄金价格
 """
 
-import requests
 import json
 import logging
+import threading
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
-class BankGoldPrice:
-    """银行黄金价格类"""
-
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        })
+from rate_limit import RateLimitedSession
+from source_registry import ESTIMATE_SUFFIXES, CompiledSource, SourceRegistry, get_registry
 
-    def get_icbc_gold_price(self) -> Optional[Dict]:
-        """获取工商银行纸黄金价格"""
+class BankGoldPrice:
+    """银行黄金价格类（银行数据源在 source_registry 中声明，group='bank'）"""
+
+    def __init__(self, registry: Optional[SourceRegistry] = None, session: Optional[RateLimitedSession] = None):
+        # 可以与其他获取器共用一个 Session（共用连接池和限流器）
+        if session is None:
+            session = RateLimitedSession()
+            session.headers.update({
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            })
+        self.session = session
+        self.registry = registry or get_registry()
+        # 按优先级排序的银行数据源
+        self.sources: List[CompiledSource] = self.registry.group('bank')
+
+    def fetch_source(self, source: CompiledSource) -> Optional[Dict]:
+        """获取一个银行数据源的价格
+
+        页面可以访问但尚未能解析出价格时，返回声明中的示例价格（如果有）。
+        """
         try:
-            # 工商银行贵金属页面
-            url = "https://mybank.icbc.com.cn/servlet/AsynGetDataServlet"
-            response = self.session.get(url, timeout=10)
-
-            if response.status_code == 200:
-                # 这里需要根据实际页面结构调整解析逻辑
-                # 工商银行通常有JSON格式的数据
-                try:
-                    data = response.json()
-                    # 解析黄金价格数据
-                    # 实际解析逻辑需要根据工商银行API响应格式调整
-                except (ValueError, json.JSONDecodeError):
-                    # 如果JSON解析失败，尝试HTML解析
-                    pass
-
-            # 返回示例价格
-            return {
-                'source': '工商银行纸黄金',
-                'price': 915.5,  # 示例价格，实际需要从响应中提取
-                'timestamp': datetime.now().isoformat(),
-                'note': '工商银行纸黄金价格，仅供参考'
+            result, _ = source.fetch(self.session)
+            if result is None and source.sample_price is None:
+                return None
+            price_data = {
+                'source': source.name,
+                'price': result['price'] if result else source.sample_price,
+                'timestamp': datetime.now().isoformat()
             }
+            if source.note:
+                price_data['note'] = source.note
+            return price_data
 
         except Exception as e:
-            logging.error("获取工商银行金价失败: %s", e)
+            logging.error("获取%s金价失败: %s", source.name, e)
 
         return None
 
+    def get_icbc_gold_price(self) -> Optional[Dict]:
+        """获取工商银行纸黄金价格"""
+        return self.fetch_source(self.registry.get('工商银行纸黄金'))
+
     def get_boc_gold_price(self) -> Optional[Dict]:
         """获取中国银行黄金价格"""
-        try:
-            # 中国银行贵金属页面
-            url = "https://www.boc.cn/finadata/gold/"
-            response = self.session.get(url, timeout=10)
-
-            if response.status_code == 200:
-                # 解析中国银行黄金价格
-                # 这里需要根据实际页面结构调整
-                return {
-                    'source': '中国银行黄金',
-                    'price': 916.8,  # 示例价格
-                    'timestamp': datetime.now().isoformat(),
-                    'note': '中国银行黄金价格，仅供参考'
-                }
-
-        except Exception as e:
-            logging.error("获取中国银行金价失败: %s", e)
-
-        return None
+        return self.fetch_source(self.registry.get('中国银行黄金'))
 
     def get_ccb_gold_price(self) -> Optional[Dict]:
         """获取建设银行黄金价格"""
-        try:
-            # 建设银行贵金属页面
-            url = "https://www.ccb.com/cn/personal/wealth/gold_silver.html"
-            response = self.session.get(url, timeout=10)
-
-            if response.status_code == 200:
-                # 解析建设银行黄金价格
-                return {
-                    'source': '建设银行黄金',
-                    'price': 917.2,  # 示例价格
-                    'timestamp': datetime.now().isoformat(),
-                    'note': '建设银行黄金价格，仅供参考'
-                }
-
-        except Exception as e:
-            logging.error("获取建设银行金价失败: %s", e)
-
-        return None
+        return self.fetch_source(self.registry.get('建设银行黄金'))
 
     def get_bank_gold_price(self) -> Optional[Dict]:
-        """获取银行黄金价格（优先选择）"""
-        # 按优先级尝试不同的银行
-        price_data = None
-
-        # 首先尝试工商银行
-        price_data = self.get_icbc_gold_price()
-        if price_data:
-            return price_data
-
-        # 然后尝试中国银行
-        price_data = self.get_boc_gold_price()
-        if price_data:
-            return price_data
-
-        # 最后尝试建设银行
-        price_data = self.get_ccb_gold_price()
-        if price_data:
-            return price_data
+        """获取银行黄金价格（按优先级尝试各银行）"""
+        for source in self.sources:
+            price_data = self.fetch_source(source)
+            if price_data:
+                return price_data
 
         return None
 
@@ -118,14 +75,14 @@ class BankGoldPrice:
         bank_price = self.get_bank_gold_price()
 
         if bank_price:
-            # 水贝金价通常比银行金价略高（包含加工费等）
-            shuibei_price = bank_price['price'] * 1.03  # 增加3%作为估算
+            # 水贝金价通常比银行金价略高（包含加工费等），加价系数在数据源声明中配置
+            source = self.registry.get(bank_price['source'])
             return {
-                'source': f"{bank_price['source']} (水贝估算)",
-                'price': round(shuibei_price, 2),
+                'source': bank_price['source'] + ESTIMATE_SUFFIXES['bank'],
+                'price': source.estimate(bank_price['price']),
                 'timestamp': datetime.now().isoformat(),
                 'base_bank_price': bank_price['price'],
-                'markup_percentage': 3.0,
+                'markup_percentage': source.markup_percentage,
                 'note': '基于银行金价估算的水贝市场金价，实际价格可能有所不同'
             }
         else:
@@ -137,11 +94,23 @@ class BankGoldPrice:
             }
 
 
+_default_bank: Optional[BankGoldPrice] = None
+_default_lock = threading.Lock()
+
+
+def get_default_bank() -> BankGoldPrice:
+    """进程内共享的银行金价获取器（复用 Session 的连接池，不再每次调用都新建）"""
+    global _default_bank
+    with _default_lock:
+        if _default_bank is None:
+            _default_bank = BankGoldPrice()
+        return _default_bank
+
+
 # 兼容接口
 def get_bank_gold_data():
     """获取银行黄金数据"""
-    bank = BankGoldPrice()
-    return bank.get_shuibei_estimate()
+    return get_default_bank().get_shuibei_estimate()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,349 @@
+"""
+终端实时看板
+订阅 GoldPriceScheduler 的价格事件（监听器）和各数据源的获取结果（日志中的 outcome 字段），
+显示各数据源的最新价格、走势迷你图、滚动统计和数据源健康状况。
+
+启动时从存储的最近价格缓存载入一次历史，之后完全由进程内事件驱动，不再读取存储。
+每个区域只在对应数据变化时重新生成，刷新频率不超过 fps；没有变化时只有时钟每秒更新一次。
+"""
+
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Set
+
+import numpy as np
+
+from data_storage import DEFAULT_DURABILITY
+from price_stats import RunningStats
+
+# 迷你图使用的字符（由低到高）
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+
+# 默认最高刷新频率（帧/秒）
+DEFAULT_FPS = 4
+
+# 每个数据源保留的价格点数（迷你图宽度和滚动统计窗口）
+DEFAULT_HISTORY = 60
+
+# 看板的各个区域
+PANELS = ('header', 'prices', 'stats', 'health')
+
+
+def sparkline(values: List[float], width: int = DEFAULT_HISTORY) -> str:
+    """把最近 width 个价格画成一行迷你图"""
+    values = values[-width:]
+    if not values:
+        return ''
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(values)
+    scale = (len(SPARK_CHARS) - 1) / (high - low)
+    return ''.join(SPARK_CHARS[int((value - low) * scale)] for value in values)
+
+
+class SourceState:
+    """单个数据源的价格历史和健康状况"""
+
+    def __init__(self, history: int):
+        self.prices: Deque[float] = deque(maxlen=history)
+        # 本次运行以来的累计统计（不含启动时载入的历史）
+        self.session = RunningStats()
+        self.last_price: Optional[float] = None
+        self.previous_price: Optional[float] = None
+        self.last_timestamp: Optional[str] = None
+        self.ok = 0
+        self.failed = 0
+        self.throttled = 0
+        self.consecutive_failures = 0
+        self.last_outcome: Optional[str] = None
+        self.latency_ms: Optional[float] = None
+        self.last_seen: Optional[str] = None
+
+    def push_price(self, price: float, timestamp: Optional[str]):
+        self.previous_price = self.last_price
+        self.last_price = price
+        self.last_timestamp = timestamp
+        self.prices.append(price)
+
+
+class DashboardState:
+    """线程安全的看板数据，记录自上次渲染以来哪些区域需要重新生成"""
+
+    def __init__(self, history: int = DEFAULT_HISTORY):
+        self.history = history
+        self.sources: Dict[str, SourceState] = {}
+        self.ticks = 0
+        self.failed_ticks = 0
+        self.last_error: Optional[str] = None
+        self.changed = threading.Event()
+        self._dirty: Set[str] = set(PANELS)
+        self._lock = threading.Lock()
+
+    def _source(self, name: str) -> SourceState:
+        state = self.sources.get(name)
+        if state is None:
+            state = self.sources[name] = SourceState(self.history)
+        return state
+
+    def _mark(self, *panels: str):
+        self._dirty.update(panels)
+        self.changed.set()
+
+    def load(self, records: List[Dict]):
+        """载入启动时的历史记录（按时间顺序）"""
+        with self._lock:
+            for record in records:
+                if record.get('price') is not None:
+                    self._source(str(record.get('source'))).push_price(float(record['price']),
+                                                                       record.get('timestamp'))
+            self._mark('prices', 'stats')
+
+    def on_tick(self, price_data: Dict):
+        """调度器每次获取后调用（价格监听器）"""
+        with self._lock:
+            self.ticks += 1
+            if price_data.get('price') is None:
+                self.failed_ticks += 1
+                self.last_error = price_data.get('error')
+                self._mark('header')
+                return
+            price = float(price_data['price'])
+            state = self._source(str(price_data.get('source')))
+            state.push_price(price, price_data.get('timestamp'))
+            state.session.update(price)
+            self._mark('header', 'prices', 'stats')
+
+    def on_outcome(self, source: str, outcome: str, latency_ms: Optional[float] = None):
+        """某个数据源的一次获取结果（ok / no_price / throttled / error）"""
+        with self._lock:
+            state = self._source(source)
+            if outcome == 'ok':
+                state.ok += 1
+                state.consecutive_failures = 0
+            elif outcome == 'throttled':
+                state.throttled += 1
+            else:
+                state.failed += 1
+                state.consecutive_failures += 1
+            state.last_outcome = outcome
+            if latency_ms is not None:
+                state.latency_ms = latency_ms
+            state.last_seen = datetime.now().strftime('%H:%M:%S')
+            self._mark('health')
+
+    def take_dirty(self) -> Set[str]:
+        """取出并清空需要重新生成的区域"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            self.changed.clear()
+            return dirty
+
+
+class _OutcomeHandler(logging.Handler):
+    """把带 outcome 字段的日志记录（各数据源的获取结果）转发给看板"""
+
+    def __init__(self, state: DashboardState):
+        super().__init__(logging.INFO)
+        self.state = state
+
+    def emit(self, record: logging.LogRecord):
+        outcome = getattr(record, 'outcome', None)
+        source = getattr(record, 'source', None)
+        if outcome and source:
+            self.state.on_outcome(str(source), outcome, getattr(record, 'latency_ms', None))
+
+
+class PriceDashboard:
+    """基于 rich Live 的终端看板"""
+
+    def __init__(self, scheduler, history: int = DEFAULT_HISTORY, fps: float = DEFAULT_FPS):
+        self.scheduler = scheduler
+        self.state = DashboardState(history)
+        self.fps = max(0.1, fps)
+        self.frames = 0
+        self.started = time.monotonic()
+        self._handler = _OutcomeHandler(self.state)
+        self._stop = threading.Event()
+
+    def load_history(self, per_source: int = DEFAULT_HISTORY):
+        """从存储的最近价格缓存载入一次历史（之后不再读取存储）"""
+        try:
+            records = self.scheduler.storage.get_recent_prices(limit=per_source * 10)
+        except Exception as e:
+            logging.getLogger(__name__).warning("载入最近价格失败: %s", e)
+            return
+        self.state.load(records)
+
+    def _render_header(self):
+        from rich.panel import Panel
+        from rich.text import Text
+
+        state = self.state
+        uptime = int(time.monotonic() - self.started)
+        text = Text()
+        text.append(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), style='bold')
+        text.append(f"   运行 {uptime // 3600:02d}:{uptime % 3600 // 60:02d}:{uptime % 60:02d}")
+        text.append(f"   间隔 {self.scheduler.interval_minutes} 分钟")
+        text.append(f"   获取 {state.ticks} 次")
+        if state.failed_ticks:
+            text.append(f"（失败 {state.failed_ticks} 次）", style='red')
+        text.append(f"   帧数 {self.frames}")
+        if state.last_error:
+            text.append(f"\n最近错误: {state.last_error}", style='red')
+        return Panel(text, title='水贝金价实时看板')
+
+    def _render_prices(self):
+        from rich.panel import Panel
+        from rich.table import Table
+
+        table = Table(expand=True, box=None)
+        table.add_column('数据源')
+        table.add_column('最新价(元/克)', justify='right')
+        table.add_column('涨跌', justify='right')
+        table.add_column('走势')
+        table.add_column('时间', justify='right')
+        for name, source in sorted(self.state.sources.items()):
+            if source.last_price is None:
+                continue
+            change = ''
+            # 国内行情习惯：红涨绿跌
+            style = 'white'
+            if source.previous_price is not None:
+                delta = source.last_price - source.previous_price
+                style = 'red' if delta > 0 else 'green' if delta < 0 else 'white'
+                change = f"{delta:+.2f}"
+            timestamp = (source.last_timestamp or '')[11:19]
+            table.add_row(name, f"{source.last_price:.2f}", f"[{style}]{change}[/]",
+                          f"[{style}]{sparkline(list(source.prices), self.state.history)}[/]", timestamp)
+        return Panel(table, title='最新价格')
+
+    def _render_stats(self):
+        from rich.panel import Panel
+        from rich.table import Table
+
+        table = Table(expand=True, box=None)
+        for column in ('数据源', '窗口均值', '最低', '最高', '标准差', '本次样本'):
+            table.add_column(column, justify='left' if column == '数据源' else 'right')
+        for name, source in sorted(self.state.sources.items()):
+            if not source.prices:
+                continue
+            window = np.fromiter(source.prices, dtype=float)
+            table.add_row(name, f"{window.mean():.2f}", f"{window.min():.2f}", f"{window.max():.2f}",
+                          f"{window.std():.2f}", str(source.session.count))
+        return Panel(table, title=f'滚动统计（最近 {self.state.history} 个价格）')
+
+    def _render_health(self):
+        from rich.panel import Panel
+        from rich.table import Table
+
+        table = Table(expand=True, box=None)
+        for column in ('数据源', '状态', '成功', '失败', '限流', '耗时(ms)', '最近'):
+            table.add_column(column, justify='left' if column in ('数据源', '状态') else 'right')
+        icons = {'ok': '[green]正常[/]', 'no_price': '[yellow]无价格[/]',
+                 'throttled': '[yellow]限流[/]', 'error': '[red]失败[/]'}
+        for name, source in sorted(self.state.sources.items()):
+            if source.last_outcome is None:
+                continue
+            status = icons.get(source.last_outcome, source.last_outcome)
+            if source.consecutive_failures > 1:
+                status += f" ×{source.consecutive_failures}"
+            latency = f"{source.latency_ms:.0f}" if source.latency_ms is not None else '-'
+            table.add_row(name, status, str(source.ok), str(source.failed), str(source.throttled),
+                          latency, source.last_seen or '')
+        return Panel(table, title='数据源健康')
+
+    def _build_layout(self):
+        from rich.layout import Layout
+
+        layout = Layout()
+        layout.split_column(Layout(name='header', size=4), Layout(name='prices', ratio=1),
+                            Layout(name='bottom', ratio=1))
+        layout['bottom'].split_row(Layout(name='stats'), Layout(name='health'))
+        return layout
+
+    def _scheduler_alive(self) -> bool:
+        thread = self.scheduler.scheduler_thread
+        return thread is None or thread.is_alive()
+
+    def run(self):
+        """显示看板直到调度器停止或 stop()（阻塞）"""
+        from rich.console import Console
+        from rich.live import Live
+
+        renderers = {'header': self._render_header, 'prices': self._render_prices,
+                     'stats': self._render_stats, 'health': self._render_health}
+        frame_interval = 1.0 / self.fps
+        layout = self._build_layout()
+        last_frame = 0.0
+        last_second = None
+
+        root = logging.getLogger()
+        root.addHandler(self._handler)
+        try:
+            # 看板直接写入原来的终端；其他模块逐条打印的信息（例如"价格数据已保存"）
+            # 在看板运行期间丢弃，避免破坏画面
+            console = Console(file=sys.stdout)
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), \
+                    Live(layout, console=console, auto_refresh=False, screen=True,
+                         redirect_stdout=False, redirect_stderr=False) as live:
+                while not self._stop.is_set() and self._scheduler_alive():
+                    # 没有事件时最多等 1 秒（更新时钟）
+                    self.state.changed.wait(timeout=1.0)
+                    wait = last_frame + frame_interval - time.monotonic()
+                    if wait > 0:
+                        # 限制帧率：等待期间到达的事件合并到同一帧
+                        time.sleep(wait)
+
+                    dirty = self.state.take_dirty()
+                    second = int(time.time())
+                    if second != last_second:
+                        dirty.add('header')
+                        last_second = second
+                    with self.state._lock:
+                        for name in dirty:
+                            layout[name].update(renderers[name]())
+                    live.refresh()
+                    self.frames += 1
+                    last_frame = time.monotonic()
+        finally:
+            root.removeHandler(self._handler)
+
+    def stop(self):
+        self._stop.set()
+        self.state.changed.set()
+
+
+def run_dashboard(interval_minutes: int = 1, jitter_seconds: Optional[float] = None, scraper=None,
+                  fps: float = DEFAULT_FPS, history: int = DEFAULT_HISTORY, socket_path: Optional[str] = None,
+                  durability: str = DEFAULT_DURABILITY):
+    """启动定时监控并显示实时看板（阻塞）"""
+    try:
+        import rich  # noqa: F401
+    except ImportError:
+        print("❌ 看板需要 rich 库，请先运行: pip install rich")
+        return
+
+    from scheduler import GoldPriceScheduler
+
+    scheduler = GoldPriceScheduler(interval_minutes=interval_minutes, scraper=scraper,
+                                   jitter_seconds=jitter_seconds, socket_path=socket_path, durability=durability)
+    # 看板占用整个终端，调度器不再逐次打印
+    scheduler.echo = False
+    dashboard = PriceDashboard(scheduler, history=history, fps=fps)
+    dashboard.load_history(history)
+    scheduler.add_listener(dashboard.state.on_tick)
+
+    try:
+        scheduler.start()
+        dashboard.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dashboard.stop()
+        scheduler.stop()
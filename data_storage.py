@@ -1,17 +1,100 @@
 import json
 import csv
 import os
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict
+from typing import Dict, Iterator, List, Optional
 import pandas as pd
 
+from recent_cache import RECORD_START, RecentPriceCache, read_csv_tail
+from segment_store import SegmentStore, filter_frame
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，退化为不加锁
+    fcntl = None
+
+# CSV 文件的列顺序
+CSV_COLUMNS = ['timestamp', 'source', 'price', 'raw_text', 'error', 'note']
+
+# JSON 文件只作为最近记录的快速读取缓存，完整历史保存在 CSV 和压缩分段中
+JSON_RECENT_LIMIT = 1000
+
+# 写入的持久化模式：
+#   none    不调用 fsync，由操作系统决定何时落盘（进程崩溃不丢数据，断电或宕机可能丢失最近的写入）
+#   group   组提交：每 commit_interval_ms 毫秒或每 commit_records 条记录统一 fsync 一次，
+#           宕机时最多丢失一个提交窗口内的记录
+#   strict  每次写入返回前 fsync，写入返回即已落盘
+DURABILITY_MODES = ('none', 'group', 'strict')
+DEFAULT_DURABILITY = 'group'
+
+# 组提交的时间窗口（毫秒）和记录数上限
+GROUP_COMMIT_INTERVAL_MS = 200
+GROUP_COMMIT_RECORDS = 100
+
+# 写前日志超过该大小时把其中的记录合并进 JSON 文件（检查点）
+WAL_CHECKPOINT_BYTES = 256 * 1024
+
+
+def _fsync_path(path: str):
+    """把文件（或目录）已写入的内容刷到磁盘"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # Windows 不能以这种方式打开目录
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _record_key(record: Dict):
+    return str(record.get('timestamp')), str(record.get('source'))
+
+
+def timestamp_keys(timestamps: pd.Series) -> List[int]:
+    """把时间戳列转换为纳秒整数列表，作为去重键的一部分"""
+    return pd.to_datetime(timestamps, format='ISO8601').to_numpy().astype('datetime64[ns]').astype('int64').tolist()
+
+
 class GoldPriceStorage:
     """黄金价格数据存储类"""
 
-    def __init__(self, data_dir: str = "data"):
+    def __init__(self, data_dir: str = "data", durability: str = DEFAULT_DURABILITY,
+                 commit_interval_ms: float = GROUP_COMMIT_INTERVAL_MS, commit_records: int = GROUP_COMMIT_RECORDS):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"不支持的持久化模式: {durability}")
         self.data_dir = data_dir
         self.json_file = os.path.join(data_dir, "gold_prices.json")
         self.csv_file = os.path.join(data_dir, "gold_prices.csv")
+        # 写前日志：CSV 之外再追加一份完整记录，JSON 文件只在检查点时整体重写（临时文件 + 原子重命名）
+        self.wal_file = os.path.join(data_dir, "gold_prices.wal")
+        # 多进程写入时使用的文件锁
+        self.lock_file = os.path.join(data_dir, ".gold_prices.lock")
+        # 写入者存活标记：写过数据、尚未关闭的存储持有它的共享锁（进程退出时由内核释放），
+        # 启动时据此区分"仍在运行的写入者的写前日志"和"崩溃留下的写前日志"
+        self.writer_file = os.path.join(data_dir, ".gold_prices.writer")
+        self._writer_handle = None
+        # 已结束日期的历史数据轮转为按天的压缩分段
+        self.segments = SegmentStore(os.path.join(data_dir, "segments"))
+
+        # 最近记录的内存缓存（每个数据源一个环形缓冲区），写入时更新，首次读取时从 CSV 末尾预热
+        self.recent = RecentPriceCache(self.csv_file, CSV_COLUMNS, capacity=JSON_RECENT_LIMIT,
+                                       older_records=self._segment_tail_records)
+
+        self.durability = durability
+        self.commit_interval = commit_interval_ms / 1000.0
+        self.commit_records = commit_records
+        # 组提交：尚未 fsync 的记录数、最早一条的时间，以及后台提交线程
+        self._pending = 0
+        self._pending_since: Optional[float] = None
+        self._commit_cond = threading.Condition()
+        self._committer: Optional[threading.Thread] = None
+        self._closed = False
+        self.commits = 0
 
         # 确保数据目录存在
         os.makedirs(data_dir, exist_ok=True)
@@ -19,6 +102,9 @@ class GoldPriceStorage:
         # 初始化数据文件
         self._initialize_files()
 
+        # 上次没有正常退出时修复残留的半行数据和写前日志
+        self._recover()
+
     def _initialize_files(self):
         """初始化数据文件"""
         # JSON文件初始化
@@ -30,109 +116,517 @@ class GoldPriceStorage:
         if not os.path.exists(self.csv_file):
             with open(self.csv_file, 'w', encoding='utf-8', newline='') as f:
                 writer = csv.writer(f)
-                writer.writerow([
-                    'timestamp', 'source', 'price', 'raw_text', 'error', 'note'
-                ])
+                writer.writerow(CSV_COLUMNS)
+
+    @contextmanager
+    def write_lock(self):
+        """跨进程的排他写锁，保护 JSON 的读-改-写和 CSV 追加"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
 
     def save_price_data(self, price_data: Dict):
         """保存价格数据到所有格式"""
         # 添加保存时间戳
         price_data['saved_at'] = datetime.now().isoformat()
 
-        # 保存到JSON
-        self._save_to_json(price_data)
-
-        # 保存到CSV
-        self._save_to_csv(price_data)
+        self._append_records([price_data])
 
         print(f"价格数据已保存: {price_data.get('price', 'N/A')}元/克")
 
-    def _save_to_json(self, price_data: Dict):
-        """保存数据到JSON文件"""
+    def save_price_batch(self, records: List[Dict], skip_existing: bool = False):
+        """批量保存多条价格数据：CSV 和写前日志各追加一次
+
+        skip_existing 为真时跳过最近记录中已有相同 (timestamp, source) 的记录
+        （接收服务确认超时后重复提交的同一批记录）。
+        """
+        if not records:
+            return
+
+        saved_at = datetime.now().isoformat()
+        for record in records:
+            record['saved_at'] = saved_at
+
+        self._append_records(records, skip_existing)
+
+    def _append_records(self, records: List[Dict], skip_existing: bool = False):
+        """追加记录到 CSV 和写前日志，按持久化模式提交，写前日志较大时做一次检查点"""
+        with self.write_lock():
+            self.recent.sync()
+            if skip_existing:
+                # 在写锁内检查，检查和写入之间不会有其他写入者插入同一条记录
+                existing = {source: self.recent.timestamps(source)
+                            for source in {str(record.get('source')) for record in records}}
+                records = [record for record in records
+                           if str(record.get('timestamp')) not in existing[str(record.get('source'))]]
+                if not records:
+                    return
+
+            # 保存到CSV
+            self._save_to_csv(records)
+
+            self._mark_writer()
+
+            # 完整记录追加到写前日志，之后合并进 JSON
+            try:
+                with open(self.wal_file, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(record, ensure_ascii=False, default=str) + '\n'
+                                    for record in records))
+                    wal_size = f.tell()
+            except Exception as e:
+                print(f"保存到写前日志失败: {e}")
+                wal_size = 0
+
+            self.recent.on_write(records)
+
+            if self.durability == 'strict':
+                self._fsync_data()
+            if wal_size >= WAL_CHECKPOINT_BYTES:
+                self._checkpoint()
+
+        if self.durability == 'group':
+            self._schedule_commit(len(records))
+
+    def _fsync_data(self):
+        """把 CSV 和写前日志刷到磁盘"""
+        _fsync_path(self.csv_file)
+        _fsync_path(self.wal_file)
+        self.commits += 1
+
+    def _schedule_commit(self, count: int):
+        """组提交：攒够 commit_records 条时立即提交，否则由后台线程在时间窗口结束时提交"""
+        with self._commit_cond:
+            self._pending += count
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            if self._pending < self.commit_records:
+                if self._committer is None or not self._committer.is_alive():
+                    self._committer = threading.Thread(target=self._commit_loop, daemon=True)
+                    self._committer.start()
+                self._commit_cond.notify()
+                return
+            self._pending = 0
+            self._pending_since = None
+        self._fsync_data()
+
+    def _commit_loop(self):
+        """后台提交线程：每个时间窗口对窗口内的全部写入只 fsync 一次"""
+        with self._commit_cond:
+            while not self._closed:
+                if self._pending_since is None:
+                    self._commit_cond.wait()
+                    continue
+                remaining = self._pending_since + self.commit_interval - time.monotonic()
+                if remaining > 0:
+                    self._commit_cond.wait(remaining)
+                    continue
+                self._pending = 0
+                self._pending_since = None
+                self._commit_cond.release()
+                try:
+                    self._fsync_data()
+                except OSError as e:
+                    print(f"提交写入失败: {e}")
+                finally:
+                    self._commit_cond.acquire()
+
+    def _read_wal(self) -> List[Dict]:
+        """读取写前日志中的完整记录（宕机时最后一行可能不完整，忽略）"""
+        records = []
+        try:
+            with open(self.wal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+        except FileNotFoundError:
+            pass
+        return records
+
+    def _load_json(self) -> List[Dict]:
+        """读取 JSON 文件；文件损坏时从 CSV 末尾重建"""
         try:
-            # 读取现有数据
             with open(self.json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            # 添加新数据
-            data.append(price_data)
-
-            # 只保留最近1000条记录以避免文件过大
-            if len(data) > 1000:
-                data = data[-1000:]
-
-            # 写回文件
-            with open(self.json_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+        except ValueError:
+            print("⚠️ JSON文件已损坏，从CSV重建最近记录")
+            return read_csv_tail(self.csv_file, JSON_RECENT_LIMIT, CSV_COLUMNS)[0]
+
+    def _write_json(self, data: List[Dict]):
+        """原子地重写 JSON 文件：写临时文件后重命名，读者不会看到写了一半的文件"""
+        tmp_file = self.json_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            if self.durability != 'none':
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, self.json_file)
+        if self.durability != 'none':
+            _fsync_path(self.data_dir)
+
+    def _checkpoint(self):
+        """把写前日志中的记录合并进 JSON 文件，然后清空写前日志（需持有写锁）
+
+        JSON 已写入但写前日志还没清空时宕机，恢复时重复的记录按 (timestamp, source) 去除。
+        """
+        records = self._read_wal()
+        if records:
+            data = self._load_json()
+            existing = {_record_key(record) for record in data[-JSON_RECENT_LIMIT:]}
+            data.extend(record for record in records if _record_key(record) not in existing)
+            self._write_json(data[-JSON_RECENT_LIMIT:])
+        if os.path.exists(self.wal_file):
+            with open(self.wal_file, 'w', encoding='utf-8'):
+                pass
+
+    def _mark_writer(self):
+        """首次写入时持有写入者存活标记的共享锁（需持有写锁）"""
+        if fcntl is None or self._writer_handle is not None:
+            return
+        handle = open(self.writer_file, 'a')
+        fcntl.flock(handle, fcntl.LOCK_SH)
+        self._writer_handle = handle
+
+    def _release_writer(self):
+        """写前日志已合并，释放写入者存活标记"""
+        if self._writer_handle is not None:
+            fcntl.flock(self._writer_handle, fcntl.LOCK_UN)
+            self._writer_handle.close()
+            self._writer_handle = None
+
+    def _live_writer(self) -> bool:
+        """是否有尚未关闭的写入者（本进程或其他进程）；不支持文件锁时视为没有"""
+        if fcntl is None:
+            return False
+        with open(self.writer_file, 'a') as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return True
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        return False
+
+    def _recover(self):
+        """启动时的崩溃恢复：删除残留的临时文件，截掉 CSV 末尾写了一半的记录，重放写前日志"""
+        with self.write_lock():
+            for tmp_file in (self.json_file + '.tmp', self.csv_file + '.tmp'):
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+
+            size = os.path.getsize(self.csv_file)
+            if size:
+                with open(self.csv_file, 'rb+') as f:
+                    f.seek(max(0, size - 64 * 1024))
+                    tail = f.read()
+                    if not tail.endswith(b'\n'):
+                        # 最后一条记录不完整：截断到它的开头（记录以时间戳开头）
+                        starts = [match.start() + 1 for match in RECORD_START.finditer(tail)]
+                        cut = starts[-1] if starts else tail.rfind(b'\n') + 1
+                        f.truncate(size - len(tail) + cut)
+                        if size - len(tail) + cut == 0:
+                            f.seek(0)
+                            f.write((','.join(CSV_COLUMNS) + '\n').encode('utf-8'))
+                        print(f"🔧 已截掉CSV文件末尾不完整的记录（{len(tail) - cut} 字节）")
+
+            # 写前日志属于仍在运行的写入者时不是崩溃，由它在检查点或关闭时合并
+            replayed = len(self._read_wal())
+            if replayed and not self._live_writer():
+                self._checkpoint()
+                print(f"🔧 已从写前日志恢复 {replayed} 条记录到JSON文件")
+
+    def close(self):
+        """提交尚未落盘的写入，把写前日志合并进 JSON 文件"""
+        with self._commit_cond:
+            self._closed = True
+            pending = self._pending
+            self._pending = 0
+            self._pending_since = None
+            self._commit_cond.notify_all()
+        if self._committer is not None:
+            self._committer.join(timeout=5)
+        # 之后仍可继续写入，提交线程在需要时重新启动
+        with self._commit_cond:
+            self._closed = False
+            self._committer = None
+        with self.write_lock():
+            self._checkpoint()
+            if pending or self.durability != 'none':
+                self._fsync_data()
+            self._release_writer()
+
+    def load_record_keys(self) -> set:
+        """读取已存储记录（含压缩分段）的 (时间戳纳秒, 数据源) 键集合，用于批量导入去重"""
+        keys = set()
+        try:
+            frames = [self.segments.read_segment(entry, ['timestamp', 'source'])
+                      for entry in self.segments.load_index()]
+            frames.append(pd.read_csv(self.csv_file, usecols=['timestamp', 'source']))
         except Exception as e:
-            print(f"保存到JSON文件失败: {e}")
-
-    def _save_to_csv(self, price_data: Dict):
-        """保存数据到CSV文件"""
+            print(f"读取已有记录失败: {e}")
+            return keys
+
+        for df in frames:
+            valid = pd.to_datetime(df['timestamp'], errors='coerce', format='ISO8601').notna()
+            keys.update(zip(timestamp_keys(df.loc[valid, 'timestamp']),
+                            df.loc[valid, 'source'].astype(str).tolist()))
+        return keys
+
+    @staticmethod
+    def filter_new_keys(timestamps: List[int], sources: List[str], known_keys: set) -> List[bool]:
+        """返回每条记录是否为新记录的掩码，并把新记录的键加入 known_keys（批内重复同样会被去除）"""
+        keep = []
+        for key in zip(timestamps, sources):
+            if key in known_keys:
+                keep.append(False)
+            else:
+                known_keys.add(key)
+                keep.append(True)
+        return keep
+
+    def write_history(self, df: pd.DataFrame) -> int:
+        """写入补录的历史记录（CSV_COLUMNS 列），返回写入的记录数
+
+        早于今天的记录按天直接写成压缩分段，不经过 CSV；今天的记录与 CSV 合并后按时间重写，
+        CSV 末尾始终是最新的记录（当前价格、最近记录缓存都依赖这一点）。
+        """
+        if df.empty:
+            return 0
+        cutoff = pd.Timestamp(datetime.now().date())
+        timestamps = pd.to_datetime(df['timestamp'], errors='coerce', format='ISO8601')
+        df = df[timestamps.notna()]
+        timestamps = timestamps[timestamps.notna()]
+        old = timestamps < cutoff
+
+        with self.write_lock():
+            days = timestamps[old].dt.strftime('%Y-%m-%d')
+            self.segments.write_segments((day, rows[CSV_COLUMNS]) for day, rows in df[old].groupby(days, sort=True))
+
+            if not old.all():
+                current = pd.read_csv(self.csv_file, dtype=str, keep_default_na=False)
+                merged = pd.concat([current, df.loc[~old, CSV_COLUMNS].astype(str)], ignore_index=True)
+                order = pd.to_datetime(merged['timestamp'], errors='coerce', format='ISO8601')
+                merged = merged.iloc[order.argsort(kind='stable')]
+                tmp_file = self.csv_file + '.tmp'
+                merged.to_csv(tmp_file, index=False, encoding='utf-8')
+                os.replace(tmp_file, self.csv_file)
+        return len(df)
+
+    def _save_to_csv(self, records: List[Dict]):
+        """追加数据到CSV文件"""
         try:
             with open(self.csv_file, 'a', encoding='utf-8', newline='') as f:
                 writer = csv.writer(f)
-                writer.writerow([
-                    price_data.get('timestamp', ''),
-                    price_data.get('source', ''),
-                    price_data.get('price', ''),
-                    price_data.get('raw_text', ''),
-                    price_data.get('error', ''),
-                    price_data.get('note', '')
-                ])
+                writer.writerows([record.get(column, '') for column in CSV_COLUMNS] for record in records)
 
         except Exception as e:
             print(f"保存到CSV文件失败: {e}")
 
-    def get_recent_prices(self, limit: int = 10) -> List[Dict]:
-        """获取最近的价格数据"""
+    def get_recent_prices(self, limit: int = 10, source: Optional[str] = None) -> List[Dict]:
+        """获取最近的价格数据（来自内存缓存，可只取一个数据源）"""
         try:
-            with open(self.json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            return data[-limit:]
+            return self.recent.recent(limit, source)
 
         except Exception as e:
             print(f"读取价格数据失败: {e}")
             return []
 
+    def _segment_tail_records(self, limit: int) -> List[Dict]:
+        """最新几个压缩分段中的最后 limit 条记录（CSV 刚轮转、记录不够预热时使用）"""
+        frames = []
+        count = 0
+        for entry in reversed(self.segments.load_index()):
+            if count >= limit:
+                break
+            df = self.segments.read_segment(entry, dtype=str, keep_default_na=False)
+            frames.insert(0, df)
+            count += len(df)
+        if not frames:
+            return []
+        df = pd.concat(frames, ignore_index=True).tail(limit).reindex(columns=CSV_COLUMNS)
+        prices = pd.to_numeric(df['price'], errors='coerce').tolist()
+        records = df.astype(object).where(df != '', None).to_dict('records')
+        for record, price in zip(records, prices):
+            record['price'] = None if pd.isna(price) else float(price)
+        return records
+
+    def get_data_version(self) -> str:
+        """返回历史数据的版本标识（CSV 文件和分段索引的修改时间和大小），数据变化时版本随之变化"""
+        try:
+            stat = os.stat(self.csv_file)
+            csv_version = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        except OSError:
+            csv_version = "0-0"
+        return f"{self.segments.get_version()}-{csv_version}"
+
+    def iter_price_chunks(self, start: Optional[str] = None, end: Optional[str] = None,
+                          source: Optional[str] = None, chunksize: int = 50000) -> Iterator[pd.DataFrame]:
+        """按块读取历史数据，并按时间范围和数据源过滤，避免一次性载入全部数据
+
+        先按索引读取相关的压缩分段（按时间顺序），再读取尚未轮转的 CSV。
+        """
+        yield from self.segments.query(start, end, source)
+
+        start_ts = pd.to_datetime(start) if start else None
+        end_ts = pd.to_datetime(end) if end else None
+
+        for chunk in pd.read_csv(self.csv_file, chunksize=chunksize):
+            if chunk.empty:
+                continue
+            chunk = filter_frame(chunk, start_ts, end_ts, source)
+            if not chunk.empty:
+                yield chunk
+
+    def read_history(self, start: Optional[str] = None, end: Optional[str] = None,
+                     source: Optional[str] = None) -> pd.DataFrame:
+        """读取（过滤后的）全部历史数据为一个数据表"""
+        chunks = list(self.iter_price_chunks(start, end, source))
+        if not chunks:
+            return pd.DataFrame(columns=CSV_COLUMNS)
+        return pd.concat(chunks, ignore_index=True)
+
+    def rotate_segments(self, before: Optional[str] = None) -> Dict:
+        """把 CSV 中早于 before（默认今天零点）的数据按天轮转为压缩分段，CSV 只保留之后的数据
+
+        分段写入完成后才重写 CSV，中途失败不会丢失数据。
+        """
+        cutoff = pd.Timestamp(before) if before else pd.Timestamp(datetime.now().date())
+        with self.write_lock():
+            # 按字符串读取，分段中保留原始格式
+            df = pd.read_csv(self.csv_file, dtype=str, keep_default_na=False)
+            timestamps = pd.to_datetime(df['timestamp'], errors='coerce', format='ISO8601')
+            old = timestamps.notna() & (timestamps < cutoff)
+            if not old.any():
+                return {'segments': 0, 'records': 0, 'remaining': len(df)}
+
+            days = timestamps[old].dt.strftime('%Y-%m-%d')
+            written = self.segments.write_segments(df[old].groupby(days, sort=True))
+
+            remaining = df[~old]
+            tmp_file = self.csv_file + '.tmp'
+            remaining.to_csv(tmp_file, index=False, encoding='utf-8')
+            os.replace(tmp_file, self.csv_file)
+
+        return {
+            'segments': len(written),
+            'records': sum(entry['count'] for entry in written),
+            'compressed_bytes': sum(entry['bytes'] for entry in written),
+            'remaining': len(remaining)
+        }
+
+    def replace_records(self, records: List[Dict]) -> Dict:
+        """按 (timestamp, source) 更新已存储记录的 price/raw_text/error/note，找不到的记录追加到 CSV
+
+        用于离线重新提取后修复历史数据；涉及的压缩分段会整体重写为新的分段。
+        """
+        if not records:
+            return {'updated': 0, 'inserted': 0}
+
+        keys = list(zip(timestamp_keys(pd.Series([record['timestamp'] for record in records])),
+                        [str(record['source']) for record in records]))
+        updates = dict(zip(keys, records))
+        matched = set()
+        fields = ['price', 'raw_text', 'error', 'note']
+
+        def apply(df: pd.DataFrame) -> bool:
+            """就地更新命中的行，返回是否有改动"""
+            valid = pd.to_datetime(df['timestamp'], errors='coerce', format='ISO8601').notna()
+            row_keys = zip(timestamp_keys(df.loc[valid, 'timestamp']), df.loc[valid, 'source'].tolist())
+            hits = [(index, key) for index, key in zip(df.index[valid], row_keys) if key in updates]
+            for index, key in hits:
+                matched.add(key)
+                record = updates[key]
+                for field in fields:
+                    value = record.get(field)
+                    df.at[index, field] = '' if value is None else str(value)
+            return bool(hits)
+
+        days = {str(record['timestamp'])[:10] for record in records}
+        sources = {key[1] for key in keys}
+        with self.write_lock():
+            for entry in self.segments.load_index():
+                if entry['day'] not in days or not sources.intersection(entry['sources']):
+                    continue
+                df = self.segments.read_segment(entry, dtype=str, keep_default_na=False)
+                if apply(df):
+                    self.segments.replace_segment(entry, df)
+
+            df = pd.read_csv(self.csv_file, dtype=str, keep_default_na=False)
+            apply(df)
+            inserted = [updates[key] for key in keys if key not in matched]
+            if inserted:
+                df = pd.concat([df, pd.DataFrame(
+                    [['' if record.get(column) is None else str(record.get(column)) for column in CSV_COLUMNS]
+                     for record in inserted], columns=CSV_COLUMNS
+                )], ignore_index=True)
+            tmp_file = self.csv_file + '.tmp'
+            df.to_csv(tmp_file, index=False, encoding='utf-8')
+            os.replace(tmp_file, self.csv_file)
+
+            # 最近记录缓存中的对应记录同步更新
+            try:
+                self._checkpoint()
+                data = self._load_json()
+                json_keys = timestamp_keys(pd.Series([record.get('timestamp') for record in data], dtype=object)) \
+                    if data else []
+                for record, ts_key in zip(data, json_keys):
+                    update = updates.get((ts_key, str(record.get('source'))))
+                    if update is not None:
+                        record.update({field: update.get(field) for field in fields})
+                self._write_json(data)
+            except Exception as e:
+                print(f"更新JSON文件失败: {e}")
+
+        return {'updated': len(matched), 'inserted': len(inserted)}
+
     def get_price_statistics(self) -> Dict:
         """获取价格统计信息"""
         try:
-            # 使用pandas读取CSV文件进行统计分析
-            df = pd.read_csv(self.csv_file)
-
-            # 过滤有效价格数据
-            valid_prices = df[df['price'].notna() & (df['price'] != '')]
+            # 按天分区并行计算部分聚合后合并，不可变分区的结果有缓存
+            from partitioned_exec import PartitionedExecutor
+            return PartitionedExecutor(self).statistics()
 
-            if len(valid_prices) == 0:
-                return {
-                    'total_records': len(df),
-                    'valid_price_records': 0,
-                    'message': '没有有效的价格数据'
-                }
+        except Exception as e:
+            print(f"生成统计信息失败: {e}")
+            return {'error': str(e)}
 
-            # 转换价格列为数值类型
-            valid_prices['price'] = pd.to_numeric(valid_prices['price'])
+    @staticmethod
+    def compute_statistics(df: pd.DataFrame) -> Dict:
+        """对一个价格数据表计算统计信息"""
+        # 过滤有效价格数据
+        valid_prices = df[df['price'].notna() & (df['price'] != '')].copy()
 
-            stats = {
+        if len(valid_prices) == 0:
+            return {
                 'total_records': len(df),
-                'valid_price_records': len(valid_prices),
-                'current_price': valid_prices['price'].iloc[-1],
-                'min_price': valid_prices['price'].min(),
-                'max_price': valid_prices['price'].max(),
-                'avg_price': valid_prices['price'].mean(),
-                'price_std': valid_prices['price'].std(),
-                'data_sources': valid_prices['source'].value_counts().to_dict(),
-                'latest_update': valid_prices['timestamp'].iloc[-1]
+                'valid_price_records': 0,
+                'message': '没有有效的价格数据'
             }
 
-            return stats
-
-        except Exception as e:
-            print(f"生成统计信息失败: {e}")
-            return {'error': str(e)}
+        # 转换价格列为数值类型
+        valid_prices['price'] = pd.to_numeric(valid_prices['price'])
+
+        return {
+            'total_records': len(df),
+            'valid_price_records': len(valid_prices),
+            'current_price': valid_prices['price'].iloc[-1],
+            'min_price': valid_prices['price'].min(),
+            'max_price': valid_prices['price'].max(),
+            'avg_price': valid_prices['price'].mean(),
+            'price_std': valid_prices['price'].std(),
+            'data_sources': valid_prices['source'].value_counts().to_dict(),
+            'latest_update': valid_prices['timestamp'].iloc[-1]
+        }
 
     def export_to_excel(self, output_file: str = None):
         """导出数据到Excel文件"""
@@ -140,38 +634,52 @@ class GoldPriceStorage:
             output_file = os.path.join(self.data_dir, "gold_prices_export.xlsx")
 
         try:
-            df = pd.read_csv(self.csv_file)
-            df.to_excel(output_file, index=False)
-            print(f"数据已导出到: {output_file}")
+            # 分区并行解压，按时间顺序流式写入，不在内存中构建完整数据表
+            from partitioned_exec import PartitionedExecutor
+            exported = PartitionedExecutor(self).export_to_excel(output_file)
+            print(f"数据已导出到: {output_file}（{exported} 条记录）")
 
         except Exception as e:
             print(f"导出到Excel失败: {e}")
 
-    def clear_old_data(self, days: int = 30):
-        """清理指定天数前的旧数据"""
-        try:
-            df = pd.read_csv(self.csv_file)
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
+    def delete_before(self, cutoff) -> int:
+        """删除时间早于 cutoff 的数据，返回删除的记录数
 
-            cutoff_date = datetime.now() - pd.Timedelta(days=days)
-            filtered_df = df[df['timestamp'] >= cutoff_date]
+        压缩分段中早于 cutoff 的记录也会被删除（跨越 cutoff 的分段会被重写）；CSV 和最近记录缓存逐条过滤。
+        """
+        cutoff = pd.Timestamp(cutoff)
+        with self.write_lock():
+            removed = self.segments.drop_before(cutoff)
 
-            # 保存过滤后的数据
-            filtered_df.to_csv(self.csv_file, index=False)
+            # 按字符串读取，保留的记录格式保持不变
+            df = pd.read_csv(self.csv_file, dtype=str, keep_default_na=False)
+            keep = pd.to_datetime(df['timestamp'], format='ISO8601', errors='coerce') >= cutoff
+            if not keep.all():
+                tmp_file = self.csv_file + '.tmp'
+                df[keep].to_csv(tmp_file, index=False, encoding='utf-8')
+                os.replace(tmp_file, self.csv_file)
+                removed += int((~keep).sum())
 
             # 同时更新JSON文件
-            with open(self.json_file, 'r', encoding='utf-8') as f:
-                json_data = json.load(f)
+            self._checkpoint()
+            json_data = self._load_json()
 
             filtered_json = [
                 record for record in json_data
-                if pd.to_datetime(record['timestamp']) >= cutoff_date
+                if pd.to_datetime(record['timestamp']) >= cutoff
             ]
 
-            with open(self.json_file, 'w', encoding='utf-8') as f:
-                json.dump(filtered_json, f, ensure_ascii=False, indent=2)
+            if len(filtered_json) != len(json_data):
+                self._write_json(filtered_json)
 
-            print(f"已清理 {days} 天前的数据，剩余 {len(filtered_df)} 条记录")
+        return removed
+
+    def clear_old_data(self, days: int = 30):
+        """清理指定天数前的旧数据"""
+        try:
+            cutoff_date = datetime.now() - pd.Timedelta(days=days)
+            removed = self.delete_before(cutoff_date)
+            print(f"已清理 {days} 天前的数据，共删除 {removed} 条记录")
 
         except Exception as e:
             print(f"清理数据失败: {e}")
@@ -179,18 +687,21 @@ class GoldPriceStorage:
     def clear_all_data(self):
         """清除所有历史数据"""
         try:
-            # 清空JSON文件
-            with open(self.json_file, 'w', encoding='utf-8') as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
+            with self.write_lock():
+                # 清空JSON文件和写前日志
+                self._write_json([])
+                with open(self.wal_file, 'w', encoding='utf-8'):
+                    pass
 
-            # 清空CSV文件，只保留表头
-            with open(self.csv_file, 'w', encoding='utf-8', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    'timestamp', 'source', 'price', 'raw_text', 'error', 'note'
-                ])
+                # 删除所有压缩分段
+                self.segments.clear()
+
+                # 清空CSV文件，只保留表头
+                with open(self.csv_file, 'w', encoding='utf-8', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(CSV_COLUMNS)
 
-            print("✅ 已清除所有历史数据")
+                print("✅ 已清除所有历史数据")
 
         except Exception as e:
             print(f"清除数据失败: {e}")
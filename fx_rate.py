@@ -0,0 +1,210 @@
+"""
+汇率子系统
+提供带 TTL 缓存的汇率获取（后台线程刷新，价格获取路径永不阻塞在汇率请求上），
+本地固定汇率提供者（用于测试），以及批量历史美元价格的向量化换算
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import requests
+
+# 1 金衡盎司 = 31.1035 克
+GRAMS_PER_TROY_OUNCE = 31.1035
+
+# 没有任何可用汇率时使用的近似美元兑人民币汇率
+DEFAULT_USD_CNY_RATE = 7.2
+
+
+class FXRateProvider:
+    """汇率提供者基类"""
+
+    name = 'base'
+
+    def get_rate(self, base: str, quote: str) -> float:
+        """返回 1 单位 base 货币可兑换的 quote 货币数量"""
+        raise NotImplementedError
+
+
+class StaticFXRateProvider(FXRateProvider):
+    """固定汇率提供者（本地桩，用于测试和离线运行）"""
+
+    name = 'static'
+
+    def __init__(self, rates: Optional[Dict[Tuple[str, str], float]] = None):
+        self.rates = rates or {('USD', 'CNY'): DEFAULT_USD_CNY_RATE}
+        self.calls = 0
+
+    def get_rate(self, base: str, quote: str) -> float:
+        self.calls += 1
+        if (base, quote) in self.rates:
+            return self.rates[(base, quote)]
+        if (quote, base) in self.rates:
+            return 1.0 / self.rates[(quote, base)]
+        raise KeyError(f"没有 {base}/{quote} 的汇率")
+
+
+class OpenERAPIProvider(FXRateProvider):
+    """ExchangeRate-API 开放接口（无需密钥，每日更新）"""
+
+    name = 'open.er-api.com'
+
+    def __init__(self, session: Optional[requests.Session] = None, timeout: float = 5):
+        self.session = session or requests.Session()
+        self.timeout = timeout
+
+    def get_rate(self, base: str, quote: str) -> float:
+        response = self.session.get(f'https://open.er-api.com/v6/latest/{base}', timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        if data.get('result') != 'success' or quote not in data.get('rates', {}):
+            raise ValueError(f"汇率接口未返回 {base}/{quote}")
+        return float(data['rates'][quote])
+
+
+class FXRateCache:
+    """带 TTL 的汇率缓存，后台线程定期刷新
+
+    get_rate() 只读取内存中的缓存值，不会发起网络请求：
+    缓存为空时返回兜底汇率并触发一次后台刷新；缓存过期时继续返回旧值并标记为过期。
+    """
+
+    def __init__(self, provider: Optional[FXRateProvider] = None,
+                 ttl: float = 3600, refresh_interval: Optional[float] = None,
+                 pairs=(('USD', 'CNY'),), fallback_rates: Optional[Dict[Tuple[str, str], float]] = None):
+        self.provider = provider or OpenERAPIProvider()
+        self.ttl = ttl
+        # 默认在过期前刷新
+        self.refresh_interval = refresh_interval or ttl * 0.8
+        self.pairs = set(pairs)
+        self.fallback_rates = fallback_rates or {('USD', 'CNY'): DEFAULT_USD_CNY_RATE}
+
+        self._rates: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """启动后台刷新线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止后台刷新线程"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def refresh(self):
+        """同步刷新所有已登记的货币对"""
+        for pair in list(self.pairs):
+            try:
+                rate = self.provider.get_rate(*pair)
+                with self._lock:
+                    self._rates[pair] = (rate, time.time())
+                self.logger.info("汇率已更新 %s/%s = %s (%s)", pair[0], pair[1], rate, self.provider.name)
+            except Exception as e:
+                self.logger.warning("获取汇率 %s/%s 失败: %s", pair[0], pair[1], e)
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+
+    def get_rate(self, base: str = 'USD', quote: str = 'CNY') -> float:
+        """返回缓存的汇率（非阻塞）"""
+        return self.get_rate_info(base, quote)['rate']
+
+    def get_rate_info(self, base: str = 'USD', quote: str = 'CNY') -> Dict:
+        """返回汇率及其来源、更新时间和是否过期"""
+        pair = (base, quote)
+        with self._lock:
+            cached = self._rates.get(pair)
+            new_pair = pair not in self.pairs
+            self.pairs.add(pair)
+
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        elif new_pair:
+            self._wakeup.set()
+
+        if cached is None:
+            return {
+                'rate': self.fallback_rates.get(pair, float('nan')),
+                'source': 'fallback',
+                'updated_at': None,
+                'stale': True
+            }
+
+        rate, updated_at = cached
+        return {
+            'rate': rate,
+            'source': self.provider.name,
+            'updated_at': updated_at,
+            'stale': time.time() - updated_at > self.ttl
+        }
+
+
+_default_cache: Optional[FXRateCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_fx_cache() -> FXRateCache:
+    """进程内共享的默认汇率缓存"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = FXRateCache()
+        return _default_cache
+
+
+def usd_per_ounce_to_cny_per_gram(prices, rate):
+    """美元/盎司 -> 元/克，prices 和 rate 可以是标量或等长数组"""
+    return np.asarray(prices, dtype=float) * np.asarray(rate, dtype=float) / GRAMS_PER_TROY_OUNCE
+
+
+def convert_usd_ticks(ticks: pd.DataFrame, rates: Optional[pd.DataFrame] = None,
+                      rate: Optional[float] = None, price_column: str = 'price_usd') -> pd.DataFrame:
+    """批量换算历史美元/盎司报价为元/克
+
+    ticks 需要包含 timestamp 和 price_column 列；
+    提供 rates（timestamp, rate 两列）时，每条报价使用其时间点之前最近的汇率（as-of 对齐），
+    早于第一条汇率的报价使用最早的汇率，否则使用统一的 rate。
+    返回的行保持 ticks 的原有顺序和索引。
+    """
+    result = ticks.copy()
+    result['timestamp'] = pd.to_datetime(result['timestamp'])
+
+    if rates is not None and not rates.empty:
+        rate_table = rates[['timestamp', 'rate']].copy()
+        rate_table['timestamp'] = pd.to_datetime(rate_table['timestamp'])
+        rate_table = rate_table.sort_values('timestamp', kind='stable')
+        # merge_asof 要求按时间排序：记下原来的位置，对齐后恢复顺序
+        index = result.index
+        result['_order'] = np.arange(len(result))
+        result = pd.merge_asof(result.sort_values('timestamp', kind='stable'),
+                               rate_table.rename(columns={'rate': 'fx_rate'}),
+                               on='timestamp', direction='backward')
+        result = result.sort_values('_order').drop(columns='_order')
+        result.index = index
+        # 早于第一条汇率的报价使用最早的汇率
+        result['fx_rate'] = result['fx_rate'].fillna(rate_table['rate'].iloc[0])
+    else:
+        result['fx_rate'] = DEFAULT_USD_CNY_RATE if rate is None else rate
+
+    result['price'] = np.round(
+        usd_per_ounce_to_cny_per_gram(result[price_column].to_numpy(), result['fx_rate'].to_numpy()), 2
+    )
+    return result
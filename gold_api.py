@@ -2,97 +2,56 @@
 使用金融API获取真实黄金价格数据
 """
 
-import requests
 import json
 import logging
+import threading
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
-class GoldPriceAPI:
-    """黄金价格API类"""
-
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        })
-
-        # 公开的黄金价格API
-        self.api_endpoints = [
-            {
-                'name': 'Alpha Vantage黄金价格',
-                'url': 'https://www.alphavantage.co/query',
-                'params': {
-                    'function': 'GLOBAL_QUOTE',
-                    'symbol': 'GC=F',
-                    'apikey': 'demo'  # 免费API密钥，有调用限制
-                },
-                'parser': self._parse_alpha_vantage
-            },
-            {
-                'name': '金属价格API',
-                'url': 'https://api.metalpriceapi.com/v1/latest',
-                'params': {
-                    'api_key': 'demo',  # 需要注册获取真实API密钥
-                    'base': 'XAU',
-                    'currencies': 'CNY'
-                },
-                'parser': self._parse_metalpriceapi
-            }
-        ]
-
-    def _parse_alpha_vantage(self, data: dict) -> Optional[Dict]:
-        """解析Alpha Vantage API返回的数据"""
-        try:
-            if 'Global Quote' in data and data['Global Quote']:
-                quote = data['Global Quote']
-                price_usd = float(quote.get('05. price', 0))
-                # 简单汇率转换（实际应该使用实时汇率）
-                price_cny = price_usd * 7.2  # 近似汇率
-                return {
-                    'price': round(price_cny / 31.1035, 2),  # 转换为元/克
-                    'raw_data': quote
-                }
-        except Exception as e:
-            logging.error("解析Alpha Vantage数据失败: %s", e)
-        return None
+from fx_rate import FXRateCache, get_default_fx_cache
+from rate_limit import RateLimitedSession
+from source_registry import ESTIMATE_SUFFIXES, CompiledSource, SourceRegistry, get_registry
 
-    def _parse_metalpriceapi(self, data: dict) -> Optional[Dict]:
-        """解析MetalPriceAPI返回的数据"""
-        try:
-            if 'rates' in data and 'CNY' in data['rates']:
-                price_cny_per_oz = data['rates']['CNY']
-                price_cny_per_gram = price_cny_per_oz / 31.1035
-                return {
-                    'price': round(price_cny_per_gram, 2),
-                    'raw_data': data
-                }
-        except Exception as e:
-            logging.error("解析MetalPriceAPI数据失败: %s", e)
-        return None
+class GoldPriceAPI:
+    """黄金价格API类（API 数据源在 source_registry 中声明，group='api'）"""
+
+    def __init__(self, fx_cache: Optional[FXRateCache] = None, registry: Optional[SourceRegistry] = None,
+                 session: Optional[RateLimitedSession] = None):
+        # 汇率缓存默认在进程内共享，由后台线程刷新
+        self.fx_cache = fx_cache or get_default_fx_cache()
+        # 可以与其他获取器共用一个 Session（共用连接池和限流器）
+        if session is None:
+            session = RateLimitedSession()
+            session.headers.update({
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            })
+        self.session = session
+        self.registry = registry or get_registry()
+        # 按优先级排序的公开黄金价格API
+        self.sources: List[CompiledSource] = self.registry.group('api')
 
     def get_gold_price_from_api(self) -> Optional[Dict]:
-        """从API获取黄金价格"""
-        for api in self.api_endpoints:
+        """从API获取黄金价格（元/克，按声明的单位换算）"""
+        for source in self.sources:
             try:
-                logging.info("尝试从 %s 获取数据...", api['name'])
-                response = self.session.get(api['url'], params=api['params'], timeout=10)
-                response.raise_for_status()
-
-                data = response.json()
-                parsed_data = api['parser'](data)
+                logging.info("尝试从 %s 获取数据...", source.name)
+                parsed_data, _ = source.fetch(self.session, fx_cache=self.fx_cache)
 
                 if parsed_data:
-                    return {
-                        'source': api['name'],
+                    result = {
+                        'source': source.name,
                         'price': parsed_data['price'],
                         'timestamp': datetime.now().isoformat(),
                         'raw_data': parsed_data['raw_data'],
-                        'note': '国际黄金价格，仅供参考'
+                        'note': source.note or '国际黄金价格，仅供参考'
                     }
+                    if 'fx_rate' in parsed_data:
+                        result['fx_rate'] = parsed_data['fx_rate']
+                        result['fx_source'] = parsed_data['fx_source']
+                    return result
 
             except Exception as e:
-                logging.error("从 {api['name']} 获取数据失败: %s", e)
+                logging.error("从 %s 获取数据失败: %s", source.name, e)
                 continue
 
         return None
@@ -102,14 +61,14 @@ class GoldPriceAPI:
         api_price = self.get_gold_price_from_api()
 
         if api_price:
-            # 水贝金价通常比国际金价高一些（包含加工费、利润等）
-            shuibei_price = api_price['price'] * 1.08  # 增加8%作为估算
+            # 水贝金价通常比国际金价高一些（包含加工费、利润等），加价系数在数据源声明中配置
+            source = self.registry.get(api_price['source'])
             return {
-                'source': f"{api_price['source']} (估算)",
-                'price': round(shuibei_price, 2),
+                'source': api_price['source'] + ESTIMATE_SUFFIXES['api'],
+                'price': source.estimate(api_price['price']),
                 'timestamp': datetime.now().isoformat(),
                 'base_international_price': api_price['price'],
-                'markup_percentage': 8.0,
+                'markup_percentage': source.markup_percentage,
                 'note': '基于国际金价估算的水贝市场金价，实际价格可能有所不同'
             }
         else:
@@ -121,11 +80,23 @@ class GoldPriceAPI:
             }
 
 
+_default_api: Optional[GoldPriceAPI] = None
+_default_lock = threading.Lock()
+
+
+def get_default_api() -> GoldPriceAPI:
+    """进程内共享的金融 API 获取器（复用 Session 的连接池，不再每次调用都新建）"""
+    global _default_api
+    with _default_lock:
+        if _default_api is None:
+            _default_api = GoldPriceAPI()
+        return _default_api
+
+
 # 兼容原有接口的函数
 def get_real_gold_price():
     """获取真实黄金价格"""
-    api = GoldPriceAPI()
-    return api.get_shuibei_approximate_price()
+    return get_default_api().get_shuibei_approximate_price()
 
 
 if __name__ == "__main__":
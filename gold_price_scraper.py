@@ -1,27 +1,23 @@
-import requests
-from bs4 import BeautifulSoup
 import json
 import logging
+import time
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
-from real_gold_price import get_real_gold_price
+from real_gold_price import RealGoldPriceFetcher
+from rate_limit import RateLimitedSession, RateLimitExceeded
+from source_registry import CompiledSource, SourceRegistry, extract_price, get_registry
+
+logger = logging.getLogger(__name__)
+
+# 网页数据源在 source_registry.SOURCE_SPECS 中声明（group='web'），按 priority 依次尝试
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('gold_price.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 
 class ShuiBeiGoldPriceScraper:
     """水贝黄金价格爬虫类"""
 
-    def __init__(self):
-        self.session = requests.Session()
+    def __init__(self, raw_archive=None, registry: Optional[SourceRegistry] = None):
+        self.session = RateLimitedSession()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -30,170 +26,120 @@ class ShuiBeiGoldPriceScraper:
             'Connection': 'keep-alive',
         })
 
-        # 可能的水贝金价数据源
-        self.data_sources = [
-            {
-                'name': '上海黄金交易所',
-                'url': 'https://www.sge.com.cn/goldPrice',
-                'description': '上海黄金交易所官方价格'
-            },
-            {
-                'name': '中国黄金网',
-                'url': 'https://www.gold.org.cn/',
-                'description': '中国黄金网实时金价'
-            },
-            {
-                'name': '金投网-实时金价',
-                'url': 'https://quote.cngold.org/gold/cngold.html',
-                'description': '金投网实时金价'
-            }
-        ]
-
-    def get_shuibei_price_from_gold_org(self) -> Optional[Dict]:
-        """从黄金网获取水贝金价"""
+        self.registry = registry or get_registry()
+        # 按优先级排序的网页数据源
+        self.sources: List[CompiledSource] = self.registry.group('web')
+        # 原始响应归档（RawArchive），设置后保存每次获取的页面，便于之后离线重新提取
+        self.raw_archive = raw_archive
+        # 银行 / 金融 API 数据源与网页数据源共用同一个注册表和 Session
+        self.fetcher = RealGoldPriceFetcher(registry=self.registry, session=self.session)
+
+    def _stream_price(self, source: CompiledSource, timestamp: str) -> Optional[Tuple[float, str]]:
+        """流式下载数据源页面，找到有效价格后立即停止读取
+
+        启用原始响应归档时不提前结束，读取完整页面（仍受 max_bytes 限制）并归档。
+        """
+        body = [] if self.raw_archive is not None else None
+        result, stats = source.fetch(self.session, on_bytes=body.append if body is not None else None,
+                                     stop_early=body is None)
+        logger.debug("%s 下载统计: %s", source.name, stats,
+                     extra={'source': source.name, 'latency_ms': stats['elapsed_ms'], 'url': source.url})
+
+        if body is not None:
+            try:
+                self.raw_archive.capture(
+                    b''.join(body), source=source.name, url=source.url, timestamp=timestamp,
+                    encoding=stats.get('encoding'), price=result['price'] if result else None
+                )
+            except Exception as e:
+                logger.warning("归档原始响应失败: %s", e, extra={'source': source.name})
+        return (result['price'], result['raw_text']) if result else None
+
+    def fetch_source(self, name: str, label: Optional[str] = None) -> Optional[Dict]:
+        """按名称获取一个网页数据源的价格，返回价格数据或 None"""
+        source = self.registry.get(name)
+        if source is None:
+            raise KeyError(f"未注册的数据源: {name}")
+        label = label or f"从{name}获取金价"
+        started = time.perf_counter()
         try:
-            response = self.session.get(self.data_sources[0]['url'], timeout=10)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # 这里需要根据实际网页结构调整选择器
-            # 示例选择器，需要根据实际网站调整
-            price_elements = soup.find_all('div', class_='gold-price') or \
-                           soup.find_all('span', class_='price') or \
-                           soup.find_all('td', text=lambda x: x and '水贝' in x)
-
-            if price_elements:
-                # 提取价格信息
-                price_text = price_elements[0].get_text().strip()
-                return {
-                    'source': self.data_sources[0]['name'],
-                    'price': self._extract_price(price_text),
-                    'timestamp': datetime.now().isoformat(),
+            timestamp = datetime.now().isoformat()
+            result = self._stream_price(source, timestamp)
+            latency_ms = round((time.perf_counter() - started) * 1000, 2)
+
+            if result:
+                price, price_text = result
+                price_data = {
+                    'source': name,
+                    'price': price,
+                    'timestamp': timestamp,
                     'raw_text': price_text
                 }
-
+                if source.note:
+                    price_data['note'] = source.note
+                logger.info("%s成功: %s元/克", label, price,
+                            extra={'source': name, 'latency_ms': latency_ms, 'outcome': 'ok', 'price': price})
+                return price_data
+
+            logger.info("%s: 页面中没有找到价格", label,
+                        extra={'source': name, 'latency_ms': latency_ms, 'outcome': 'no_price'})
+
+        except RateLimitExceeded as e:
+            # 被限流的数据源立即跳过，不占用请求超时
+            logger.warning("%s跳过: %s", label, e,
+                           extra={'source': name, 'outcome': 'throttled',
+                                  'latency_ms': round((time.perf_counter() - started) * 1000, 2)})
         except Exception as e:
-            logging.error("从黄金网获取水贝金价失败: %s", e)
+            logger.error("%s失败: %s", label, e,
+                         extra={'source': name, 'outcome': 'error',
+                                'latency_ms': round((time.perf_counter() - started) * 1000, 2)})
 
         return None
 
+    def get_shuibei_price_from_gold_org(self) -> Optional[Dict]:
+        """从黄金网获取水贝金价"""
+        return self.fetch_source('中国黄金网', "从黄金网获取水贝金价")
+
     def get_shuibei_price_from_cngold(self) -> Optional[Dict]:
         """从金投网获取水贝金价"""
-        try:
-            response = self.session.get(self.data_sources[1]['url'], timeout=10)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # 查找包含水贝金价的元素
-            price_elements = soup.find_all(text=lambda x: x and '水贝' in x)
-
-            for element in price_elements:
-                parent = element.parent
-                if parent:
-                    price_text = parent.get_text().strip()
-                    price = self._extract_price(price_text)
-                    if price:
-                        return {
-                            'source': self.data_sources[1]['name'],
-                            'price': price,
-                            'timestamp': datetime.now().isoformat(),
-                            'raw_text': price_text
-                        }
-
-        except Exception as e:
-            logging.error("从金投网获取水贝金价失败: %s", e)
-
-        return None
+        return self.fetch_source('金投网-实时金价', "从金投网获取水贝金价")
 
     def get_shuibei_price_from_sina(self) -> Optional[Dict]:
         """从新浪财经获取黄金价格（作为备选）"""
-        try:
-            response = self.session.get(self.data_sources[2]['url'], timeout=10)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # 查找黄金价格相关元素
-            gold_elements = soup.find_all(text=lambda x: x and any(keyword in x for keyword in ['黄金', '金价', 'Au']))
-
-            for element in gold_elements[:5]:  # 检查前几个相关元素
-                price_text = element.get_text().strip()
-                price = self._extract_price(price_text)
-                if price:
-                    return {
-                        'source': self.data_sources[2]['name'],
-                        'price': price,
-                        'timestamp': datetime.now().isoformat(),
-                        'raw_text': price_text,
-                        'note': '可能不是水贝特定价格，仅供参考'
-                    }
-
-        except Exception as e:
-            logging.error("从新浪财经获取黄金价格失败: %s", e)
-
-        return None
+        return self.fetch_source('新浪财经-黄金', "从新浪财经获取黄金价格")
 
     def _extract_price(self, text: str) -> Optional[float]:
         """从文本中提取价格数字"""
-        import re
-
-        # 匹配价格模式：数字+可能的小数点+可能的后缀
-        patterns = [
-            r'(\d+\.?\d*)\s*元/克',
-            r'¥\s*(\d+\.?\d*)',
-            r'(\d+\.?\d*)\s*元',
-            r'价格\s*[:：]\s*(\d+\.?\d*)'
-        ]
-
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                try:
-                    return float(match.group(1))
-                except ValueError:
-                    continue
-
-        return None
+        return extract_price(text)
 
     def get_gold_price(self) -> Dict:
         """获取水贝金价，尝试多个数据源"""
-        logging.info("开始获取水贝金价...")
+        logger.info("开始获取水贝金价...")
 
         # 首先尝试使用API获取真实数据
+        started = time.perf_counter()
         try:
-            api_price = get_real_gold_price()
+            # 银行和 API 都不可用时不使用估算价格，继续尝试网页数据源
+            api_price = self.fetcher.get_gold_price(use_fallback=False)
             if api_price and api_price.get('price'):
-                logging.info("从API成功获取水贝金价估算: %s元/克", api_price['price'])
+                logger.info("从API成功获取水贝金价估算: %s元/克", api_price['price'],
+                            extra={'source': api_price.get('source'), 'outcome': 'ok', 'price': api_price['price'],
+                                   'latency_ms': round((time.perf_counter() - started) * 1000, 2)})
                 return api_price
         except Exception as e:
-            logging.warning("API获取失败，尝试网页数据源: %s", e)
+            logger.warning("API获取失败，尝试网页数据源: %s", e,
+                           extra={'source': 'api', 'outcome': 'error',
+                                  'latency_ms': round((time.perf_counter() - started) * 1000, 2)})
 
         # 如果API失败，按优先级尝试不同的网页数据源
-        price_data = None
-
-        # 首先尝试金投网
-        price_data = self.get_shuibei_price_from_cngold()
-        if price_data:
-            logging.info("从金投网成功获取水贝金价: %s元/克", price_data['price'])
-            return price_data
-
-        # 然后尝试黄金网
-        price_data = self.get_shuibei_price_from_gold_org()
-        if price_data:
-            logging.info("从黄金网成功获取水贝金价: %s元/克", price_data['price'])
-            return price_data
-
-        # 最后尝试新浪财经作为备选
-        price_data = self.get_shuibei_price_from_sina()
-        if price_data:
-            logging.info("从新浪财经获取黄金价格: %s元/克", price_data['price'])
-            return price_data
+        for source in self.sources:
+            price_data = self.fetch_source(source.name)
+            if price_data:
+                return price_data
 
         # 如果所有数据源都失败
         error_msg = "无法从任何数据源获取水贝金价"
-        logging.error(error_msg)
+        logger.error(error_msg, extra={'source': '所有数据源', 'outcome': 'error'})
         return {
             'source': '所有数据源',
             'price': None,
@@ -203,6 +149,10 @@ class ShuiBeiGoldPriceScraper:
 
 
 if __name__ == "__main__":
+    from log_config import setup_logging
+
+    setup_logging()
+
     # 测试代码
     scraper = ShuiBeiGoldPriceScraper()
     result = scraper.get_gold_price()
@@ -0,0 +1,466 @@
+"""
+Gorilla 压缩的内存时间序列
+按数据源把价格 tick 压缩后常驻内存：时间戳用 delta-of-delta 编码，价格用 XOR 浮点压缩
+（Facebook Gorilla 论文的做法），每个数据点通常只占几个字节，
+而 get_recent_prices 返回的字典列表每条要几百字节。
+
+数据按块保存，每块最多 block_size 个点；写满的块封存为不可变的字节串，
+并记录块内的起止时间、最小/最大价格和点数。范围查询先用块摘要跳过无关的块，
+只解码与查询区间相交的块；区间完全覆盖的块直接用摘要回答最值和计数。
+
+时间戳以毫秒整数保存，不带时区的时间按 UTC 处理（与回放引擎一致）。
+"""
+
+import json
+import struct
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 每块最多保存的数据点数
+DEFAULT_BLOCK_SIZE = 1024
+
+# delta-of-delta 的分段编码：(前缀, 前缀位数, 数值位数)，超出范围时用 '1111' + 64 位
+DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+
+_DOUBLE = struct.Struct('>d')
+_UINT64 = struct.Struct('>Q')
+_MASK64 = (1 << 64) - 1
+
+# 解码时每个点读取的窗口大小
+WINDOW_BYTES = 20
+WINDOW_BITS = WINDOW_BYTES * 8
+
+
+def _float_bits(value: float) -> int:
+    return _UINT64.unpack(_DOUBLE.pack(value))[0]
+
+
+def _bits_float(bits: int) -> float:
+    return _DOUBLE.unpack(_UINT64.pack(bits))[0]
+
+
+def _signed(value: int, bits: int) -> int:
+    """把 bits 位的补码还原为有符号整数"""
+    return value - (1 << bits) if value >= 1 << (bits - 1) else value
+
+
+def to_millis(value) -> int:
+    """把时间（毫秒整数、ISO 字符串、datetime 或 Timestamp）转换为毫秒时间戳"""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return pd.Timestamp(value).value // 1_000_000
+
+
+class BitWriter:
+    """按位追加写入，满 64 位时把整字节移入缓冲区"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self._acc = 0
+        self._nbits = 0
+
+    def write(self, value: int, nbits: int):
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._nbits += nbits
+        if self._nbits >= 64:
+            nbytes = self._nbits >> 3
+            rest = self._nbits & 7
+            self.buffer += (self._acc >> rest).to_bytes(nbytes, 'big')
+            self._acc &= (1 << rest) - 1
+            self._nbits = rest
+
+    @property
+    def bit_length(self) -> int:
+        return len(self.buffer) * 8 + self._nbits
+
+    def getvalue(self) -> bytes:
+        """返回已写入的字节（末尾不足一字节的部分补零）"""
+        if not self._nbits:
+            return bytes(self.buffer)
+        pad = -self._nbits & 7
+        return bytes(self.buffer) + (self._acc << pad).to_bytes((self._nbits + pad) >> 3, 'big')
+
+
+class GorillaBlock:
+    """封存后的压缩块：编码字节和块级摘要"""
+
+    __slots__ = ('data', 'count', 'start', 'end', 'min', 'max')
+
+    def __init__(self, data: bytes, count: int, start: int, end: int, min_value: float, max_value: float):
+        self.data = data
+        self.count = count
+        # 块内最早/最晚的毫秒时间戳
+        self.start = start
+        self.end = end
+        self.min = min_value
+        self.max = max_value
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.data)
+
+    def overlaps(self, start: Optional[int], end: Optional[int]) -> bool:
+        return (start is None or self.end >= start) and (end is None or self.start <= end)
+
+    def covered_by(self, start: Optional[int], end: Optional[int]) -> bool:
+        return (start is None or self.start >= start) and (end is None or self.end <= end)
+
+    def __iter__(self) -> Iterator[Tuple[int, float]]:
+        """逐点解码，产出 (毫秒时间戳, 价格)"""
+        # 每个点最多占 4 + 64 + 2 + 5 + 6 + 64 = 145 位：每个点只取一次 160 位窗口，
+        # 字段用移位从窗口中取出，避免逐字段调用读取函数
+        data = self.data + bytes(WINDOW_BYTES)
+        from_bytes = int.from_bytes
+        window = from_bytes(data[:16], 'big')
+        timestamp = _signed(window >> 64, 64)
+        bits = window & _MASK64
+        yield timestamp, _bits_float(bits)
+
+        position = 128
+        delta = 0
+        leading = trailing = 0
+        for _ in range(self.count - 1):
+            start = position >> 3
+            window = from_bytes(data[start:start + WINDOW_BYTES], 'big')
+            used = position & 7
+
+            # 时间戳：delta-of-delta
+            used += 1
+            if (window >> (WINDOW_BITS - used)) & 1:
+                for prefix, prefix_bits, value_bits in DOD_BUCKETS:
+                    used += 1
+                    if not (window >> (WINDOW_BITS - used)) & 1:
+                        used += value_bits
+                        delta += _signed((window >> (WINDOW_BITS - used)) & ((1 << value_bits) - 1), value_bits)
+                        break
+                else:
+                    used += 64
+                    delta += _signed((window >> (WINDOW_BITS - used)) & _MASK64, 64)
+            timestamp += delta
+
+            # 价格：与上一个值的 XOR
+            used += 1
+            if (window >> (WINDOW_BITS - used)) & 1:
+                used += 1
+                if (window >> (WINDOW_BITS - used)) & 1:
+                    used += 11
+                    header = (window >> (WINDOW_BITS - used)) & 0x7FF
+                    leading = header >> 6
+                    trailing = 64 - leading - ((header & 0x3F) + 1)
+                meaningful = 64 - leading - trailing
+                used += meaningful
+                bits ^= ((window >> (WINDOW_BITS - used)) & ((1 << meaningful) - 1)) << trailing
+            position += used - (position & 7)
+            yield timestamp, _bits_float(bits)
+
+    def decode(self) -> Tuple[np.ndarray, np.ndarray]:
+        """解码整块，返回 (毫秒时间戳数组, 价格数组)"""
+        times = np.empty(self.count, dtype=np.int64)
+        values = np.empty(self.count, dtype=np.float64)
+        for i, (timestamp, value) in enumerate(self):
+            times[i] = timestamp
+            values[i] = value
+        return times, values
+
+
+class BlockEncoder:
+    """正在写入的块：逐点压缩，写满后封存为 GorillaBlock"""
+
+    def __init__(self):
+        self.writer = BitWriter()
+        self.count = 0
+        self.start = self.end = 0
+        self.min = self.max = 0.0
+        self._timestamp = 0
+        self._delta = 0
+        self._bits = 0
+        # 初始窗口不可复用，第一个非零 XOR 一定写出前导零和有效位长度
+        self._leading = 64
+        self._trailing = 0
+
+    def append(self, timestamp: int, value: float):
+        write = self.writer.write
+        bits = _float_bits(value)
+
+        if not self.count:
+            write(timestamp, 64)
+            write(bits, 64)
+            self.start = self.end = timestamp
+            self.min = self.max = value
+        else:
+            delta = timestamp - self._timestamp
+            dod = delta - self._delta
+            self._delta = delta
+            if dod == 0:
+                write(0, 1)
+            else:
+                for prefix, prefix_bits, value_bits in DOD_BUCKETS:
+                    if -(1 << (value_bits - 1)) <= dod < 1 << (value_bits - 1):
+                        write(prefix, prefix_bits)
+                        write(dod, value_bits)
+                        break
+                else:
+                    write(0b1111, 4)
+                    write(dod & _MASK64, 64)
+
+            xor = bits ^ self._bits
+            if xor == 0:
+                write(0, 1)
+            else:
+                leading = min(64 - xor.bit_length(), 31)
+                trailing = (xor & -xor).bit_length() - 1
+                if leading >= self._leading and trailing >= self._trailing:
+                    # 有效位落在上一个窗口内，复用窗口
+                    write(0b10, 2)
+                    write(xor >> self._trailing, 64 - self._leading - self._trailing)
+                else:
+                    meaningful = 64 - leading - trailing
+                    write(0b11, 2)
+                    write(leading, 5)
+                    write(meaningful - 1, 6)
+                    write(xor >> trailing, meaningful)
+                    self._leading, self._trailing = leading, trailing
+
+            self.start = min(self.start, timestamp)
+            self.end = max(self.end, timestamp)
+            if value < self.min:
+                self.min = value
+            elif value > self.max:
+                self.max = value
+
+        self._timestamp = timestamp
+        self._bits = bits
+        self.count += 1
+
+    def seal(self) -> GorillaBlock:
+        """返回当前内容的不可变块（不影响继续写入）"""
+        return GorillaBlock(self.writer.getvalue(), self.count, self.start, self.end, self.min, self.max)
+
+
+class GorillaSeries:
+    """单个数据源的压缩序列（非线程安全，由 SeriesStore 加锁）"""
+
+    def __init__(self, block_size: int = DEFAULT_BLOCK_SIZE):
+        self.block_size = block_size
+        self.sealed: List[GorillaBlock] = []
+        self._open = BlockEncoder()
+        self._snapshot: Optional[GorillaBlock] = None
+
+    def __len__(self) -> int:
+        return sum(block.count for block in self.sealed) + self._open.count
+
+    def append(self, timestamp: int, value: float):
+        """追加一个点（毫秒时间戳, 价格）"""
+        self._open.append(int(timestamp), float(value))
+        self._snapshot = None
+        if self._open.count >= self.block_size:
+            self.sealed.append(self._open.seal())
+            self._open = BlockEncoder()
+
+    def extend(self, times, values):
+        for timestamp, value in zip(np.asarray(times, dtype=np.int64).tolist(),
+                                    np.asarray(values, dtype=np.float64).tolist()):
+            self.append(timestamp, value)
+
+    @property
+    def blocks(self) -> List[GorillaBlock]:
+        """全部块（包括正在写入的块的快照）"""
+        if not self._open.count:
+            return list(self.sealed)
+        if self._snapshot is None:
+            self._snapshot = self._open.seal()
+        return self.sealed + [self._snapshot]
+
+    @property
+    def nbytes(self) -> int:
+        """压缩数据占用的字节数"""
+        return sum(block.nbytes for block in self.sealed) + (self._open.writer.bit_length + 7) // 8
+
+    def scan(self, start=None, end=None) -> Iterator[Tuple[int, float]]:
+        """逐点产出 [start, end] 内的 (毫秒时间戳, 价格)，只解码相交的块"""
+        start = None if start is None else to_millis(start)
+        end = None if end is None else to_millis(end)
+        for block in self.blocks:
+            if not block.overlaps(start, end):
+                continue
+            if block.covered_by(start, end):
+                yield from block
+            else:
+                for timestamp, value in block:
+                    if (start is None or timestamp >= start) and (end is None or timestamp <= end):
+                        yield timestamp, value
+
+    def range(self, start=None, end=None) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 [start, end] 内的 (datetime64[ms] 时间数组, 价格数组)"""
+        start = None if start is None else to_millis(start)
+        end = None if end is None else to_millis(end)
+        times: List[np.ndarray] = []
+        values: List[np.ndarray] = []
+        for block in self.blocks:
+            if not block.overlaps(start, end):
+                continue
+            block_times, block_values = block.decode()
+            if not block.covered_by(start, end):
+                mask = np.ones(block.count, dtype=bool)
+                if start is not None:
+                    mask &= block_times >= start
+                if end is not None:
+                    mask &= block_times <= end
+                block_times, block_values = block_times[mask], block_values[mask]
+            times.append(block_times)
+            values.append(block_values)
+        if not times:
+            return np.empty(0, dtype='datetime64[ms]'), np.empty(0, dtype=np.float64)
+        return np.concatenate(times).astype('datetime64[ms]'), np.concatenate(values)
+
+    def summary(self, start=None, end=None) -> Dict:
+        """区间内的点数和最值：完全覆盖的块直接使用块摘要，只解码边缘的块"""
+        start = None if start is None else to_millis(start)
+        end = None if end is None else to_millis(end)
+        count = 0
+        low, high = float('inf'), float('-inf')
+        decoded_blocks = 0
+        for block in self.blocks:
+            if not block.overlaps(start, end):
+                continue
+            if block.covered_by(start, end):
+                count += block.count
+                low, high = min(low, block.min), max(high, block.max)
+                continue
+            decoded_blocks += 1
+            for timestamp, value in block:
+                if (start is None or timestamp >= start) and (end is None or timestamp <= end):
+                    count += 1
+                    low, high = min(low, value), max(high, value)
+        return {
+            'count': count,
+            'min_price': low if count else None,
+            'max_price': high if count else None,
+            'decoded_blocks': decoded_blocks
+        }
+
+    def latest(self, n: int = 1) -> List[Tuple[int, float]]:
+        """最近追加的 n 个点（从块尾向前解码，按追加顺序返回）"""
+        points: List[Tuple[int, float]] = []
+        for block in reversed(self.blocks):
+            points = list(block)[-(n - len(points)):] + points
+            if len(points) >= n:
+                break
+        return points
+
+
+class SeriesStore:
+    """按数据源组织的压缩序列集合，可从 GoldPriceStorage 载入，也可作为调度器监听器持续追加"""
+
+    def __init__(self, block_size: int = DEFAULT_BLOCK_SIZE):
+        self.block_size = block_size
+        self.series: Dict[str, GorillaSeries] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, source: str) -> GorillaSeries:
+        series = self.series.get(source)
+        if series is None:
+            series = self.series[source] = GorillaSeries(self.block_size)
+        return series
+
+    def sources(self) -> List[str]:
+        return sorted(self.series)
+
+    def append_record(self, price_data: Dict) -> bool:
+        """追加一条价格记录，没有价格的记录跳过（可直接注册为调度器监听器）"""
+        price = price_data.get('price')
+        if price is None or not price_data.get('timestamp'):
+            return False
+        with self._lock:
+            self._get(str(price_data.get('source'))).append(to_millis(price_data['timestamp']), float(price))
+        return True
+
+    def add_frame(self, df: pd.DataFrame) -> int:
+        """批量追加存储读出的数据表，丢弃无效的时间和价格，返回追加的点数"""
+        timestamps = pd.to_datetime(df['timestamp'], errors='coerce', format='ISO8601')
+        prices = pd.to_numeric(df['price'], errors='coerce')
+        valid = (timestamps.notna() & prices.notna()).to_numpy()
+        times = timestamps.to_numpy()[valid].astype('datetime64[ms]').astype(np.int64)
+        values = prices.to_numpy(dtype=np.float64)[valid]
+        sources = df['source'].astype(str).to_numpy()[valid]
+        codes, names = pd.factorize(sources)
+        with self._lock:
+            for code, name in enumerate(names):
+                mask = codes == code
+                self._get(name).extend(times[mask], values[mask])
+        return int(valid.sum())
+
+    def load(self, storage=None, start: Optional[str] = None, end: Optional[str] = None,
+             source: Optional[str] = None, chunksize: int = 100000) -> int:
+        """从存储分块载入历史数据，返回载入的点数"""
+        if storage is None:
+            from data_storage import GoldPriceStorage
+            storage = GoldPriceStorage()
+        return sum(self.add_frame(chunk) for chunk in storage.iter_price_chunks(start, end, source, chunksize=chunksize))
+
+    def range(self, source: str, start=None, end=None) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            series = self.series.get(source)
+            if series is None:
+                return np.empty(0, dtype='datetime64[ms]'), np.empty(0, dtype=np.float64)
+            return series.range(start, end)
+
+    def summary(self, source: str, start=None, end=None) -> Dict:
+        with self._lock:
+            series = self.series.get(source)
+            if series is None:
+                return {'count': 0, 'min_price': None, 'max_price': None, 'decoded_blocks': 0}
+            return series.summary(start, end)
+
+    def memory_report(self) -> Dict:
+        """各数据源的点数、块数和压缩后占用的字节数"""
+        with self._lock:
+            sources = {}
+            for name in sorted(self.series):
+                series = self.series[name]
+                points, nbytes = len(series), series.nbytes
+                sources[name] = {
+                    'points': points,
+                    'blocks': len(series.blocks),
+                    'bytes': nbytes,
+                    'bytes_per_point': round(nbytes / points, 2) if points else 0.0
+                }
+        points = sum(item['points'] for item in sources.values())
+        nbytes = sum(item['bytes'] for item in sources.values())
+        return {
+            'points': points,
+            'bytes': nbytes,
+            'bytes_per_point': round(nbytes / points, 2) if points else 0.0,
+            'sources': sources
+        }
+
+
+def run_series_report(start: Optional[str] = None, end: Optional[str] = None, source: Optional[str] = None,
+                      block_size: int = DEFAULT_BLOCK_SIZE, as_json: bool = False) -> Dict:
+    """把历史数据载入压缩序列，打印内存占用和各数据源的区间摘要"""
+    store = SeriesStore(block_size)
+    started = time.perf_counter()
+    points = store.load(start=start, end=end, source=source)
+    report = store.memory_report()
+    report['load_s'] = round(time.perf_counter() - started, 2)
+
+    started = time.perf_counter()
+    for name, item in report['sources'].items():
+        item.update(store.summary(name))
+    report['summary_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+    if as_json:
+        print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+        return report
+
+    print(f"🗜️ 已载入 {points} 个数据点，压缩后 {report['bytes'] / 1024:.1f} KB，"
+          f"平均每点 {report['bytes_per_point']} 字节（用时 {report['load_s']} 秒）")
+    for name, item in report['sources'].items():
+        print(f"  {name}: {item['points']} 点 / {item['blocks']} 块，{item['bytes_per_point']} 字节/点，"
+              f"最低 {item['min_price']}，最高 {item['max_price']}")
+    print(f"⏱️ 区间摘要用时 {report['summary_ms']} 毫秒")
+    return report
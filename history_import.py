@@ -0,0 +1,233 @@
+"""
+历史数据批量导入
+把外部的 CSV / Excel 历史金价数据分块流式读取，在进程池中并行做向量化规范化，
+再按 (timestamp, source) 去重后批量写入 GoldPriceStorage（早于今天的记录直接写成按天的压缩分段）
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_storage import CSV_COLUMNS, GoldPriceStorage, timestamp_keys
+from fx_rate import convert_usd_ticks
+
+# 常见的时间列和价格列名称（按优先级）
+TIMESTAMP_COLUMNS = ['timestamp', 'datetime', 'date', 'time', '时间', '日期', '交易日期']
+PRICE_COLUMNS = ['price', 'close', 'Close', '收盘价', '收盘', '价格', '最新价']
+SOURCE_COLUMNS = ['source', '数据源', '来源', 'symbol', '品种']
+# 历史汇率表的汇率列名称
+RATE_COLUMNS = ['rate', 'usd_cny', 'close', '汇率', '中间价', '收盘价']
+
+# 支持的价格单位
+UNITS = ('cny_per_gram', 'usd_per_ounce')
+
+
+def _find_column(columns, candidates: List[str]) -> Optional[str]:
+    """按候选名称（忽略大小写）查找列名"""
+    lowered = {str(column).strip().lower(): column for column in columns}
+    for candidate in candidates:
+        if candidate.lower() in lowered:
+            return lowered[candidate.lower()]
+    return None
+
+
+def iter_file_chunks(path: str, chunk_size: int = 100000) -> Iterator[pd.DataFrame]:
+    """分块读取 CSV / Excel 文件"""
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension in ('.xlsx', '.xlsm'):
+        # openpyxl 只读模式逐行读取，不会一次载入整个工作簿
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(value) for value in next(rows)]
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= chunk_size:
+                    yield pd.DataFrame(batch, columns=header)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=header)
+        finally:
+            workbook.close()
+    elif extension == '.xls':
+        # 旧格式不支持流式读取，读入后再分块
+        df = pd.read_excel(path)
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+def load_rate_table(path: str) -> pd.DataFrame:
+    """读取历史美元兑人民币汇率表（CSV / Excel），返回按时间排序的 timestamp, rate 两列"""
+    parts = []
+    for chunk in iter_file_chunks(path):
+        ts_column = _find_column(chunk.columns, TIMESTAMP_COLUMNS)
+        rate_column = _find_column(chunk.columns, RATE_COLUMNS)
+        if ts_column is None or rate_column is None:
+            raise ValueError(f"无法识别汇率表的时间列或汇率列，现有列: {list(chunk.columns)}")
+        parts.append(pd.DataFrame({
+            'timestamp': pd.to_datetime(chunk[ts_column], errors='coerce'),
+            'rate': pd.to_numeric(chunk[rate_column], errors='coerce')
+        }).dropna())
+    rates = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['timestamp', 'rate'])
+    rates = rates[rates['rate'] > 0]
+    if rates.empty:
+        raise ValueError(f"汇率表 {path} 中没有有效的汇率")
+    return rates.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+
+def normalize_chunk(chunk: pd.DataFrame, source: Optional[str] = None,
+                    unit: str = 'cny_per_gram', fx_rates: Optional[pd.DataFrame] = None,
+                    note: str = '历史数据导入') -> pd.DataFrame:
+    """把一块原始数据向量化地规范化为存储格式（CSV_COLUMNS）
+
+    美元报价（usd_per_ounce）按每条记录时间点当时的汇率换算，fx_rates 为历史汇率表（timestamp, rate）。
+    """
+    ts_column = _find_column(chunk.columns, TIMESTAMP_COLUMNS)
+    price_column = _find_column(chunk.columns, PRICE_COLUMNS)
+    if ts_column is None or price_column is None:
+        raise ValueError(f"无法识别时间列或价格列，现有列: {list(chunk.columns)}")
+
+    timestamps = pd.to_datetime(chunk[ts_column], errors='coerce')
+    prices = chunk[price_column]
+    if prices.dtype == object:
+        # 去掉千位分隔符
+        prices = prices.astype(str).str.replace(',', '', regex=False)
+    prices = pd.to_numeric(prices, errors='coerce')
+
+    if source:
+        sources = pd.Series(source, index=chunk.index)
+    else:
+        source_column = _find_column(chunk.columns, SOURCE_COLUMNS)
+        sources = chunk[source_column].astype(str) if source_column else pd.Series('历史导入', index=chunk.index)
+
+    valid = timestamps.notna() & prices.notna()
+    timestamps = timestamps[valid]
+    if unit == 'usd_per_ounce':
+        if fx_rates is None or fx_rates.empty:
+            raise ValueError("美元报价需要历史汇率表才能换算")
+        converted = convert_usd_ticks(pd.DataFrame({'timestamp': timestamps, 'price_usd': prices[valid]}),
+                                      fx_rates)
+        prices = converted['price'].reindex(prices.index)
+    # numpy 的 datetime_as_string 比逐行 strftime 快一个数量级
+    has_fraction = (timestamps.dt.microsecond != 0).any()
+    unit_code = 'us' if has_fraction else 's'
+    iso_strings = np.datetime_as_string(
+        timestamps.to_numpy().astype(f'datetime64[{unit_code}]'), unit=unit_code
+    )
+
+    normalized = pd.DataFrame({
+        'timestamp': pd.Series(iso_strings, index=timestamps.index),
+        'source': sources[valid],
+        'price': prices[valid].round(2),
+        'raw_text': '',
+        'error': '',
+        'note': note
+    }, columns=CSV_COLUMNS)
+    return normalized.reset_index(drop=True)
+
+
+def prepare_chunk(chunk: pd.DataFrame, source: Optional[str], unit: str,
+                  fx_rates: Optional[pd.DataFrame]) -> Tuple[List[int], List[str], pd.DataFrame]:
+    """在工作进程中完成规范化和去重键计算，返回 (时间戳键, 数据源, 规范化后的数据表)
+
+    主进程只需按键去重并顺序写入，避免成为瓶颈。
+    """
+    normalized = normalize_chunk(chunk, source, unit, fx_rates)
+    if normalized.empty:
+        return [], [], normalized
+    return timestamp_keys(normalized['timestamp']), normalized['source'].astype(str).tolist(), normalized
+
+
+class HistoryImporter:
+    """并行历史数据导入器"""
+
+    def __init__(self, storage: Optional[GoldPriceStorage] = None, workers: Optional[int] = None,
+                 chunk_size: int = 100000):
+        self.storage = storage or GoldPriceStorage()
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.logger = logging.getLogger(__name__)
+
+    def import_file(self, path: str, source: Optional[str] = None, unit: str = 'cny_per_gram',
+                    fx_rates: Optional[pd.DataFrame] = None) -> Dict:
+        """导入一个文件，返回导入报告
+
+        导入美元报价时必须提供历史汇率表 fx_rates（timestamp, rate），不会用当前汇率或固定汇率换算历史数据。
+        """
+        if unit not in UNITS:
+            raise ValueError(f"不支持的价格单位: {unit}，可选: {', '.join(UNITS)}")
+        if unit == 'usd_per_ounce' and (fx_rates is None or fx_rates.empty):
+            raise ValueError("导入美元报价需要提供历史汇率表")
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+
+        start = time.perf_counter()
+        known_keys = self.storage.load_record_keys()
+        rows_read = rows_valid = rows_inserted = chunks = 0
+        # 新增记录的时间范围（纳秒），用于重新汇总已汇总过的时间桶
+        inserted_range = []
+
+        def load(prepared) -> Tuple[int, int]:
+            keys, sources, normalized = prepared
+            keep = self.storage.filter_new_keys(keys, sources, known_keys)
+            self.storage.write_history(normalized[keep])
+            new_keys = [key for key, new in zip(keys, keep) if new]
+            if new_keys:
+                inserted_range.extend([min(new_keys), max(new_keys)])
+            return len(normalized), sum(keep)
+
+        # 限制同时在途的块数，保证内存有界
+        max_in_flight = self.workers * 2
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending = []
+            for chunk in iter_file_chunks(path, self.chunk_size):
+                rows_read += len(chunk)
+                pending.append(executor.submit(prepare_chunk, chunk, source, unit, fx_rates))
+                while len(pending) >= max_in_flight:
+                    valid, inserted = load(pending.pop(0).result())
+                    rows_valid += valid
+                    rows_inserted += inserted
+                    chunks += 1
+
+            for future in pending:
+                valid, inserted = load(future.result())
+                rows_valid += valid
+                rows_inserted += inserted
+                chunks += 1
+
+        if inserted_range:
+            from retention import note_backfill
+            note_backfill(self.storage, pd.Timestamp(min(inserted_range)), pd.Timestamp(max(inserted_range)))
+
+        elapsed = time.perf_counter() - start
+        report = {
+            'file': path,
+            'chunks': chunks,
+            'rows_read': rows_read,
+            'rows_valid': rows_valid,
+            'rows_inserted': rows_inserted,
+            'rows_duplicate': rows_valid - rows_inserted,
+            'elapsed_s': round(elapsed, 3),
+            'rows_per_second': round(rows_read / elapsed) if elapsed > 0 else None
+        }
+        self.logger.info("历史数据导入完成: %s", report)
+        return report
+
+
+def import_history(path: str, source: Optional[str] = None, unit: str = 'cny_per_gram',
+                   workers: Optional[int] = None, chunk_size: int = 100000,
+                   fx_rates: Optional[pd.DataFrame] = None) -> Dict:
+    """导入历史数据文件"""
+    importer = HistoryImporter(workers=workers, chunk_size=chunk_size)
+    return importer.import_file(path, source=source, unit=unit, fx_rates=fx_rates)
@@ -0,0 +1,313 @@
+"""
+单写入者数据接收服务
+由一个守护进程独占 JSON/CSV 存储，其他进程（定时监控、单次获取、多个调度器）
+通过本地 Unix 套接字提交记录。服务端把所有连接提交的记录合并成批次，
+由唯一的写线程一次写入，并在写入完成后逐个确认。
+
+守护进程不可用时，客户端自动退回到本地写入，此时由 GoldPriceStorage 的文件锁保证互斥。
+请求已发出但等待确认超时的记录可能已被服务端写入，退回写入和服务端写入都按 (timestamp, source)
+跳过已有的记录，不会重复保存。
+"""
+
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional
+
+from data_storage import DEFAULT_DURABILITY, GoldPriceStorage
+
+# Windows 上没有 Unix 套接字服务器，此时只能使用文件锁方式写入
+UNIX_SOCKETS_SUPPORTED = hasattr(socket, 'AF_UNIX') and hasattr(socketserver, 'ThreadingUnixStreamServer')
+_UnixServerBase = socketserver.ThreadingUnixStreamServer if UNIX_SOCKETS_SUPPORTED else object
+
+# 默认的套接字路径（位于数据目录下）
+DEFAULT_SOCKET_NAME = "ingest.sock"
+
+
+def default_socket_path(data_dir: str = "data") -> str:
+    """默认的接收服务套接字路径"""
+    return os.path.join(data_dir, DEFAULT_SOCKET_NAME)
+
+
+class _PendingBatch:
+    """一次提交：记录列表 + 写入完成的通知"""
+
+    __slots__ = ('records', 'done', 'error')
+
+    def __init__(self, records: List[Dict]):
+        self.records = records
+        self.done = threading.Event()
+        self.error: Optional[str] = None
+
+
+class _IngestHandler(socketserver.StreamRequestHandler):
+    """每个客户端连接一个处理线程：逐行读取 JSON 请求并等待写入确认"""
+
+    def handle(self):
+        server: 'IngestServer' = self.server
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                records = request['records']
+                if isinstance(records, dict):
+                    records = [records]
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply({'ok': False, 'error': f'无效请求: {e}'})
+                continue
+
+            batch = server.submit(records)
+            batch.done.wait()
+            try:
+                self._reply({
+                    'id': request.get('id'),
+                    'ok': batch.error is None,
+                    'written': len(records),
+                    'error': batch.error
+                })
+            except OSError:
+                # 客户端等待确认超时后已断开（记录已写入，客户端退回写入时会跳过它们）
+                return
+
+    def _reply(self, payload: Dict):
+        self.wfile.write(json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+class IngestServer(_UnixServerBase):
+    """单写入者接收服务"""
+
+    daemon_threads = True
+    # 大量生产者同时连接时避免 listen 队列溢出
+    request_queue_size = 1024
+
+    def __init__(self, socket_path: Optional[str] = None, storage: Optional[GoldPriceStorage] = None,
+                 max_batch: int = 1000, max_delay: float = 0.02):
+        if not UNIX_SOCKETS_SUPPORTED:
+            raise RuntimeError("当前平台不支持 Unix 套接字，无法启动数据接收服务")
+        self.storage = storage or GoldPriceStorage()
+        self.socket_path = socket_path or default_socket_path(self.storage.data_dir)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.logger = logging.getLogger(__name__)
+
+        self._queue: 'queue.Queue[Optional[_PendingBatch]]' = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self.records_written = 0
+        self.batches_written = 0
+
+        self._remove_stale_socket()
+        super().__init__(self.socket_path, _IngestHandler)
+
+    def _remove_stale_socket(self):
+        """删除上次异常退出遗留的套接字文件；如果已有服务在运行则报错"""
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except OSError:
+            os.unlink(self.socket_path)
+        else:
+            raise RuntimeError(f"接收服务已在运行: {self.socket_path}")
+        finally:
+            probe.close()
+
+    def submit(self, records: List[Dict]) -> _PendingBatch:
+        """提交一批记录，返回可等待的批次对象"""
+        batch = _PendingBatch(records)
+        self._queue.put(batch)
+        return batch
+
+    def _write_loop(self):
+        """唯一的写线程：合并多个提交后一次写入存储"""
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            group = [first]
+            count = len(first.records)
+            deadline = time.monotonic() + self.max_delay
+
+            # 在短时间窗口内继续收集其他提交，直到达到批次上限
+            while count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                group.append(item)
+                count += len(item.records)
+
+            records = [record for batch in group for record in batch.records]
+            error = None
+            try:
+                # 客户端确认超时后可能已在本地写入了同一批记录
+                self.storage.save_price_batch(records, skip_existing=True)
+                self.records_written += len(records)
+                self.batches_written += 1
+            except Exception as e:
+                error = str(e)
+                self.logger.error("批量写入失败: %s", e)
+
+            for batch in group:
+                batch.error = error
+                batch.done.set()
+
+    def serve(self):
+        """启动写线程并开始服务（阻塞）"""
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        self.logger.info("数据接收服务已启动: %s", self.socket_path)
+        print(f"📥 数据接收服务已启动: {self.socket_path}")
+        try:
+            self.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        """停止服务，写完队列中剩余的记录"""
+        self._queue.put(None)
+        if self._writer is not None:
+            self._writer.join(timeout=10)
+        self.storage.close()
+        self.server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def get_status(self) -> Dict:
+        """获取服务状态"""
+        return {
+            'socket_path': self.socket_path,
+            'records_written': self.records_written,
+            'batches_written': self.batches_written,
+            'queued': self._queue.qsize()
+        }
+
+
+class IngestClient:
+    """接收服务客户端（线程安全，复用同一连接）"""
+
+    def __init__(self, socket_path: str, timeout: float = 10.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self._sock = sock
+        self._reader = sock.makefile('rb')
+
+    def submit(self, records: List[Dict]) -> Dict:
+        """提交记录并等待写入确认，连接失败时抛出 OSError"""
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            self._next_id += 1
+            payload = json.dumps({'id': self._next_id, 'records': records},
+                                 ensure_ascii=False, default=str).encode('utf-8') + b'\n'
+            try:
+                self._sock.sendall(payload)
+                line = self._reader.readline()
+                if not line:
+                    raise ConnectionError("接收服务已断开")
+                return json.loads(line)
+            except (OSError, ValueError):
+                self.close()
+                raise
+
+    def close(self):
+        """关闭连接"""
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            finally:
+                self._sock = None
+                self._reader = None
+
+
+class RemoteWriterStorage(GoldPriceStorage):
+    """写入经由接收服务完成的存储；读取仍直接读本地文件
+
+    接收服务不可用时退回本地写入（带文件锁），保证数据不丢失。
+    """
+
+    def __init__(self, data_dir: str = "data", socket_path: Optional[str] = None,
+                 durability: str = DEFAULT_DURABILITY):
+        super().__init__(data_dir, durability)
+        self.client = IngestClient(socket_path or default_socket_path(data_dir))
+        self.logger = logging.getLogger(__name__)
+
+    def save_price_data(self, price_data: Dict):
+        """保存价格数据（通过接收服务）"""
+        if self._submit([price_data]):
+            print(f"价格数据已提交: {price_data.get('price', 'N/A')}元/克")
+        else:
+            super().save_price_batch([price_data], skip_existing=True)
+            print(f"价格数据已保存: {price_data.get('price', 'N/A')}元/克")
+
+    def save_price_batch(self, records: List[Dict], skip_existing: bool = False):
+        """批量保存价格数据（通过接收服务）
+
+        退回本地写入时总是跳过已有的记录：确认超时的请求可能已经由接收服务写入。
+        """
+        if records and not self._submit(records):
+            super().save_price_batch(records, skip_existing=True)
+
+    def close(self):
+        """关闭与接收服务的连接，并提交本地退回写入的数据"""
+        self.client.close()
+        super().close()
+
+    def _submit(self, records: List[Dict]) -> bool:
+        try:
+            reply = self.client.submit(records)
+            if reply.get('ok'):
+                return True
+            self.logger.warning("接收服务写入失败，改为本地写入: %s", reply.get('error'))
+        except (OSError, ValueError) as e:
+            self.logger.warning("无法连接接收服务，改为本地写入: %s", e)
+        return False
+
+
+def create_storage(data_dir: str = "data", socket_path: Optional[str] = None,
+                   durability: str = DEFAULT_DURABILITY) -> GoldPriceStorage:
+    """创建存储：接收服务在运行时通过它写入，否则直接写本地文件（带文件锁）
+
+    durability 是本地写入（包括接收服务不可用时的退回写入）的持久化模式。
+    """
+    socket_path = socket_path or default_socket_path(data_dir)
+    if UNIX_SOCKETS_SUPPORTED and os.path.exists(socket_path):
+        return RemoteWriterStorage(data_dir, socket_path, durability)
+    return GoldPriceStorage(data_dir, durability)
+
+
+def run_ingest_daemon(data_dir: str = "data", socket_path: Optional[str] = None,
+                      durability: str = DEFAULT_DURABILITY):
+    """运行接收服务（阻塞）"""
+    if not UNIX_SOCKETS_SUPPORTED:
+        print("❌ 当前平台不支持 Unix 套接字，无法启动数据接收服务")
+        print("💡 各进程会直接写入本地文件，由文件锁保证互斥，无需启动接收服务")
+        return
+    server = IngestServer(socket_path, GoldPriceStorage(data_dir, durability))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        print("\n🛑 正在停止数据接收服务...")
@@ -0,0 +1,210 @@
+"""
+离线压测工具
+使用向量化合成价格驱动存储层或调度器，按指定速率施加负载并测量其吞吐上限
+"""
+
+import contextlib
+import io
+import json
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from mock_gold_price import SyntheticPriceGenerator
+
+# 生成器吞吐测试默认生成的总 tick 数（步数按品种数折算）
+BENCHMARK_TICKS = 10_000_000
+
+# 生成器吞吐测试每次生成的最大 tick 数，保证内存占用与品种数无关
+GENERATOR_BLOCK_TICKS = 1_000_000
+
+
+class _GeneratorScraper:
+    """把合成价格记录包装成爬虫接口（get_gold_price），供调度器调用"""
+
+    def __init__(self, generator: SyntheticPriceGenerator, block_size: int = 4096):
+        self.generator = generator
+        # 每块约 block_size 条记录（步数按品种数折算）
+        self.block_steps = max(1, block_size // len(generator.instruments))
+        self._buffer: List[Dict] = []
+
+    def get_gold_price(self) -> Dict:
+        if not self._buffer:
+            prices = self.generator.generate(self.block_steps)
+            self._buffer = self.generator.to_records(prices)
+            self._buffer.reverse()
+        return self._buffer.pop()
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    """计算延迟分位数（毫秒）"""
+    if not samples:
+        return {}
+    values = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'max_ms': round(float(values.max()), 3)
+    }
+
+
+def benchmark_generator(n_steps: Optional[int] = None, n_instruments: int = 10,
+                        seed: Optional[int] = None) -> Dict:
+    """测量合成价格生成器本身的吞吐（ticks/秒）
+
+    n_steps 默认按品种数折算，使总 tick 数约为 BENCHMARK_TICKS；
+    价格路径分块生成，每块不超过 GENERATOR_BLOCK_TICKS 个 tick。
+    """
+    if n_steps is None:
+        n_steps = max(1, BENCHMARK_TICKS // n_instruments)
+    block_steps = max(1, GENERATOR_BLOCK_TICKS // n_instruments)
+    # 历史环形缓冲区同样按品种数折算，只需容纳一块
+    generator = SyntheticPriceGenerator(
+        instruments=[f'合成品种-{i}' for i in range(n_instruments)],
+        jump_intensity=1000.0, history_size=block_steps, seed=seed
+    )
+    start = time.perf_counter()
+    for offset in range(0, n_steps, block_steps):
+        generator.generate(min(block_steps, n_steps - offset))
+    elapsed = time.perf_counter() - start
+    ticks = n_steps * n_instruments
+    return {
+        'ticks': ticks,
+        'elapsed_s': round(elapsed, 4),
+        'ticks_per_second': round(ticks / elapsed) if elapsed > 0 else None
+    }
+
+
+class LoadDriver:
+    """以固定速率驱动存储层或调度器的负载发生器"""
+
+    def __init__(self, target: str = 'storage', rate: float = 100.0,
+                 duration: float = 10.0, instruments: int = 1,
+                 data_dir: Optional[str] = None, seed: Optional[int] = None,
+                 storage_options: Optional[Dict] = None):
+        if target not in ('storage', 'scheduler'):
+            raise ValueError(f"不支持的压测目标: {target}")
+
+        self.target = target
+        self.rate = rate
+        self.duration = duration
+        self.data_dir = data_dir
+        self.storage_options = storage_options or {}
+        # 调度器每次只取一条记录，历史环形缓冲区只需容纳一块（按品种数折算）
+        self.generator = SyntheticPriceGenerator(
+            instruments=[f'合成品种-{i}' for i in range(instruments)],
+            history_size=max(1, GENERATOR_BLOCK_TICKS // max(instruments, 1)), seed=seed
+        )
+
+    def _build_operation(self, data_dir: str):
+        """根据压测目标构造单次操作"""
+        from data_storage import GoldPriceStorage
+
+        storage = GoldPriceStorage(data_dir=data_dir, **self.storage_options)
+
+        if self.target == 'storage':
+            scraper = _GeneratorScraper(self.generator)
+            return lambda: storage.save_price_data(scraper.get_gold_price()), storage
+
+        from scheduler import GoldPriceScheduler
+
+        scheduler = GoldPriceScheduler(
+            scraper=_GeneratorScraper(self.generator),
+            storage=storage
+        )
+        return scheduler.fetch_and_store_price, storage
+
+    def run(self) -> Dict:
+        """运行压测并返回报告"""
+        with contextlib.ExitStack() as stack:
+            data_dir = self.data_dir
+            if data_dir is None:
+                data_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='gold_load_'))
+
+            operation, storage = self._build_operation(data_dir)
+            stack.callback(getattr(storage, 'close', lambda: None))
+            # 屏蔽每次写入时的控制台输出，避免终端本身成为瓶颈
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+
+            latencies: List[float] = []
+            interval = 1.0 / self.rate if self.rate > 0 else 0.0
+            start = time.perf_counter()
+            deadline = start + self.duration
+            next_due = start
+            lag_events = 0
+
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                if now < next_due:
+                    time.sleep(min(next_due - now, 0.001))
+                    continue
+                if now - next_due > interval and interval > 0:
+                    # 目标无法跟上设定速率
+                    lag_events += 1
+
+                op_start = time.perf_counter()
+                operation()
+                latencies.append(time.perf_counter() - op_start)
+                next_due += interval
+
+            elapsed = time.perf_counter() - start
+            fsyncs = getattr(storage, 'commits', None)
+
+        achieved = len(latencies) / elapsed if elapsed > 0 else 0.0
+        report = {
+            'target': self.target,
+            'target_rate': self.rate,
+            'duration_s': round(elapsed, 3),
+            'operations': len(latencies),
+            'achieved_rate': round(achieved, 1),
+            'saturated': achieved < self.rate * 0.95,
+            'lag_events': lag_events,
+            'latency': _percentiles(latencies)
+        }
+        if self.storage_options:
+            report['storage_options'] = self.storage_options
+        if fsyncs is not None:
+            report['durability'] = storage.durability
+            report['fsync_commits'] = fsyncs
+        return report
+
+
+def run_load_test(target: str = 'storage', rate: float = 100.0, duration: float = 10.0,
+                  instruments: int = 1, **kwargs) -> Dict:
+    """运行一次压测"""
+    driver = LoadDriver(target=target, rate=rate, duration=duration,
+                        instruments=instruments, **kwargs)
+    return driver.run()
+
+
+def benchmark_durability(rate: float = 2000.0, duration: float = 3.0, instruments: int = 1,
+                         modes: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """按各持久化模式分别压测存储层，比较吞吐、写入延迟和 fsync 次数"""
+    from data_storage import DURABILITY_MODES
+
+    results = {}
+    for mode in modes or DURABILITY_MODES:
+        report = run_load_test('storage', rate=rate, duration=duration, instruments=instruments,
+                               storage_options={'durability': mode})
+        results[mode] = {
+            'achieved_rate': report['achieved_rate'],
+            'saturated': report['saturated'],
+            'latency': report['latency'],
+            'fsync_commits': report['fsync_commits'],
+            'records_per_fsync': round(report['operations'] / report['fsync_commits'], 1)
+            if report['fsync_commits'] else None
+        }
+    return results
+
+
+if __name__ == "__main__":
+    print("🔧 合成价格生成器吞吐:")
+    print(json.dumps(benchmark_generator(), ensure_ascii=False, indent=2))
+    print("\n🔧 存储层压测:")
+    print(json.dumps(run_load_test('storage', rate=200, duration=3), ensure_ascii=False, indent=2))
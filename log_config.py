@@ -0,0 +1,156 @@
+"""
+异步日志管道
+所有日志记录先进入内存队列，由后台线程写入文件和控制台，获取价格的线程不会因为
+磁盘或终端缓慢而阻塞。日志文件按大小（或时间）轮转并压缩为 .gz，
+文件中的每条记录是一行 JSON，包含 source、latency_ms、outcome 等结构化字段。
+"""
+
+import atexit
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+from datetime import datetime
+from typing import Optional
+
+# 默认日志文件
+DEFAULT_LOG_FILE = 'gold_price.log'
+
+# 控制台使用的文本格式（与原来的 basicConfig 一致）
+CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# 作为结构化字段输出的 extra 属性
+STRUCTURED_FIELDS = ('source', 'latency_ms', 'outcome', 'price', 'url')
+
+_listener: Optional['_DrainingQueueListener'] = None
+_queue_handler: Optional['NonBlockingQueueHandler'] = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        if record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """队列已满时丢弃日志而不是阻塞调用线程，并记录丢弃的条数"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 在调用线程中合并消息参数（参数可能随后被修改）；
+        # 队列只在进程内使用，异常信息原样保留，由各输出端自行格式化
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class _DrainingQueueListener(logging.handlers.QueueListener):
+    """停止时阻塞等待队列腾出空间再放入结束标记，保证已入队的日志全部写出"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def _gzip_namer(name: str) -> str:
+    return name + '.gz'
+
+
+def _gzip_rotator(source: str, dest: str):
+    """轮转时把旧日志压缩为 .gz（在后台写线程中执行）"""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _create_file_handler(log_file: str, max_bytes: int, backup_count: int,
+                         when: Optional[str]) -> logging.Handler:
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when=when, backupCount=backup_count, encoding='utf-8', delay=True
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True
+        )
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def setup_logging(log_file: str = DEFAULT_LOG_FILE, level: int = logging.INFO,
+                  max_bytes: int = 10 * 1024 * 1024, backup_count: int = 10,
+                  when: Optional[str] = None, console: bool = True, queue_size: int = 10000):
+    """配置异步日志管道（重复调用无副作用）
+
+    when 不为空时按时间轮转（取值同 TimedRotatingFileHandler，例如 'midnight'），否则按大小轮转。
+    """
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        handlers = [_create_file_handler(log_file, max_bytes, backup_count, when)]
+        if console:
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+            handlers.append(console_handler)
+
+        log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+        _listener = _DrainingQueueListener(log_queue, *handlers, respect_handler_level=True)
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(_queue_handler)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """停止后台写线程，写完队列中剩余的日志"""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is None:
+            return
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+        _queue_handler = None
+
+
+def get_dropped_count() -> int:
+    """因队列已满被丢弃的日志条数"""
+    return _queue_handler.dropped if _queue_handler is not None else 0
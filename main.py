@@ -7,6 +7,7 @@
 """
 
 import argparse
+import json
 import sys
 import os
 from datetime import datetime
@@ -15,8 +16,9 @@ from datetime import datetime
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from scheduler import GoldPriceScheduler, run_single_fetch, show_statistics
-from data_storage import GoldPriceStorage
+from data_storage import DEFAULT_DURABILITY, GoldPriceStorage
 from gold_price_scraper import ShuiBeiGoldPriceScraper
+from log_config import setup_logging
 
 
 def print_banner():
@@ -40,45 +42,114 @@ def print_usage():
   single     单次获取当前水贝金价
   schedule   启动定时监控（每分钟获取一次）
   stats      显示历史数据统计
-  test       测试数据源连接
+  test       并发探测所有数据源的分阶段延迟和提取成功率
   export     导出数据到Excel
+  loadtest   使用合成价格离线压测存储层/调度器
+  stream     启动定时监控并通过 SSE/WebSocket 推送实时价格
+  api        启动历史价格只读查询 HTTP API
+  import     并行导入外部 CSV/Excel 历史数据
+  ingestd    启动单写入者数据接收服务（其他进程经由它写入存储）
+  rotate     把已结束日期的历史数据轮转为压缩分段
+  reprocess  用当前提取规则并行重新提取已归档的原始页面，修复历史记录
+  retention  汇总 1分钟/1小时/1天 K线，并按各层保留期清理过期数据
+  budget     显示各主机的请求限额及能支持的最短轮询间隔
+  worker     启动分片工作进程（多个进程通过租约分摊数据源）
+  dashboard  启动定时监控并显示终端实时看板
+  replay     回放历史数据，评估加价系数和告警规则
+  series     把历史数据载入压缩内存序列，报告内存占用和区间摘要
+  soak       在本地桩服务上加速运行调度器，检查长时间运行的内存是否平稳
+  shm        读取共享内存段中各数据源的最新价格
 
 选项:
   --interval MINUTES  定时模式下的间隔分钟数（默认: 1）
+  --jitter SECONDS    每次定时获取前的最大随机延迟秒数（默认: 间隔的10%，最多10秒）
+  --interval-seconds S  工作进程的获取间隔秒数（worker 模式，默认: --interval 换算的秒数）
+  --worker-id ID      工作进程标识（worker 模式，默认: 主机名-进程号）
+  --lease-ttl SECONDS 分片租约有效期（worker 模式，默认: 30）
   --days DAYS         统计模式显示最近N天的数据（默认: 7）
-  --file FILE         导出文件的路径
+  --file FILE         导出文件的路径（test 模式下为探测报告的保存路径）
+  --rounds N          数据源探测轮数（test 模式，默认: 3）
+  --json              以 JSON 输出报告（test/replay/series/soak/shm 模式）
+  --target TARGET     压测目标: storage 或 scheduler（默认: storage）
+  --rate RATE         压测速率，每秒操作数（默认: 100）
+  --durability MODE   写入持久化模式: none/group/strict（single/schedule/stream/dashboard/worker/ingestd/loadtest 模式，默认: group），
+                      all 为依次压测比较三种模式（仅 loadtest 模式）
+  --duration SECONDS  压测或浸泡测试持续秒数（loadtest 默认: 10，soak 默认: 3600）
+  --tick SECONDS      浸泡测试的加速获取间隔秒数（soak 模式，默认: 0.2）
+  --budget MB         浸泡测试允许的常驻内存增长（soak 模式，默认: 32）
+  --instruments N     合成品种数量（默认: 1）
+  --host HOST         服务监听地址（默认: 127.0.0.1）
+  --port PORT         服务监听端口（stream 默认: 8765，api 默认: 8080）
+  --source NAME       导入数据的数据源名称（默认读取文件中的来源列）
+  --unit UNIT         导入数据的价格单位: cny_per_gram 或 usd_per_ounce
+  --fx-rates FILE     历史美元兑人民币汇率表，导入 usd_per_ounce 数据时必须提供
+  --workers N         并行进程数（默认: CPU核数）
+  --chunk-size N      每块读取的行数（默认: 100000）
+  --socket PATH       数据接收服务的套接字路径（ingestd 为监听路径，single/schedule/stream/dashboard/worker 经由它写入，默认: data/ingest.sock）
+  --alerts FILE       告警规则配置文件（schedule/stream/replay 模式）
+  --capture-raw       归档每次获取的原始页面（single/schedule/stream/dashboard 模式）
+  --consensus         并发查询全部数据源，使用剔除离群报价后的共识价格（single/schedule/stream/dashboard/soak 模式）
+  --deadline SECONDS  共识模式等待各数据源的截止秒数（默认: 8）
+  --shm [NAME]        把最新价格发布到共享内存段（schedule/stream 模式，shm 模式下为读取的段名，默认: goldenpress_prices）
+  --start TIME        重新提取、回放或载入的起始时间（reprocess/replay/series 模式）
+  --end TIME          重新提取、回放或载入的结束时间（reprocess/replay/series 模式）
+  --dry-run           只报告重新提取的结果，不改写记录
+  --keep-raw DAYS     原始数据保留天数（retention 模式，默认: 30）
+  --fps N             看板最高刷新频率（dashboard 模式，默认: 4）
+  --markups LIST      要评估的候选加价系数，逗号分隔（replay 模式，另含当前配置的系数）
+  --reference NAMES   作为实际水贝报价的数据源，逗号分隔（replay 模式，默认: 全部网页数据源）
+  --speed X           回放倍速，例如 60 表示 1 分钟的数据用 1 秒回放（replay 模式，默认: 尽可能快）
 
 示例:
   python main.py single                    # 单次获取价格
   python main.py schedule                  # 启动定时监控
   python main.py schedule --interval 5     # 每5分钟获取一次
+  python main.py schedule --alerts alerts.json  # 定时监控并启用价格告警
   python main.py stats                     # 显示统计信息
   python main.py stats --days 30           # 显示最近30天统计
   python main.py test                      # 测试数据源
+  python main.py test --rounds 10 --json   # 探测10轮并输出JSON报告
   python main.py export                    # 导出数据到Excel
+  python main.py loadtest --rate 500       # 以每秒500次写入压测存储层
+  python main.py loadtest --durability all --rate 2000  # 比较各持久化模式的吞吐
+  python main.py stream --port 8765        # 启动实时价格推送服务
+  python main.py api --port 8080           # 启动历史价格查询API
+  python main.py import --file sge.csv --source 上海黄金交易所  # 导入历史数据
+  python main.py ingestd                   # 启动数据接收服务
+  python main.py rotate                    # 轮转历史数据为压缩分段
+  python main.py schedule --capture-raw    # 定时监控并归档原始页面
+  python main.py schedule --consensus --deadline 5  # 定时获取多源共识价格
+  python main.py reprocess --start 2025-10-01 --end 2025-10-15  # 重新提取并修复记录
+  python main.py retention --keep-raw 14   # 汇总K线，原始数据保留14天
+  python main.py budget --interval 1       # 检查每分钟轮询是否超出各主机限额
+  python main.py worker --interval-seconds 15  # 启动分片工作进程（可启动多个）
+  python main.py dashboard --interval 1    # 定时监控并显示实时看板
+  python main.py replay --markups 1.03,1.05,1.08 --alerts alerts.json  # 回放历史评估加价系数和告警
+  python main.py series --start 2025-01-01  # 查看历史数据压缩后的内存占用
+  python main.py soak --duration 7200 --tick 0.1  # 浸泡测试 2 小时
+  python main.py schedule --shm            # 定时监控并把最新价格发布到共享内存
+  python main.py shm                       # 读取共享内存中的最新价格
     """)
 
 
-def test_data_sources():
-    """测试所有数据源的连接情况"""
-    print("🔧 测试数据源连接...")
-    print("=" * 60)
+def test_data_sources(rounds=3, as_json=False, output_file=None):
+    """并发探测所有数据源（网页、银行、API）的延迟和提取成功率"""
+    from source_probe import print_report, run_probe
 
-    scraper = ShuiBeiGoldPriceScraper()
+    if not as_json:
+        print(f"🔧 并发探测所有数据源，共 {rounds} 轮...")
+    report = run_probe(rounds)
 
-    for i, source in enumerate(scraper.data_sources, 1):
-        print(f"\n{i}. 测试: {source['name']}")
-        print(f"   网址: {source['url']}")
-        print(f"   描述: {source['description']}")
+    if as_json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
 
-        try:
-            response = scraper.session.get(source['url'], timeout=10)
-            if response.status_code == 200:
-                print("   ✅ 连接成功")
-            else:
-                print(f"   ⚠️  连接异常 (状态码: {response.status_code})")
-        except Exception as e:
-            print(f"   ❌ 连接失败: {e}")
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        if not as_json:
+            print(f"\n💾 探测报告已保存到: {output_file}")
 
 
 def export_data(output_file=None):
@@ -96,9 +167,186 @@ def export_data(output_file=None):
         print(f"❌ 导出失败: {e}")
 
 
+def run_load_test(target='storage', rate=100.0, duration=10.0, instruments=1, durability=None):
+    """运行离线压测并打印报告"""
+    import json
+    from load_test import benchmark_durability, benchmark_generator, run_load_test as run_driver
+
+    if durability == 'all':
+        print(f"⏱️  按持久化模式压测存储层: 目标速率 {rate}/秒, 每种模式 {duration} 秒...")
+        results = benchmark_durability(rate, duration, instruments)
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        for mode, result in results.items():
+            print(f"  {mode:<7} {result['achieved_rate']:>8}/秒  p99 {result['latency'].get('p99_ms')} ms  "
+                  f"fsync {result['fsync_commits']} 次")
+        return
+
+    print("🔧 合成价格生成器吞吐测试...")
+    print(json.dumps(benchmark_generator(n_instruments=max(instruments, 1)), ensure_ascii=False, indent=2))
+
+    print(f"\n⏱️  压测 {target}: 目标速率 {rate}/秒, 持续 {duration} 秒...")
+    report = run_driver(target=target, rate=rate, duration=duration, instruments=instruments,
+                        storage_options={'durability': durability} if durability else None)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if report['saturated']:
+        print(f"⚠️  {target} 无法达到目标速率，实际上限约 {report['achieved_rate']}/秒")
+    else:
+        print(f"✅ {target} 可以维持 {report['achieved_rate']}/秒")
+
+
+def create_scraper(capture_raw=False, consensus=False, deadline=None):
+    """创建爬虫，capture_raw 为真时归档每次获取的原始页面，consensus 为真时使用多源共识价格"""
+    archive = None
+    if capture_raw:
+        from raw_archive import RawArchive
+
+        archive = RawArchive()
+        print(f"🗄️  原始页面归档已开启: {archive.archive_dir}")
+    if consensus:
+        from real_gold_price import DEFAULT_CONSENSUS_DEADLINE, RealGoldPriceFetcher
+
+        deadline = deadline or DEFAULT_CONSENSUS_DEADLINE
+        print(f"🧮 多源共识模式: 并发查询全部数据源，截止时间 {deadline} 秒")
+        return RealGoldPriceFetcher(consensus=True, deadline=deadline, raw_archive=archive)
+    return ShuiBeiGoldPriceScraper(raw_archive=archive)
+
+
+def attach_alerts(scheduler, config_file):
+    """按配置文件为调度器挂上告警引擎，返回引擎（未配置时返回 None）"""
+    if not config_file:
+        return None
+    from alerts import load_alert_engine
+
+    engine = load_alert_engine(config_file)
+    scheduler.add_listener(engine.on_tick)
+    print(f"🔔 已加载 {engine.rule_count} 条告警规则")
+    return engine
+
+
+def run_stream_server(interval=1, host='127.0.0.1', port=8765, alerts_file=None, capture_raw=False,
+                      consensus=False, deadline=None, shm_name=None, socket_path=None, durability=DEFAULT_DURABILITY):
+    """启动定时监控，并把每次获取到的价格推送给 SSE/WebSocket 订阅者"""
+    import time
+    from price_stream import PriceStreamServer
+
+    server = PriceStreamServer(host=host, port=port)
+    scheduler = GoldPriceScheduler(interval_minutes=interval, scraper=create_scraper(capture_raw, consensus, deadline),
+                                   socket_path=socket_path, durability=durability)
+    scheduler.add_listener(server.publish)
+    alert_engine = attach_alerts(scheduler, alerts_file)
+    if shm_name:
+        scheduler.publish_shared_memory(shm_name)
+
+    server.start()
+    try:
+        scheduler.start()
+        while scheduler.is_running:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\n🛑 正在停止推送服务...")
+    finally:
+        scheduler.stop()
+        server.stop()
+        if alert_engine:
+            alert_engine.close()
+
+
+def import_data(input_file, source=None, unit='cny_per_gram', workers=None, chunk_size=100000, fx_rates_file=None):
+    """并行导入外部历史数据文件"""
+    import json
+    from history_import import import_history, load_rate_table
+
+    if not input_file:
+        print("❌ 请使用 --file 指定要导入的文件")
+        return
+
+    fx_rates = None
+    if unit == 'usd_per_ounce':
+        # 历史报价必须按当时的汇率换算，不能使用今天的汇率
+        if not fx_rates_file:
+            print("❌ 导入美元报价需要使用 --fx-rates 指定历史汇率表（时间列 + 汇率列）")
+            return
+        fx_rates = load_rate_table(fx_rates_file)
+        print(f"💱 使用历史汇率表: {fx_rates_file}（{len(fx_rates)} 条, "
+              f"{fx_rates['timestamp'].iloc[0]} ~ {fx_rates['timestamp'].iloc[-1]}）")
+
+    print(f"📥 正在导入: {input_file}")
+    report = import_history(input_file, source=source, unit=unit, workers=workers,
+                            chunk_size=chunk_size, fx_rates=fx_rates)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"✅ 导入完成: 新增 {report['rows_inserted']} 条, 重复 {report['rows_duplicate']} 条, "
+          f"{report['rows_per_second']} 行/秒")
+
+
+def rotate_history():
+    """把已结束日期的历史数据轮转为压缩分段"""
+    storage = GoldPriceStorage()
+    print("🗜️  正在轮转历史数据...")
+    report = storage.rotate_segments()
+    if report['segments']:
+        print(f"✅ 已写入 {report['segments']} 个分段, {report['records']} 条记录, "
+              f"压缩后 {report['compressed_bytes']} 字节")
+    else:
+        print("📝 没有需要轮转的数据")
+
+    status = storage.segments.get_status()
+    print(f"📦 分段总数: {status['segments']}, 记录数: {status['records']}, "
+          f"时间范围: {status['first_day']} ~ {status['last_day']}")
+
+
+def reprocess_raw(start=None, end=None, source=None, workers=None, dry_run=False):
+    """用当前提取规则重新提取已归档的原始页面并修复记录"""
+    import json
+    from raw_archive import reprocess_archive
+
+    print(f"🔁 正在重新提取归档页面: {start or '最早'} ~ {end or '最新'}")
+    report = reprocess_archive(start=start, end=end, source=source, workers=workers, dry_run=dry_run)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if dry_run:
+        print(f"📝 共 {report['changed']} 条记录的提取结果会发生变化（未改写）")
+    else:
+        print(f"✅ 已更新 {report['updated']} 条记录, 新增 {report['inserted']} 条记录")
+
+
+def show_rate_budget(interval_minutes=1):
+    """显示各主机的请求限额、数据源数量和能支持的最短轮询间隔"""
+    from rate_limit import budget_report
+
+    print(f"🚦 各主机请求预算（当前轮询间隔 {interval_minutes} 分钟）")
+    print("=" * 60)
+    for host, entry in budget_report().items():
+        ok = entry['min_interval_s'] <= interval_minutes * 60
+        print(f"\n{'✅' if ok else '⚠️ '} {host}")
+        print(f"   限额: 每分钟 {entry['rate_per_minute']} 次（突发 {entry['burst']} 次）")
+        print(f"   数据源: {', '.join(entry['sources'])}")
+        print(f"   最短轮询间隔: {entry['min_interval_s']} 秒")
+
+
+def apply_retention(keep_raw_days=None):
+    """分层汇总 K线并按保留期清理过期数据"""
+    from retention import DEFAULT_RETENTION_DAYS, run_retention
+
+    retention_days = {'raw': keep_raw_days} if keep_raw_days else None
+    print("🧮 正在汇总K线并清理过期数据...")
+    report = run_retention(retention_days=retention_days)
+    for tier, count in report['rollup'].items():
+        print(f"  📊 {tier} K线新增 {count} 根")
+    for tier, count in report['removed'].items():
+        days = keep_raw_days if tier == 'raw' and keep_raw_days else DEFAULT_RETENTION_DAYS[tier]
+        print(f"  🗑️  {tier} 删除 {count} 条（保留 {days} 天）")
+    print("✅ 分层保留处理完成")
+
+
 def main():
     """主函数"""
-    print_banner()
+    # 日志经由队列异步写入（文件按大小轮转并压缩），不阻塞价格获取；
+    # 看板模式占用整个终端、浸泡测试每秒获取多次，日志只写入文件
+    setup_logging(console=sys.argv[1:2] not in (['dashboard'], ['soak']))
+
+    # 输出 JSON 时不打印横幅，便于直接交给其他程序处理
+    if '--json' not in sys.argv:
+        print_banner()
 
     parser = argparse.ArgumentParser(
         description='水贝黄金价格实时监控系统',
@@ -112,15 +360,30 @@ def main():
   %(prog)s stats --days 30           # 显示最近30天统计
   %(prog)s test                      # 测试数据源
   %(prog)s export                    # 导出数据到Excel
+  %(prog)s loadtest --rate 500       # 压测存储层
+  %(prog)s stream --port 8765        # 启动实时价格推送服务
+  %(prog)s api --port 8080           # 启动历史价格查询API
+  %(prog)s import --file sge.csv     # 导入历史数据
+  %(prog)s ingestd                   # 启动数据接收服务
+  %(prog)s rotate                    # 轮转历史数据为压缩分段
+  %(prog)s reprocess --start 2025-10-01  # 重新提取已归档页面
+  %(prog)s retention                 # 分层汇总并清理过期数据
+  %(prog)s budget                    # 显示各主机的请求预算
+  %(prog)s worker                    # 启动分片工作进程
+  %(prog)s dashboard                 # 显示终端实时看板
+  %(prog)s replay --start 2025-01-01 # 回放历史数据
+  %(prog)s series                    # 压缩内存序列报告
+  %(prog)s soak --duration 3600      # 调度器浸泡测试
+  %(prog)s shm                       # 读取共享内存最新价格
         """
     )
 
     parser.add_argument(
         'mode',
-        choices=['single', 'schedule', 'stats', 'test', 'export', 'help', 'clear'],
+        choices=['single', 'schedule', 'stats', 'test', 'export', 'help', 'clear', 'loadtest', 'stream', 'api', 'import', 'ingestd', 'rotate', 'reprocess', 'retention', 'budget', 'worker', 'dashboard', 'replay', 'series', 'soak', 'shm'],
         nargs='?',
         default='single',
-        help='运行模式: single(单次), schedule(定时), stats(统计), test(测试), export(导出), help(帮助), clear(清除数据)'
+        help='运行模式: single(单次), schedule(定时), stats(统计), test(测试), export(导出), help(帮助), clear(清除数据), loadtest(压测), stream(推送服务), api(查询接口), import(导入历史数据), ingestd(数据接收服务), rotate(轮转历史分段), reprocess(离线重新提取), retention(分层保留), budget(请求预算), worker(分片工作进程), dashboard(实时看板), replay(历史回放), series(压缩内存序列), soak(浸泡测试), shm(共享内存最新价格)'
     )
 
     parser.add_argument(
@@ -130,6 +393,12 @@ def main():
         help='定时模式下的间隔分钟数 (默认: 1分钟)'
     )
 
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        help='每次定时获取前的最大随机延迟秒数 (schedule/dashboard 模式, 默认: 间隔的10%%，最多10秒)'
+    )
+
     parser.add_argument(
         '--days',
         type=int,
@@ -139,7 +408,209 @@ def main():
 
     parser.add_argument(
         '--file',
-        help='导出文件的路径'
+        help='导出文件的路径（import 模式下为导入文件的路径，test 模式下为探测报告的保存路径）'
+    )
+
+    parser.add_argument(
+        '--target',
+        choices=['storage', 'scheduler'],
+        default='storage',
+        help='压测目标 (默认: storage)'
+    )
+
+    parser.add_argument(
+        '--durability',
+        choices=['none', 'group', 'strict', 'all'],
+        help='写入持久化模式 (single/schedule/stream/dashboard/worker/ingestd/loadtest 模式, 默认: group)；'
+             'all 为依次压测比较三种模式 (仅 loadtest 模式)'
+    )
+
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=100.0,
+        help='压测速率，每秒操作数 (默认: 100)'
+    )
+
+    parser.add_argument(
+        '--duration',
+        type=float,
+        help='压测或浸泡测试持续秒数 (loadtest 默认: 10, soak 默认: 3600)'
+    )
+
+    parser.add_argument(
+        '--tick',
+        type=float,
+        default=0.2,
+        help='浸泡测试的加速获取间隔秒数 (soak 模式, 默认: 0.2)'
+    )
+
+    parser.add_argument(
+        '--budget',
+        type=float,
+        default=32.0,
+        help='浸泡测试允许的常驻内存增长MB (soak 模式, 默认: 32)'
+    )
+
+    parser.add_argument(
+        '--instruments',
+        type=int,
+        default=1,
+        help='合成品种数量 (默认: 1)'
+    )
+
+    parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='服务监听地址 (默认: 127.0.0.1)'
+    )
+
+    parser.add_argument(
+        '--port',
+        type=int,
+        help='服务监听端口 (stream 默认: 8765, api 默认: 8080)'
+    )
+
+    parser.add_argument(
+        '--source',
+        help='导入数据的数据源名称（reprocess 模式下为要重新提取的数据源，replay 模式下为要回放的数据源，series 模式下为要载入的数据源）'
+    )
+
+    parser.add_argument(
+        '--unit',
+        choices=['cny_per_gram', 'usd_per_ounce'],
+        default='cny_per_gram',
+        help='导入数据的价格单位 (默认: cny_per_gram)'
+    )
+
+    parser.add_argument(
+        '--fx-rates',
+        help='历史美元兑人民币汇率表（CSV/Excel，含时间列和汇率列），导入 usd_per_ounce 数据时必须提供'
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='并行进程数 (默认: CPU核数)'
+    )
+
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=100000,
+        help='每块读取的行数 (默认: 100000)'
+    )
+
+    parser.add_argument(
+        '--rounds',
+        type=int,
+        default=3,
+        help='数据源探测轮数 (test 模式, 默认: 3)'
+    )
+
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='以 JSON 输出报告 (test/replay/series/soak 模式)'
+    )
+
+    parser.add_argument(
+        '--fps',
+        type=float,
+        default=4.0,
+        help='看板最高刷新频率 (dashboard 模式, 默认: 4)'
+    )
+
+    parser.add_argument(
+        '--markups',
+        help='要评估的候选加价系数，逗号分隔 (replay 模式, 另含当前配置的系数)'
+    )
+
+    parser.add_argument(
+        '--reference',
+        help='作为实际水贝报价的数据源，逗号分隔 (replay 模式, 默认: 全部网页数据源)'
+    )
+
+    parser.add_argument(
+        '--speed',
+        type=float,
+        help='回放倍速 (replay 模式, 默认: 尽可能快)'
+    )
+
+    parser.add_argument(
+        '--interval-seconds',
+        type=float,
+        help='工作进程的获取间隔秒数 (worker 模式, 默认: --interval 换算的秒数)'
+    )
+
+    parser.add_argument(
+        '--worker-id',
+        help='工作进程标识 (worker 模式, 默认: 主机名-进程号)'
+    )
+
+    parser.add_argument(
+        '--lease-ttl',
+        type=float,
+        default=30.0,
+        help='分片租约有效期秒数 (worker 模式, 默认: 30)'
+    )
+
+    parser.add_argument(
+        '--socket',
+        help='数据接收服务的套接字路径：ingestd 模式为监听路径，single/schedule/stream/dashboard/worker 模式经由它写入 (默认: data/ingest.sock)'
+    )
+
+    parser.add_argument(
+        '--alerts',
+        help='告警规则配置文件 (schedule/stream/replay 模式)'
+    )
+
+    parser.add_argument(
+        '--capture-raw',
+        action='store_true',
+        help='归档每次获取的原始页面 (single/schedule/stream/dashboard 模式)'
+    )
+
+    parser.add_argument(
+        '--consensus',
+        action='store_true',
+        help='并发查询全部数据源，使用剔除离群报价后的共识价格 (single/schedule/stream/dashboard/soak 模式)'
+    )
+
+    parser.add_argument(
+        '--deadline',
+        type=float,
+        help='共识模式等待各数据源的截止秒数 (默认: 8)'
+    )
+
+    parser.add_argument(
+        '--shm',
+        nargs='?',
+        const='goldenpress_prices',
+        metavar='NAME',
+        help='把最新价格发布到共享内存段 (schedule/stream 模式; shm 模式下为读取的段名, 默认: goldenpress_prices)'
+    )
+
+    parser.add_argument(
+        '--start',
+        help='重新提取、回放或载入的起始时间 (reprocess/replay/series 模式)'
+    )
+
+    parser.add_argument(
+        '--end',
+        help='重新提取、回放或载入的结束时间 (reprocess/replay/series 模式)'
+    )
+
+    parser.add_argument(
+        '--keep-raw',
+        type=int,
+        help='原始数据保留天数 (retention 模式, 默认: 30天)'
+    )
+
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='只报告重新提取的结果，不改写记录 (reprocess 模式)'
     )
 
     # 如果没有参数，显示使用说明
@@ -149,14 +620,26 @@ def main():
 
     args = parser.parse_args()
 
+    # all 只用于压测时比较三种模式，实际写入使用单一模式
+    if args.durability == 'all' and args.mode != 'loadtest':
+        print("❌ --durability all 只能用于 loadtest 模式")
+        return
+    durability = args.durability or DEFAULT_DURABILITY
+
     try:
         if args.mode == 'single':
             print("🔍 单次获取水贝金价...")
-            run_single_fetch()
+            run_single_fetch(create_scraper(args.capture_raw, args.consensus, args.deadline), args.socket, durability)
 
         elif args.mode == 'schedule':
             print(f"⏰ 启动定时监控，每 {args.interval} 分钟获取一次...")
-            scheduler = GoldPriceScheduler(interval_minutes=args.interval)
+            scheduler = GoldPriceScheduler(interval_minutes=args.interval,
+                                           scraper=create_scraper(args.capture_raw, args.consensus, args.deadline),
+                                           jitter_seconds=args.jitter, socket_path=args.socket,
+                                           durability=durability)
+            alert_engine = attach_alerts(scheduler, args.alerts)
+            if args.shm:
+                scheduler.publish_shared_memory(args.shm)
 
             try:
                 scheduler.start()
@@ -170,13 +653,16 @@ def main():
             except Exception as e:
                 print(f"❌ 发生错误: {e}")
                 scheduler.stop()
+            finally:
+                if alert_engine:
+                    alert_engine.close()
 
         elif args.mode == 'stats':
             print(f"📊 显示最近 {args.days} 天的统计信息...")
             show_statistics()
 
         elif args.mode == 'test':
-            test_data_sources()
+            test_data_sources(args.rounds, args.json, args.file)
 
         elif args.mode == 'export':
             export_data(args.file)
@@ -189,6 +675,74 @@ def main():
             storage = GoldPriceStorage()
             storage.clear_all_data()
 
+        elif args.mode == 'loadtest':
+            run_load_test(args.target, args.rate, args.duration or 10.0, args.instruments, args.durability)
+
+        elif args.mode == 'stream':
+            print(f"📡 启动实时价格推送服务，每 {args.interval} 分钟获取一次...")
+            run_stream_server(args.interval, args.host, args.port or 8765, args.alerts, args.capture_raw,
+                              args.consensus, args.deadline, args.shm, args.socket, durability)
+
+        elif args.mode == 'api':
+            from query_api import run_query_api
+            run_query_api(args.host, args.port or 8080)
+
+        elif args.mode == 'import':
+            import_data(args.file, args.source, args.unit, args.workers, args.chunk_size, args.fx_rates)
+
+        elif args.mode == 'ingestd':
+            from ingest_daemon import run_ingest_daemon
+            run_ingest_daemon(socket_path=args.socket, durability=durability)
+
+        elif args.mode == 'rotate':
+            rotate_history()
+
+        elif args.mode == 'reprocess':
+            reprocess_raw(args.start, args.end, args.source, args.workers, args.dry_run)
+
+        elif args.mode == 'retention':
+            apply_retention(args.keep_raw)
+
+        elif args.mode == 'budget':
+            show_rate_budget(args.interval)
+
+        elif args.mode == 'worker':
+            from worker_coordination import run_worker
+            run_worker(worker_id=args.worker_id, interval_seconds=args.interval_seconds or args.interval * 60,
+                       lease_ttl=args.lease_ttl, jitter_seconds=args.jitter, socket_path=args.socket,
+                       durability=durability)
+
+        elif args.mode == 'dashboard':
+            from dashboard import run_dashboard
+            run_dashboard(args.interval, args.jitter, create_scraper(args.capture_raw, args.consensus, args.deadline),
+                          args.fps, socket_path=args.socket, durability=durability)
+
+        elif args.mode == 'replay':
+            from replay import run_replay
+            markups = [float(value) for value in args.markups.split(',')] if args.markups else None
+            references = args.reference.split(',') if args.reference else None
+            run_replay(args.start, args.end, args.source, markups, references, args.alerts, args.speed, args.json)
+
+        elif args.mode == 'series':
+            from gorilla_series import run_series_report
+            run_series_report(args.start, args.end, args.source, as_json=args.json)
+
+        elif args.mode == 'soak':
+            from soak_test import print_report, run_soak
+            report = run_soak(args.duration or 3600.0, args.tick, budgets={'rss_mb': args.budget},
+                              verbose=not args.json, consensus=args.consensus)
+            if args.json:
+                print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+            else:
+                print_report(report)
+            # 超出预算时以非零状态退出，便于在 CI 中使用
+            if not report['passed']:
+                sys.exit(1)
+
+        elif args.mode == 'shm':
+            from shm_price import DEFAULT_SEGMENT_NAME, show_segment
+            show_segment(args.shm or DEFAULT_SEGMENT_NAME, args.json)
+
     except KeyboardInterrupt:
         print("\n\n🛑 程序被用户中断")
     except Exception as e:
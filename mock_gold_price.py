@@ -1,66 +1,226 @@
 """
 模拟水贝黄金价格数据源
-当真实数据源不可用时，使用模拟数据演示程序功能
+当真实数据源不可用时，使用模拟数据演示程序功能；
+同时提供基于 numpy 的向量化合成价格生成器，用于离线压测调度器和存储
 """
 
 import random
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
 import json
 
+import numpy as np
+
+from price_stats import RunningStats, merge_moments
+
+# 单个模拟数据源保留的历史记录条数上限
+DEFAULT_HISTORY_SIZE = 10000
+
+
 class MockGoldPriceSource:
     """模拟黄金价格数据源"""
-    
-    def __init__(self):
+
+    def __init__(self, history_size: int = DEFAULT_HISTORY_SIZE):
         # 模拟基础价格范围（元/克）
         self.base_price_range = (480.0, 520.0)
         self.current_price = 500.0
-        self.price_history = []
-    
+        # 有界历史记录，避免长时间运行时内存无限增长
+        self.price_history = deque(maxlen=history_size)
+        self.stats = RunningStats()
+        self.total_records = 0
+
     def generate_mock_price(self):
         """生成模拟价格数据"""
         # 模拟价格波动（±2元）
         price_change = random.uniform(-2.0, 2.0)
         self.current_price += price_change
-        
+
         # 确保价格在合理范围内
-        self.current_price = max(self.base_price_range[0], 
+        self.current_price = max(self.base_price_range[0],
                                min(self.base_price_range[1], self.current_price))
-        
+
+        price = round(self.current_price, 2)
         price_data = {
             'source': '模拟数据源-水贝金价',
-            'price': round(self.current_price, 2),
+            'price': price,
             'timestamp': datetime.now().isoformat(),
             'raw_text': f'水贝黄金价格 {self.current_price:.2f}元/克',
             'note': '此为模拟数据，仅供参考'
         }
-        
+
         self.price_history.append(price_data)
+        self.stats.update(price)
+        self.total_records += 1
         return price_data
-    
+
+    def get_gold_price(self) -> Dict:
+        """与 ShuiBeiGoldPriceScraper 相同的接口，便于替换调度器中的爬虫"""
+        return self.generate_mock_price()
+
     def get_mock_statistics(self, days=7):
-        """生成模拟统计信息"""
-        if len(self.price_history) == 0:
+        """生成模拟统计信息（基于运行统计量，O(1)）"""
+        if self.total_records == 0:
             return {
                 'total_records': 0,
                 'valid_price_records': 0,
                 'message': '暂无模拟数据'
             }
-        
-        prices = [data['price'] for data in self.price_history]
-        
+
         return {
-            'total_records': len(self.price_history),
-            'valid_price_records': len(self.price_history),
-            'current_price': prices[-1],
-            'min_price': min(prices),
-            'max_price': max(prices),
-            'avg_price': round(sum(prices) / len(prices), 2),
-            'price_std': round((sum((p - sum(prices)/len(prices))**2 for p in prices) / len(prices))**0.5, 2),
-            'data_sources': {'模拟数据源-水贝金价': len(self.price_history)},
+            'total_records': self.total_records,
+            'valid_price_records': self.total_records,
+            'current_price': self.price_history[-1]['price'],
+            'min_price': self.stats.min,
+            'max_price': self.stats.max,
+            'avg_price': round(self.stats.mean, 2),
+            'price_std': round(self.stats.std(), 2),
+            'data_sources': {'模拟数据源-水贝金价': self.total_records},
             'latest_update': self.price_history[-1]['timestamp']
         }
 
 
+class PriceRingBuffer:
+    """预分配的 numpy 环形缓冲区，按行保存多个品种的最新价格"""
+
+    def __init__(self, capacity: int, n_instruments: int):
+        self.capacity = capacity
+        self.values = np.empty((capacity, n_instruments), dtype=np.float64)
+        self.position = 0
+        self.size = 0
+
+    def extend(self, block: np.ndarray):
+        """追加一块数据（行数可以超过容量，只保留最后 capacity 行）"""
+        rows = block.shape[0]
+        if rows >= self.capacity:
+            self.values[:] = block[-self.capacity:]
+            self.position = 0
+            self.size = self.capacity
+            return
+
+        end = self.position + rows
+        if end <= self.capacity:
+            self.values[self.position:end] = block
+        else:
+            split = self.capacity - self.position
+            self.values[self.position:] = block[:split]
+            self.values[:rows - split] = block[split:]
+        self.position = end % self.capacity
+        self.size = min(self.capacity, self.size + rows)
+
+    def latest(self, n: Optional[int] = None) -> np.ndarray:
+        """按时间顺序返回最近 n 行"""
+        n = self.size if n is None else min(n, self.size)
+        index = (self.position - n + np.arange(n)) % self.capacity
+        return self.values[index]
+
+
+class SyntheticPriceGenerator:
+    """向量化的多品种合成价格生成器（几何布朗运动 + 跳跃扩散）
+
+    每次调用 generate() 一次生成 n_steps × n_instruments 的价格矩阵，
+    历史保存在有界环形缓冲区中，统计量按块合并，更新代价与历史长度无关。
+    """
+
+    def __init__(self,
+                 instruments: Sequence[str] = ('模拟数据源-水贝金价',),
+                 initial_price: float = 500.0,
+                 mu: float = 0.0,
+                 sigma: float = 0.2,
+                 jump_intensity: float = 0.0,
+                 jump_mean: float = 0.0,
+                 jump_std: float = 0.02,
+                 dt: float = 1.0 / (365 * 24 * 3600),
+                 history_size: int = 100000,
+                 seed: Optional[int] = None):
+        self.instruments = list(instruments)
+        n = len(self.instruments)
+        self.mu = mu
+        self.sigma = sigma
+        self.jump_intensity = jump_intensity
+        self.jump_mean = jump_mean
+        self.jump_std = jump_std
+        self.dt = dt
+        self.rng = np.random.default_rng(seed)
+
+        self.last_prices = np.full(n, float(initial_price))
+        self.history = PriceRingBuffer(history_size, n)
+
+        # 每个品种的运行统计量（向量形式）
+        self.count = np.zeros(n, dtype=np.int64)
+        self.mean = np.zeros(n)
+        self.m2 = np.zeros(n)
+        self.min = np.full(n, np.inf)
+        self.max = np.full(n, -np.inf)
+
+    def generate(self, n_steps: int) -> np.ndarray:
+        """生成下一段价格路径，返回形状为 (n_steps, n_instruments) 的数组"""
+        n = len(self.instruments)
+        drift = (self.mu - 0.5 * self.sigma ** 2) * self.dt
+        shocks = self.rng.standard_normal((n_steps, n)) * (self.sigma * np.sqrt(self.dt))
+        log_returns = drift + shocks
+
+        if self.jump_intensity > 0:
+            # 每步的跳跃次数服从泊松分布，跳跃幅度之和服从正态分布
+            jumps = self.rng.poisson(self.jump_intensity * self.dt, (n_steps, n))
+            has_jump = jumps > 0
+            if has_jump.any():
+                sizes = (self.jump_mean * jumps
+                         + self.jump_std * np.sqrt(jumps) * self.rng.standard_normal((n_steps, n)))
+                log_returns += np.where(has_jump, sizes, 0.0)
+
+        prices = self.last_prices * np.exp(np.cumsum(log_returns, axis=0))
+        self.last_prices = prices[-1].copy()
+        self.history.extend(prices)
+        self._update_stats(prices)
+        return prices
+
+    def _update_stats(self, prices: np.ndarray):
+        """按块合并每个品种的统计量"""
+        rows = prices.shape[0]
+        block_mean = prices.mean(axis=0)
+        block_m2 = ((prices - block_mean) ** 2).sum(axis=0)
+        self.count, self.mean, self.m2 = merge_moments(
+            self.count, self.mean, self.m2, rows, block_mean, block_m2
+        )
+        self.min = np.minimum(self.min, prices.min(axis=0))
+        self.max = np.maximum(self.max, prices.max(axis=0))
+
+    def get_statistics(self) -> Dict[str, Dict]:
+        """返回每个品种的统计信息"""
+        stats = {}
+        for i, name in enumerate(self.instruments):
+            count = int(self.count[i])
+            if count == 0:
+                continue
+            stats[name] = {
+                'count': count,
+                'current_price': round(float(self.last_prices[i]), 2),
+                'min_price': round(float(self.min[i]), 2),
+                'max_price': round(float(self.max[i]), 2),
+                'avg_price': round(float(self.mean[i]), 2),
+                'price_std': round(float(np.sqrt(self.m2[i] / count)), 4)
+            }
+        return stats
+
+    def to_records(self, prices: np.ndarray, start: Optional[datetime] = None,
+                   step: timedelta = timedelta(seconds=1)) -> List[Dict]:
+        """把价格矩阵转换为与爬虫输出相同格式的记录列表"""
+        start = start or datetime.now()
+        records = []
+        rounded = np.round(prices, 2).tolist()
+        for row_index, row in enumerate(rounded):
+            timestamp = (start + step * row_index).isoformat()
+            for name, price in zip(self.instruments, row):
+                records.append({
+                    'source': name,
+                    'price': price,
+                    'timestamp': timestamp,
+                    'note': '此为模拟数据，仅供参考'
+                })
+        return records
+
+
 # 全局模拟数据源实例
 mock_source = MockGoldPriceSource()
 
@@ -81,7 +241,15 @@ if __name__ == "__main__":
     for i in range(5):
         price_data = get_mock_gold_price()
         print(f"模拟价格 {i+1}: {price_data['price']}元/克")
-    
+
     stats = get_mock_statistics()
     print("\n📊 模拟统计信息:")
     print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+    print("\n🔧 测试向量化合成价格生成器...")
+    generator = SyntheticPriceGenerator(
+        instruments=[f'合成品种-{i}' for i in range(10)],
+        jump_intensity=50.0, seed=42
+    )
+    generator.generate(100000)
+    print(json.dumps(generator.get_statistics(), ensure_ascii=False, indent=2))
@@ -0,0 +1,226 @@
+"""
+分区的 map-reduce 执行层
+历史数据天然按天分区：已轮转的压缩分段不可变，只有尚未轮转的 CSV（通常只有今天）会变化。
+统计时每个分区在进程池中按数据源计算部分聚合（计数、均值、二阶矩、最值、最新价），
+再用可合并的统计量归并；不可变分区的部分聚合结果缓存在磁盘上，
+之后的统计只需重新计算 CSV 分区。导出同样按分区并行解压、按顺序流式写出。
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from data_storage import CSV_COLUMNS, GoldPriceStorage
+from price_stats import RunningStats
+from segment_store import SegmentStore
+
+# 不可变分区部分聚合结果的缓存文件（位于分段目录下）
+PARTIALS_CACHE = 'partials.json'
+
+# 单个 Excel 工作表的最大行数（含表头）
+EXCEL_MAX_ROWS = 1048576
+
+
+def partial_cache_key(segment_dir: str, entry: Dict) -> str:
+    """分段部分聚合的缓存键：文件名加内容摘要
+
+    分段被替换后旧文件会删除，同一天的文件名可能被新内容复用，只用文件名做键会返回过期的结果。
+    旧索引项没有摘要时，用文件大小和修改时间代替。
+    """
+    digest = entry.get('digest')
+    if not digest:
+        try:
+            stat = os.stat(os.path.join(segment_dir, entry['file']))
+            digest = f"{stat.st_size}-{stat.st_mtime_ns}"
+        except OSError:
+            digest = str(entry.get('bytes'))
+    return f"{entry['file']}@{digest}"
+
+
+def compute_partial(df: pd.DataFrame) -> Dict:
+    """计算一个分区的部分聚合：总记录数、按数据源的统计量、最后一条有效价格"""
+    prices = pd.to_numeric(df['price'], errors='coerce')
+    valid = df.assign(price=prices)[prices.notna()]
+
+    sources = {}
+    if not valid.empty:
+        grouped = valid.groupby('source', sort=False)['price']
+        summary = pd.DataFrame({
+            'count': grouped.count(),
+            'mean': grouped.mean(),
+            'm2': grouped.var(ddof=0) * grouped.count(),
+            'min': grouped.min(),
+            'max': grouped.max()
+        })
+        for source, row in summary.iterrows():
+            sources[str(source)] = {
+                'count': int(row['count']),
+                'mean': float(row['mean']),
+                'm2': float(row['m2']),
+                'min': float(row['min']),
+                'max': float(row['max'])
+            }
+
+    last = valid.iloc[-1] if not valid.empty else None
+    return {
+        'total_records': len(df),
+        'sources': sources,
+        'last_price': float(last['price']) if last is not None else None,
+        'last_timestamp': str(last['timestamp']) if last is not None else None
+    }
+
+
+def _segment_partials(segment_dir: str, entries: List[Dict]) -> List[Dict]:
+    """在工作进程中解压一批分段并分别计算部分聚合"""
+    store = SegmentStore(segment_dir)
+    return [compute_partial(store.read_segment(entry, ['timestamp', 'source', 'price'])) for entry in entries]
+
+
+def _read_segment(segment_dir: str, entry: Dict) -> pd.DataFrame:
+    """在工作进程中解压一个分段"""
+    return SegmentStore(segment_dir).read_segment(entry)
+
+
+def merge_partials(partials: List[Dict]) -> Dict:
+    """按分区顺序合并部分聚合，返回与 GoldPriceStorage.compute_statistics 相同格式的统计信息"""
+    total_records = sum(partial['total_records'] for partial in partials)
+    by_source: Dict[str, RunningStats] = {}
+    last_price = last_timestamp = None
+    for partial in partials:
+        for source, data in partial['sources'].items():
+            by_source.setdefault(source, RunningStats()).merge(RunningStats.from_dict(data))
+        if partial['last_price'] is not None:
+            last_price, last_timestamp = partial['last_price'], partial['last_timestamp']
+
+    overall = RunningStats()
+    for stats in by_source.values():
+        overall.merge(stats)
+
+    if overall.count == 0:
+        return {
+            'total_records': total_records,
+            'valid_price_records': 0,
+            'message': '没有有效的价格数据'
+        }
+
+    counts = sorted(((source, stats.count) for source, stats in by_source.items()),
+                    key=lambda item: item[1], reverse=True)
+    return {
+        'total_records': total_records,
+        'valid_price_records': overall.count,
+        'current_price': last_price,
+        'min_price': overall.min,
+        'max_price': overall.max,
+        'avg_price': overall.mean,
+        'price_std': overall.std(ddof=1),
+        'data_sources': dict(counts),
+        'latest_update': last_timestamp
+    }
+
+
+class PartitionedExecutor:
+    """按分区并行执行统计和导出"""
+
+    def __init__(self, storage: Optional[GoldPriceStorage] = None, workers: Optional[int] = None):
+        self.storage = storage or GoldPriceStorage()
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_file = os.path.join(self.storage.segments.segment_dir, PARTIALS_CACHE)
+        self.logger = logging.getLogger(__name__)
+
+    def _load_cache(self) -> Dict[str, Dict]:
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, cache: Dict[str, Dict]):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
+
+    def _map(self, func, items: List) -> Iterator:
+        """对每个分段（或分段批次）并行执行 func，按顺序产出结果；只有一项时直接在本进程执行"""
+        segment_dir = self.storage.segments.segment_dir
+        if self.workers <= 1 or len(items) <= 1:
+            for item in items:
+                yield func(segment_dir, item)
+            return
+        # 限制同时在途的任务数，保证内存有界
+        max_in_flight = self.workers * 2
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending = []
+            for item in items:
+                pending.append(executor.submit(func, segment_dir, item))
+                if len(pending) >= max_in_flight:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+
+    def segment_partials(self) -> List[Dict]:
+        """所有分段的部分聚合（按时间顺序），未缓存的分段并行计算后写入缓存"""
+        entries = self.storage.segments.load_index()
+        segment_dir = self.storage.segments.segment_dir
+        keys = [partial_cache_key(segment_dir, entry) for entry in entries]
+        cache = self._load_cache()
+        missing = [(key, entry) for key, entry in zip(keys, entries) if key not in cache]
+
+        if missing:
+            # 单个分段的计算量很小，按批分发以减少进程间通信开销
+            batch_size = max(1, -(-len(missing) // (self.workers * 4)))
+            batches = [[entry for _, entry in missing[i:i + batch_size]]
+                       for i in range(0, len(missing), batch_size)]
+            partials = [partial for batch in self._map(_segment_partials, batches) for partial in batch]
+            for (key, _), partial in zip(missing, partials):
+                cache[key] = partial
+            self.logger.info("已计算 %s 个分区的部分聚合", len(missing))
+
+        # 分段被替换或删除后，旧内容的缓存项不再需要
+        live = set(keys)
+        if missing or len(cache) != len(live):
+            cache = {key: partial for key, partial in cache.items() if key in live}
+            self._save_cache(cache)
+
+        return [cache[key] for key in keys]
+
+    def statistics(self) -> Dict:
+        """全部历史的统计信息：分段使用缓存的部分聚合，只重新计算 CSV 分区"""
+        partials = self.segment_partials()
+        partials.append(compute_partial(pd.read_csv(self.storage.csv_file,
+                                                    usecols=['timestamp', 'source', 'price'])))
+        return merge_partials(partials)
+
+    def iter_history(self, chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+        """按时间顺序产出全部历史：分段在进程池中并行解压，CSV 分块读取"""
+        yield from self._map(_read_segment, self.storage.segments.load_index())
+        yield from pd.read_csv(self.storage.csv_file, chunksize=chunksize)
+
+    def export_to_excel(self, output_file: str) -> int:
+        """流式导出全部历史到 Excel（超过单表行数上限时自动分表），返回导出的记录数"""
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet, sheet_rows, sheet_index, exported = None, 0, 0, 0
+        for chunk in self.iter_history():
+            chunk = chunk.reindex(columns=CSV_COLUMNS)
+            rows = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+            for row in rows:
+                if sheet is None or sheet_rows >= EXCEL_MAX_ROWS:
+                    sheet_index += 1
+                    sheet = workbook.create_sheet(f"Sheet{sheet_index}")
+                    sheet.append(CSV_COLUMNS)
+                    sheet_rows = 1
+                sheet.append(row)
+                sheet_rows += 1
+                exported += 1
+
+        if sheet is None:
+            workbook.create_sheet("Sheet1").append(CSV_COLUMNS)
+        workbook.save(output_file)
+        return exported
@@ -0,0 +1,106 @@
+"""
+可合并的流式统计工具
+使用 Welford / Chan 算法在 O(1) 时间内维护计数、均值、方差、最值，
+支持标量和 numpy 数组（逐元素）两种形式，便于分块、分区后再合并
+"""
+
+import math
+from typing import Dict, Optional
+
+
+def merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """合并两组 (计数, 均值, 二阶中心矩)，参数可以是标量或 numpy 数组"""
+    n = n_a + n_b
+    # 避免除零：两组都为空时保持均值为 0
+    if hasattr(n, 'shape'):
+        safe_n = n.clip(min=1)
+    elif n == 0:
+        return 0, 0.0, 0.0
+    else:
+        safe_n = n
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / safe_n
+    m2 = m2_a + m2_b + delta * delta * n_a * n_b / safe_n
+    return n, mean, m2
+
+
+class RunningStats:
+    """O(1) 更新的运行统计量（计数 / 均值 / 方差 / 最小值 / 最大值）"""
+
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def update(self, value: float):
+        """加入一个新样本"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def update_batch(self, values):
+        """一次性加入一批样本（numpy 数组或序列）"""
+        import numpy as np
+
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+        self._merge_raw(values.size, batch_mean, batch_m2,
+                        float(values.min()), float(values.max()))
+
+    def merge(self, other: 'RunningStats') -> 'RunningStats':
+        """把另一个统计量合并进来（原地修改并返回自身）"""
+        if other.count:
+            self._merge_raw(other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    def _merge_raw(self, count, mean, m2, min_value, max_value):
+        self.count, self.mean, self.m2 = merge_moments(
+            self.count, self.mean, self.m2, count, mean, m2
+        )
+        self.min = min_value if self.min is None else min(self.min, min_value)
+        self.max = max_value if self.max is None else max(self.max, max_value)
+
+    def variance(self, ddof: int = 0) -> float:
+        """方差，ddof=0 为总体方差，ddof=1 为样本方差"""
+        if self.count - ddof <= 0:
+            return float('nan')
+        return self.m2 / (self.count - ddof)
+
+    def std(self, ddof: int = 0) -> float:
+        """标准差"""
+        variance = self.variance(ddof)
+        return math.sqrt(variance) if not math.isnan(variance) else variance
+
+    def to_dict(self) -> Dict:
+        """序列化为字典（用于缓存分区统计结果）"""
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'm2': self.m2,
+            'min': self.min,
+            'max': self.max
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'RunningStats':
+        """从字典恢复统计量"""
+        stats = cls()
+        stats.count = data['count']
+        stats.mean = data['mean']
+        stats.m2 = data['m2']
+        stats.min = data['min']
+        stats.max = data['max']
+        return stats
@@ -0,0 +1,375 @@
+"""
+实时价格推送服务
+由 GoldPriceScheduler 每次获取价格后直接推送到内存中的最新价格缓存，
+再通过 SSE (/events) 和 WebSocket (/ws) 广播给所有订阅者。
+
+每个客户端按数据源做合并（conflation）：客户端处理不过来时，
+同一数据源只保留最新的一条待发送消息，慢客户端不会拖慢其他客户端。
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import struct
+import threading
+import time
+from typing import Dict, Optional
+
+# WebSocket 握手使用的固定 GUID（RFC 6455）
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# 客户端长时间无数据时发送心跳的间隔（秒）
+KEEPALIVE_INTERVAL = 15.0
+
+# 单次发送等待客户端接收的最长时间（秒），超时则断开该客户端
+DRAIN_TIMEOUT = 10.0
+
+# 客户端 WebSocket 帧的最大负载字节数（客户端只需发送 ping / close 等小帧），超过时以 1009 关闭
+MAX_WS_FRAME_BYTES = 4096
+
+# 支持的 WebSocket 协议版本
+WEBSOCKET_VERSION = '13'
+
+
+class LatestPriceCache:
+    """线程安全的最新价格缓存（每个数据源保留最新一条）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prices: Dict[str, Dict] = {}
+        self.version = 0
+
+    def update(self, price_data: Dict) -> int:
+        """更新缓存，返回新的版本号"""
+        with self._lock:
+            self.version += 1
+            self._prices[price_data.get('source', '')] = dict(price_data)
+            return self.version
+
+    def snapshot(self) -> Dict:
+        """返回当前所有数据源的最新价格快照"""
+        with self._lock:
+            return {
+                'version': self.version,
+                'prices': dict(self._prices)
+            }
+
+    def latest(self) -> Optional[Dict]:
+        """返回最近一次更新的价格"""
+        with self._lock:
+            if not self._prices:
+                return None
+            return max(self._prices.values(), key=lambda item: item.get('timestamp', ''))
+
+
+def _encode_ws_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    """编码一个服务端 WebSocket 帧（不加掩码）"""
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + struct.pack('!H', length)
+    else:
+        header += bytes([127]) + struct.pack('!Q', length)
+    return header + payload
+
+
+class WebSocketProtocolError(Exception):
+    """客户端违反 WebSocket 协议，连接需要以 code 关闭"""
+
+    def __init__(self, code: int, reason: str):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+
+
+def _valid_websocket_key(key: str) -> bool:
+    """Sec-WebSocket-Key 必须是 16 字节随机数的 base64 编码"""
+    try:
+        return len(base64.b64decode(key, validate=True)) == 16
+    except ValueError:
+        return False
+
+
+async def _read_ws_frame(reader: asyncio.StreamReader):
+    """读取一个客户端 WebSocket 帧，返回 (opcode, payload)
+
+    未加掩码的帧按协议错误（1002）、负载超过 MAX_WS_FRAME_BYTES 的帧按消息过大（1009）
+    抛出 WebSocketProtocolError，超大的负载不会被读入内存。
+    """
+    first, second = await reader.readexactly(2)
+    opcode = first & 0x0F
+    masked = second & 0x80
+    length = second & 0x7F
+    if not masked:
+        raise WebSocketProtocolError(1002, 'client frames must be masked')
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if length > MAX_WS_FRAME_BYTES:
+        raise WebSocketProtocolError(1009, 'frame too large')
+    mask = await reader.readexactly(4)
+    payload = await reader.readexactly(length)
+    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+class _Subscriber:
+    """单个订阅客户端：按数据源合并的待发送消息 + 唤醒事件"""
+
+    def __init__(self, protocol: str, writer: asyncio.StreamWriter):
+        self.protocol = protocol
+        self.writer = writer
+        self.pending: Dict[str, bytes] = {}
+        self.event = asyncio.Event()
+        self.sent = 0
+        self.conflated = 0
+
+    def offer(self, key: str, message: bytes):
+        """放入一条消息，同一数据源未发送的旧消息会被覆盖"""
+        if key in self.pending:
+            self.conflated += 1
+        self.pending[key] = message
+        self.event.set()
+
+
+class PriceStreamServer:
+    """基于 asyncio 的 SSE / WebSocket 价格推送服务"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765,
+                 cache: Optional[LatestPriceCache] = None):
+        self.host = host
+        self.port = port
+        self.cache = cache or LatestPriceCache()
+        self.logger = logging.getLogger(__name__)
+
+        self._subscribers = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+        # 监听失败（例如端口已被占用）时的异常，由 start() 在调用线程中抛出
+        self._start_error: Optional[BaseException] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self.dropped_clients = 0
+        self.started_at: Optional[float] = None
+
+    # ---- 发布接口（可在任意线程调用） ----
+
+    def publish(self, price_data: Dict):
+        """发布一条价格数据，可直接作为 GoldPriceScheduler 的监听器"""
+        version = self.cache.update(price_data)
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._broadcast, price_data, version)
+
+    def _broadcast(self, price_data: Dict, version: int):
+        """在事件循环线程中把消息投递给所有订阅者（每种协议只编码一次）"""
+        if not self._subscribers:
+            return
+        key = price_data.get('source', '')
+        body = json.dumps({'version': version, 'data': price_data},
+                          ensure_ascii=False, default=str).encode('utf-8')
+        messages = {
+            'sse': b'id: %d\nevent: price\ndata: ' % version + body + b'\n\n',
+            'ws': _encode_ws_frame(body)
+        }
+        for subscriber in self._subscribers:
+            subscriber.offer(key, messages[subscriber.protocol])
+
+    # ---- 连接处理 ----
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            raw_headers = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=10)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+
+        lines = raw_headers.decode('latin-1').split('\r\n')
+        parts = lines[0].split(' ')
+        path = parts[1].split('?')[0] if len(parts) > 1 else '/'
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            if path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                await self._serve_websocket(reader, writer, headers)
+            elif path == '/events':
+                await self._serve_sse(writer)
+            elif path == '/latest':
+                await self._serve_json(writer, self.cache.snapshot())
+            elif path == '/status':
+                await self._serve_json(writer, self.get_status())
+            else:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # 客户端断开或服务关闭
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_json(self, writer: asyncio.StreamWriter, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json; charset=utf-8\r\n'
+                     b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(body) + body)
+        await writer.drain()
+
+    async def _serve_sse(self, writer: asyncio.StreamWriter):
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n'
+                     b'Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n')
+        subscriber = self._subscribe('sse', writer)
+        try:
+            await self._pump(subscriber, keepalive=b': keepalive\n\n')
+        finally:
+            self._subscribers.discard(subscriber)
+
+    async def _serve_websocket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: Dict):
+        key = headers.get('sec-websocket-key', '')
+        if headers.get('sec-websocket-version') != WEBSOCKET_VERSION:
+            writer.write(b'HTTP/1.1 426 Upgrade Required\r\nSec-WebSocket-Version: 13\r\n'
+                         b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+            await writer.drain()
+            return
+        if not _valid_websocket_key(key):
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            await writer.drain()
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest())
+        writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                     b'Connection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        subscriber = self._subscribe('ws', writer)
+        pump = asyncio.ensure_future(self._pump(subscriber, keepalive=_encode_ws_frame(b'', opcode=0x9)))
+        try:
+            # 读取客户端帧：处理 ping / close，忽略其他消息
+            while not pump.done():
+                read = asyncio.ensure_future(_read_ws_frame(reader))
+                done, _ = await asyncio.wait({read, pump}, return_when=asyncio.FIRST_COMPLETED)
+                if read not in done:
+                    read.cancel()
+                    break
+                try:
+                    opcode, payload = read.result()
+                except WebSocketProtocolError as e:
+                    self.logger.warning("WebSocket 客户端协议错误，关闭连接: %s", e.reason)
+                    writer.write(_encode_ws_frame(struct.pack('!H', e.code) + e.reason.encode(), opcode=0x8))
+                    break
+                if opcode == 0x8:
+                    writer.write(_encode_ws_frame(payload[:2], opcode=0x8))
+                    break
+                if opcode == 0x9:
+                    writer.write(_encode_ws_frame(payload, opcode=0xA))
+        finally:
+            pump.cancel()
+            self._subscribers.discard(subscriber)
+
+    def _subscribe(self, protocol: str, writer: asyncio.StreamWriter) -> _Subscriber:
+        """注册订阅者，并先发送当前快照"""
+        subscriber = _Subscriber(protocol, writer)
+        snapshot = self.cache.snapshot()
+        for data in snapshot['prices'].values():
+            body = json.dumps({'version': snapshot['version'], 'data': data},
+                              ensure_ascii=False, default=str).encode('utf-8')
+            if protocol == 'sse':
+                message = b'id: %d\nevent: price\ndata: ' % snapshot['version'] + body + b'\n\n'
+            else:
+                message = _encode_ws_frame(body)
+            subscriber.offer(data.get('source', ''), message)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    async def _pump(self, subscriber: _Subscriber, keepalive: bytes):
+        """把订阅者的待发送消息写出；drain 超时的慢客户端会被断开"""
+        writer = subscriber.writer
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.event.wait(), timeout=KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                writer.write(keepalive)
+            else:
+                subscriber.event.clear()
+                pending, subscriber.pending = subscriber.pending, {}
+                writer.write(b''.join(pending.values()))
+                subscriber.sent += len(pending)
+
+            try:
+                await asyncio.wait_for(writer.drain(), timeout=DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.dropped_clients += 1
+                self.logger.warning("推送客户端长时间未接收数据，已断开")
+                return
+
+    # ---- 生命周期 ----
+
+    async def _run(self):
+        self._stop_event = asyncio.Event()
+        try:
+            self._server = await asyncio.start_server(
+                self._handle_connection, self.host, self.port, backlog=4096
+            )
+        except OSError as e:
+            self._start_error = e
+            self._started.set()
+            return
+        self.started_at = time.time()
+        self._started.set()
+
+        await self._stop_event.wait()
+
+        # 先停止接收新连接，再取消所有连接任务并等待其退出
+        self._server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def start(self):
+        """在后台线程中启动推送服务，监听成功后才返回；端口被占用等监听失败时抛出 OSError"""
+        def runner():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self._run())
+            finally:
+                self._loop.close()
+
+        self._started.clear()
+        self._start_error = None
+        self._thread = threading.Thread(target=runner, daemon=True)
+        self._thread.start()
+        if not self._started.wait(timeout=5):
+            self.stop()
+            raise TimeoutError(f"价格推送服务启动超时: {self.host}:{self.port}")
+        if self._start_error is not None:
+            self._thread.join(timeout=5)
+            self.logger.error("价格推送服务监听 %s:%s 失败: %s", self.host, self.port, self._start_error)
+            raise OSError(f"价格推送服务无法监听 {self.host}:{self.port}: {self._start_error}") from self._start_error
+        self.logger.info("价格推送服务已启动: http://%s:%s", self.host, self.port)
+        print(f"📡 价格推送服务已启动: SSE http://{self.host}:{self.port}/events, "
+              f"WebSocket ws://{self.host}:{self.port}/ws")
+
+    def stop(self):
+        """停止推送服务"""
+        if self._loop is not None and self._stop_event is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.logger.info("价格推送服务已停止")
+
+    def get_status(self) -> Dict:
+        """获取推送服务状态"""
+        return {
+            'subscribers': len(self._subscribers),
+            'version': self.cache.version,
+            'dropped_clients': self.dropped_clients,
+            'conflated_messages': sum(s.conflated for s in self._subscribers),
+            'started_at': self.started_at
+        }
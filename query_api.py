@@ -0,0 +1,332 @@
+"""
+历史价格只读查询 HTTP API
+提供最新价格、按时间/数据源的范围查询、OHLC K线和统计摘要。
+
+响应按数据版本（历史数据文件和分层汇总的修改时间）缓存，并带有 ETag：
+数据未变化时，重复的看板轮询直接由内存响应或返回 304；
+大范围查询分页返回，或以 NDJSON 分块流式输出，不在内存中构建完整结果。
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from data_storage import GoldPriceStorage
+from partitioned_exec import PartitionedExecutor, compute_partial, merge_partials
+from retention import TieredRetention
+
+# 单页最大记录数
+MAX_PAGE_SIZE = 5000
+
+# OHLC 支持的周期（查询参数 -> pandas 频率）
+OHLC_FREQUENCIES = {
+    '1min': '1min',
+    '5min': '5min',
+    '15min': '15min',
+    '1h': '1h',
+    '4h': '4h',
+    '1d': '1D'
+}
+
+
+def _json_default(value):
+    """把 numpy / pandas 类型转换为 JSON 可序列化的值"""
+    if hasattr(value, 'item'):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return str(value)
+
+
+def _clean_records(df: pd.DataFrame):
+    """把数据表转换为记录列表，NaN 转为 None"""
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+class ResponseCache:
+    """按数据版本失效的 LRU 响应缓存"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, version: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, version: str, body: bytes):
+        with self._lock:
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class PriceQueryService:
+    """查询逻辑：与 HTTP 层分离，便于在进程内直接调用"""
+
+    def __init__(self, storage: Optional[GoldPriceStorage] = None):
+        self.storage = storage or GoldPriceStorage()
+        self.retention = TieredRetention(self.storage)
+
+    def get_data_version(self) -> str:
+        """原始数据和分层汇总的联合版本标识"""
+        return f"{self.storage.get_data_version()}-{self.retention.get_version()}"
+
+    def latest(self, params: Dict) -> Dict:
+        """每个数据源的最新有效价格
+
+        先从最近记录缓存中找；缓存里没有有效价格的数据源再读取 CSV，
+        最后从最新的压缩分段往前找，所有数据源都找到后即停止，不读取全部历史。
+        """
+        source = params.get('source')
+        recent = self.storage.recent
+        # 读取一次以完成预热或同步其他进程追加的记录
+        self.storage.get_recent_prices(1, source)
+        latest = {}
+        for name in ([source] if source else recent.sources()):
+            for record in reversed(self.storage.get_recent_prices(recent.capacity, name)):
+                if record.get('price') is not None:
+                    latest[name] = record
+                    break
+
+        entries = self.storage.segments.select(source=source)
+        if source:
+            missing = {source}
+        else:
+            missing = {name for entry in entries for name in entry['sources']}
+            missing.update(recent.sources())
+        missing.difference_update(latest)
+        if not missing:
+            return {'prices': latest}
+
+        # CSV 比所有分段都新，其中的有效价格优先
+        for chunk in pd.read_csv(self.storage.csv_file, chunksize=50000):
+            valid = chunk[chunk['price'].notna() & chunk['source'].astype(str).isin(missing)]
+            for record in _clean_records(valid.drop_duplicates('source', keep='last')):
+                latest[str(record['source'])] = record
+        missing.difference_update(latest)
+
+        # 分段按结束时间从新到旧读取；已找到的价格不早于剩余分段的结束时间时即为最终结果
+        found = {}
+        for entry in sorted(entries, key=lambda item: item['end'], reverse=True):
+            end = pd.Timestamp(entry['end'])
+            missing.difference_update(name for name, ts in found.items() if ts >= end)
+            if not missing:
+                break
+            if not missing.intersection(entry['sources']):
+                continue
+            df = self.storage.segments.read_segment(entry)
+            df = df[df['price'].notna() & df['source'].astype(str).isin(missing)]
+            for record in _clean_records(df.drop_duplicates('source', keep='last')):
+                name = str(record['source'])
+                ts = pd.Timestamp(record['timestamp'])
+                if name not in found or ts > found[name]:
+                    found[name] = ts
+                    latest[name] = record
+        return {'prices': latest}
+
+    def recent(self, params: Dict) -> Dict:
+        """最近的若干条记录（来自存储的内存缓存，不读取历史文件）"""
+        limit = min(max(int(params.get('limit', 10)), 1), MAX_PAGE_SIZE)
+        return {'records': self.storage.get_recent_prices(limit, params.get('source'))}
+
+    def prices(self, params: Dict) -> Dict:
+        """分页的范围查询"""
+        page = max(int(params.get('page', 1)), 1)
+        page_size = min(max(int(params.get('page_size', 500)), 1), MAX_PAGE_SIZE)
+        skip = (page - 1) * page_size
+
+        records = []
+        total = 0
+        for chunk in self.storage.iter_price_chunks(params.get('start'), params.get('end'),
+                                                    params.get('source')):
+            chunk_len = len(chunk)
+            # 只截取当前页落在本块中的部分
+            lo = max(skip - total, 0)
+            hi = min(skip + page_size - total, chunk_len)
+            if lo < hi:
+                records.extend(_clean_records(chunk.iloc[lo:hi]))
+            total += chunk_len
+
+        return {
+            'page': page,
+            'page_size': page_size,
+            'total': total,
+            'pages': (total + page_size - 1) // page_size,
+            'records': records
+        }
+
+    def iter_ndjson(self, params: Dict):
+        """以 NDJSON 逐块输出范围查询结果"""
+        for chunk in self.storage.iter_price_chunks(params.get('start'), params.get('end'),
+                                                    params.get('source')):
+            lines = [json.dumps(record, ensure_ascii=False, default=_json_default)
+                     for record in _clean_records(chunk)]
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def ohlc(self, params: Dict) -> Dict:
+        """按周期聚合的 OHLC K线（按数据源分组）"""
+        freq_key = params.get('freq', '1h')
+        if freq_key not in OHLC_FREQUENCIES:
+            raise ValueError(f"不支持的周期: {freq_key}，可选: {', '.join(OHLC_FREQUENCIES)}")
+        freq = OHLC_FREQUENCIES[freq_key]
+
+        # 自动选择满足周期的最粗汇总层，尚未汇总的部分由原始数据补齐
+        result = self.retention.query(params.get('start'), params.get('end'), freq, params.get('source'))
+
+        bars = {}
+        for row in result.itertuples(index=False):
+            bars.setdefault(row.source, []).append({
+                'time': row.time.isoformat(),
+                'open': row.open,
+                'high': row.high,
+                'low': row.low,
+                'close': row.close,
+                'count': int(row.count)
+            })
+        return {'freq': freq_key, 'tiers': result.attrs.get('tiers', []), 'bars': bars}
+
+    def stats(self, params: Dict) -> Dict:
+        """统计摘要（与 GoldPriceStorage.get_price_statistics 格式一致）
+
+        逐块计算可合并的部分聚合再归并，不把整个范围载入内存；
+        不带过滤条件时直接使用分区执行器（不可变分段的部分聚合有磁盘缓存）。
+        """
+        start, end, source = params.get('start'), params.get('end'), params.get('source')
+        executor = PartitionedExecutor(self.storage, workers=1)
+        if not (start or end or source):
+            return executor.statistics()
+        return merge_partials([compute_partial(chunk[['timestamp', 'source', 'price']])
+                               for chunk in self.storage.iter_price_chunks(start, end, source)])
+
+
+class PriceQueryHandler(BaseHTTPRequestHandler):
+    """HTTP 请求处理器"""
+
+    server_version = 'GoldPriceQueryAPI/1.0'
+    # 分块传输和长连接需要 HTTP/1.1
+    protocol_version = 'HTTP/1.1'
+
+    routes = {
+        '/api/latest': 'latest',
+        '/api/recent': 'recent',
+        '/api/prices': 'prices',
+        '/api/ohlc': 'ohlc',
+        '/api/stats': 'stats'
+    }
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug("%s - %s", self.address_string(), format % args)
+
+    def _parse(self) -> Tuple[str, Dict]:
+        parsed = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        return parsed.path, params
+
+    def do_GET(self):
+        path, params = self._parse()
+        service: PriceQueryService = self.server.service
+        cache: ResponseCache = self.server.cache
+
+        if path not in self.routes:
+            self._send_json(404, {'error': f'未知接口: {path}', 'endpoints': list(self.routes)})
+            return
+
+        version = service.get_data_version()
+        cache_key = path + '?' + '&'.join(f'{k}={params[k]}' for k in sorted(params))
+        etag = '"%s"' % hashlib.sha1(f'{version}|{cache_key}'.encode('utf-8')).hexdigest()[:20]
+
+        # 数据未变化：直接返回 304，不读取任何数据
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        try:
+            if path == '/api/prices' and params.get('format') == 'ndjson':
+                self._send_stream(service.iter_ndjson(params), etag)
+                return
+
+            body = cache.get(cache_key, version)
+            if body is None:
+                result = getattr(service, self.routes[path])(params)
+                result['data_version'] = version
+                body = json.dumps(result, ensure_ascii=False, default=_json_default).encode('utf-8')
+                cache.put(cache_key, version, body)
+            self._send_body(200, body, etag)
+
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            logging.error("查询接口 %s 出错: %s", path, e)
+            self._send_json(500, {'error': str(e)})
+
+    def _send_body(self, status: int, body: bytes, etag: Optional[str] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Dict):
+        self._send_body(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+    def _send_stream(self, chunks, etag: str):
+        """使用 HTTP/1.1 分块传输编码流式输出"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(b'%x\r\n' % len(chunk) + chunk + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class PriceQueryServer(ThreadingHTTPServer):
+    """多线程的历史价格查询服务"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8080,
+                 storage: Optional[GoldPriceStorage] = None, cache_entries: int = 256):
+        self.service = PriceQueryService(storage)
+        self.cache = ResponseCache(cache_entries)
+        super().__init__((host, port), PriceQueryHandler)
+
+
+def run_query_api(host: str = '127.0.0.1', port: int = 8080, storage: Optional[GoldPriceStorage] = None):
+    """启动查询 API（阻塞运行）"""
+    server = PriceQueryServer(host, port, storage)
+    print(f"🌐 历史价格查询 API 已启动: http://{host}:{port}/api/latest")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 正在停止查询 API...")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    run_query_api()
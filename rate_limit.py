@@ -0,0 +1,229 @@
+"""
+按主机限流
+所有 HTTP 数据源共用一个限流器：每个主机一个令牌桶，遵守 429/503 响应的 Retry-After，
+被限流的主机在冷却期内直接跳过，而不是每次都等待一个完整的超时。
+限流器记录每个主机的请求预算使用情况，用于确定在各提供方限额内能达到的最高轮询频率。
+"""
+
+import email.utils
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+# 各主机的请求限额（每分钟请求数, 突发容量）
+HOST_LIMITS: Dict[str, Dict[str, float]] = {
+    # 免费/demo 密钥每分钟最多 5 次
+    'www.alphavantage.co': {'rate_per_minute': 5, 'burst': 1},
+    'api.metalpriceapi.com': {'rate_per_minute': 5, 'burst': 1},
+    'www.sge.com.cn': {'rate_per_minute': 6, 'burst': 2},
+    'mybank.icbc.com.cn': {'rate_per_minute': 6, 'burst': 2},
+    'www.boc.cn': {'rate_per_minute': 6, 'burst': 2},
+    'www.ccb.com': {'rate_per_minute': 6, 'burst': 2},
+}
+
+# 未单独配置的主机使用的限额
+DEFAULT_HOST_LIMIT = {'rate_per_minute': 30, 'burst': 5}
+
+# 触发限流的状态码
+THROTTLE_STATUS_CODES = (429, 503)
+
+# 没有 Retry-After 时的退避时间（秒），连续被限流时加倍
+DEFAULT_BACKOFF = 60.0
+MAX_BACKOFF = 3600.0
+
+
+class RateLimitExceeded(Exception):
+    """主机的请求预算已用完或处于冷却期，本次请求被跳过"""
+
+    def __init__(self, host: str, wait: float):
+        super().__init__(f"{host} 已被限流，需等待 {wait:.1f} 秒")
+        self.host = host
+        self.wait = wait
+
+
+class TokenBucket:
+    """线程安全的令牌桶"""
+
+    def __init__(self, rate_per_minute: float, burst: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """预订一个令牌，返回需要等待的秒数；等待时间超过 max_wait 时不预订，返回 None"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class HostRateLimiter:
+    """按主机的令牌桶限流器，并记录各主机的预算使用情况"""
+
+    def __init__(self, host_limits: Optional[Dict[str, Dict[str, float]]] = None,
+                 default_limit: Optional[Dict[str, float]] = None, max_wait: float = 2.0):
+        self.host_limits = dict(HOST_LIMITS if host_limits is None else host_limits)
+        self.default_limit = dict(default_limit or DEFAULT_HOST_LIMIT)
+        # 令牌需要等待超过 max_wait 秒时直接跳过本次请求
+        self.max_wait = max_wait
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._blocked_until: Dict[str, float] = {}
+        self._strikes: Dict[str, int] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def limit_for(self, host: str) -> Dict[str, float]:
+        return self.host_limits.get(host, self.default_limit)
+
+    def _bucket(self, host: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                limit = self.limit_for(host)
+                bucket = self._buckets[host] = TokenBucket(limit['rate_per_minute'], limit['burst'])
+                self._stats[host] = {'requests': 0, 'waited_s': 0.0, 'rejected': 0, 'throttled': 0}
+            return bucket
+
+    def acquire(self, host: str, max_wait: Optional[float] = None):
+        """为一次请求取得令牌，必要时短暂等待；处于冷却期或需要等待太久时抛出 RateLimitExceeded"""
+        bucket = self._bucket(host)
+        max_wait = self.max_wait if max_wait is None else max_wait
+        stats = self._stats[host]
+
+        blocked_for = self._blocked_until.get(host, 0) - time.monotonic()
+        if blocked_for > 0:
+            stats['rejected'] += 1
+            raise RateLimitExceeded(host, blocked_for)
+
+        wait = bucket.reserve(max_wait)
+        if wait is None:
+            stats['rejected'] += 1
+            raise RateLimitExceeded(host, 1 / bucket.rate)
+        if wait > 0:
+            time.sleep(wait)
+            stats['waited_s'] += wait
+        stats['requests'] += 1
+
+    def record_response(self, host: str, status_code: int, retry_after: Optional[str] = None):
+        """根据响应状态更新冷却期：429/503 时按 Retry-After（或指数退避）暂停该主机"""
+        self._bucket(host)
+        if status_code not in THROTTLE_STATUS_CODES:
+            self._strikes.pop(host, None)
+            return
+
+        strikes = self._strikes.get(host, 0) + 1
+        self._strikes[host] = strikes
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = min(DEFAULT_BACKOFF * 2 ** (strikes - 1), MAX_BACKOFF)
+        self._blocked_until[host] = time.monotonic() + delay
+        self._stats[host]['throttled'] += 1
+        self.logger.warning("%s 返回 %s，暂停请求 %.0f 秒", host, status_code, delay)
+
+    def report(self) -> Dict[str, Dict]:
+        """各主机的限额、剩余令牌和累计使用情况"""
+        now = time.monotonic()
+        result = {}
+        for host in sorted(self._buckets):
+            limit = self.limit_for(host)
+            result[host] = {
+                'rate_per_minute': limit['rate_per_minute'],
+                'burst': limit['burst'],
+                'tokens': round(self._buckets[host].available(), 2),
+                'blocked_for_s': round(max(0.0, self._blocked_until.get(host, 0) - now), 1),
+                **{key: round(value, 3) for key, value in self._stats[host].items()}
+            }
+        return result
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).hostname or ''
+
+
+class RateLimitedSession(requests.Session):
+    """每次请求前经过按主机限流的 Session"""
+
+    def __init__(self, limiter: Optional[HostRateLimiter] = None):
+        super().__init__()
+        self.limiter = limiter or get_default_limiter()
+
+    def request(self, method, url, *args, **kwargs):
+        host = host_of(url)
+        self.limiter.acquire(host)
+        response = super().request(method, url, *args, **kwargs)
+        self.limiter.record_response(host, response.status_code, response.headers.get('Retry-After'))
+        return response
+
+
+def budget_report(limiter: Optional[HostRateLimiter] = None, registry=None) -> Dict[str, Dict]:
+    """按主机汇总请求预算：限额、该主机上的数据源以及能支持的最短轮询间隔
+
+    min_interval_s 假设每轮都会请求该主机上的所有数据源（最坏情况）。
+    """
+    from source_registry import get_registry
+
+    limiter = limiter or get_default_limiter()
+    registry = registry or get_registry()
+    usage = limiter.report()
+
+    hosts: Dict[str, Dict] = {}
+    for source in registry:
+        host = host_of(source.url)
+        entry = hosts.setdefault(host, {'sources': [], **limiter.limit_for(host)})
+        entry['sources'].append(source.name)
+
+    for host, entry in hosts.items():
+        entry['min_interval_s'] = round(60.0 * len(entry['sources']) / entry['rate_per_minute'], 1)
+        entry.update({key: value for key, value in usage.get(host, {}).items()
+                      if key not in ('rate_per_minute', 'burst')})
+    return hosts
+
+
+_default_limiter: Optional[HostRateLimiter] = None
+_default_lock = threading.Lock()
+
+
+def get_default_limiter() -> HostRateLimiter:
+    """进程内共享的限流器（爬虫、银行、API 模块的请求共用同一组令牌桶）"""
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = HostRateLimiter()
+        return _default_limiter
@@ -0,0 +1,186 @@
+"""
+原始响应归档与离线重新提取
+开启原始响应采集后，爬虫获取的每个页面按内容寻址（SHA-256）压缩保存，
+并在采集日志中记录对应的数据源、时间戳和当时提取到的价格。
+网站改版导致一段时间内提取错误时，可以用当前的提取规则在进程池中并行重新提取
+已归档的页面，并改写受影响的记录，无需重新抓取。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+import zstandard
+
+from data_storage import GoldPriceStorage
+
+# 采集日志文件名
+CAPTURE_LOG = 'captures.jsonl'
+
+
+class RawArchive:
+    """按内容寻址的压缩原始响应归档"""
+
+    def __init__(self, archive_dir: str = os.path.join("data", "raw"), compression_level: int = 10):
+        self.archive_dir = archive_dir
+        self.objects_dir = os.path.join(archive_dir, 'objects')
+        self.capture_log = os.path.join(archive_dir, CAPTURE_LOG)
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest[2:] + '.zst')
+
+    def put(self, body: bytes) -> str:
+        """保存一个响应体，返回其 SHA-256；相同内容只保存一次"""
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(zstandard.ZstdCompressor(level=self.compression_level).compress(body))
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        """读取并解压一个响应体"""
+        with open(self._object_path(digest), 'rb') as f:
+            return zstandard.ZstdDecompressor().decompress(f.read())
+
+    def capture(self, body: bytes, source: str, url: str, timestamp: str,
+                encoding: Optional[str] = None, price: Optional[float] = None) -> Dict:
+        """归档一次获取的响应体并追加采集日志"""
+        entry = {
+            'timestamp': timestamp,
+            'source': source,
+            'url': url,
+            'sha256': self.put(body),
+            'bytes': len(body),
+            'encoding': encoding or 'utf-8',
+            'price': price
+        }
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        # 整行一次写入 O_APPEND 文件，多个进程同时采集也不会交错
+        with self._lock:
+            fd = os.open(self.capture_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode('utf-8'))
+            finally:
+                os.close(fd)
+        return entry
+
+    def iter_captures(self, start: Optional[str] = None, end: Optional[str] = None,
+                      source: Optional[str] = None) -> Iterator[Dict]:
+        """按时间范围和数据源遍历采集日志"""
+        if not os.path.exists(self.capture_log):
+            return
+        start_ts = pd.to_datetime(start) if start else None
+        end_ts = pd.to_datetime(end) if end else None
+
+        with open(self.capture_log, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if source and entry.get('source') != source:
+                    continue
+                if start_ts is not None or end_ts is not None:
+                    captured_at = pd.Timestamp(entry['timestamp'])
+                    if start_ts is not None and captured_at < start_ts:
+                        continue
+                    if end_ts is not None and captured_at > end_ts:
+                        continue
+                yield entry
+
+
+def reextract_capture(archive_dir: str, entry: Dict) -> Dict:
+    """在工作进程中用当前的提取规则重新提取一个归档页面"""
+    from source_registry import get_registry
+
+    result = {'timestamp': entry['timestamp'], 'source': entry['source'],
+              'old_price': entry.get('price'), 'price': None, 'raw_text': None, 'error': None}
+    source = get_registry().get(entry['source'])
+    if source is None or source.kind != 'html':
+        result['error'] = f"数据源已不存在: {entry['source']}"
+        return result
+
+    try:
+        body = RawArchive(archive_dir).get(entry['sha256'])
+        extracted = source.extract_html(body.decode(entry.get('encoding') or 'utf-8', errors='replace'))
+    except Exception as e:
+        result['error'] = str(e)
+        return result
+
+    if extracted:
+        result['price'], result['raw_text'] = extracted
+    return result
+
+
+def _reextract_batch(archive_dir: str, entries: List[Dict]) -> List[Dict]:
+    return [reextract_capture(archive_dir, entry) for entry in entries]
+
+
+def reprocess_archive(archive: Optional[RawArchive] = None, storage: Optional[GoldPriceStorage] = None,
+                      start: Optional[str] = None, end: Optional[str] = None, source: Optional[str] = None,
+                      workers: Optional[int] = None, batch_size: int = 200, dry_run: bool = False) -> Dict:
+    """用当前提取规则并行重新提取归档页面，并改写提取结果发生变化的记录，返回处理报告"""
+    archive = archive or RawArchive()
+    storage = storage or GoldPriceStorage()
+    workers = workers or os.cpu_count() or 1
+    logger = logging.getLogger(__name__)
+
+    started = time.perf_counter()
+    captures = list(archive.iter_captures(start, end, source))
+    batches = [captures[i:i + batch_size] for i in range(0, len(captures), batch_size)]
+
+    changed, failed = [], 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_reextract_batch, archive.archive_dir, batch) for batch in batches]
+        for future in futures:
+            for result in future.result():
+                if result['error']:
+                    failed += 1
+                    logger.warning("重新提取 %s %s 失败: %s", result['source'], result['timestamp'],
+                                   result['error'])
+                elif result['price'] is not None and result['price'] != result['old_price']:
+                    changed.append(result)
+
+    records = [{
+        'timestamp': result['timestamp'],
+        'source': result['source'],
+        'price': result['price'],
+        'raw_text': result['raw_text'],
+        'error': None,
+        'note': '离线重新提取'
+    } for result in changed]
+
+    written = {'updated': 0, 'inserted': 0}
+    if records and not dry_run:
+        written = storage.replace_records(records)
+        # 改写的记录可能已经汇总进 K线，重新汇总受影响的时间桶
+        from retention import note_backfill
+        timestamps = pd.to_datetime([record['timestamp'] for record in records], format='ISO8601')
+        note_backfill(storage, timestamps.min(), timestamps.max())
+
+    report = {
+        'captures': len(captures),
+        'changed': len(changed),
+        'failed': failed,
+        'updated': written['updated'],
+        'inserted': written['inserted'],
+        'dry_run': dry_run,
+        'elapsed_s': round(time.perf_counter() - started, 3)
+    }
+    logger.info("离线重新提取完成: %s", report)
+    return report
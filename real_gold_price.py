@@ -1,21 +1,94 @@
 """
 获取真实黄金价格的实用解决方案
 结合多个数据源，提供稳定的黄金价格获取功能
+
+默认按银行、金融 API 的顺序返回第一个可用的价格。
+共识模式在截止时间内并发查询注册表中的全部数据源，把各报价统一换算为水贝金价（元/克，银行和 API 按加价系数估算），
+以中位数/MAD 加权得到稳健估计，并标记偏离过大的离群报价；示例价格（页面可访问但未能解析）不参与估计。
 """
 
 import json
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from bank_gold_price import BankGoldPrice
+from fx_rate import FXRateCache
+from gold_api import GoldPriceAPI
+from rate_limit import RateLimitedSession, RateLimitExceeded
+from source_registry import ESTIMATE_SUFFIXES, CompiledSource, SourceRegistry, get_registry
+
+logger = logging.getLogger(__name__)
+
+# 共识模式等待各数据源的截止时间（秒），超时未返回的数据源不参与本次估计
+DEFAULT_CONSENSUS_DEADLINE = 8.0
+
+# MAD 换算为标准差的系数（正态分布下的一致估计）
+MAD_SCALE = 1.4826
+
+# 偏离中位数超过多少个尺度判为离群（同时是 Tukey 双权重的截断点）
+OUTLIER_THRESHOLD = 3.5
+
+# 报价几乎一致时 MAD 接近 0，尺度至少取中位数的 0.2%，避免把正常的小幅差异判为离群
+MIN_RELATIVE_SCALE = 0.002
+
+# 共识价格记录的数据源名称
+CONSENSUS_SOURCE = '多源共识'
+
+
+def robust_consensus(prices: Sequence[float]) -> Dict:
+    """中位数/MAD 加权的稳健估计
+
+    以中位数为中心、MAD（不小于中位数的 MIN_RELATIVE_SCALE）为尺度计算各报价的偏离，
+    超过 OUTLIER_THRESHOLD 的判为离群、权重为 0，其余按 Tukey 双权重加权平均。
+    返回估计值、中位数、尺度以及各报价的权重和离群标记。
+    """
+    values = np.asarray(prices, dtype=float)
+    median = float(np.median(values))
+    mad = float(np.median(np.abs(values - median))) * MAD_SCALE
+    scale = max(mad, abs(median) * MIN_RELATIVE_SCALE)
+    z = np.abs(values - median) / scale if scale > 0 else np.zeros_like(values)
+    outliers = z > OUTLIER_THRESHOLD
+    weights = np.where(outliers, 0.0, (1 - (z / OUTLIER_THRESHOLD) ** 2) ** 2)
+    return {
+        'price': float(np.dot(weights, values) / weights.sum()),
+        'median': median,
+        'mad': mad,
+        'scale': scale,
+        'weights': weights,
+        'outliers': outliers
+    }
+
 
 class RealGoldPriceFetcher:
     """真实黄金价格获取器"""
 
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        })
+    def __init__(self, registry: Optional[SourceRegistry] = None, session: Optional[RateLimitedSession] = None,
+                 fx_cache: Optional[FXRateCache] = None, consensus: bool = False,
+                 deadline: float = DEFAULT_CONSENSUS_DEADLINE, raw_archive=None):
+        self.registry = registry or get_registry()
+        # 银行、API 和共识模式共用一个 Session
+        if session is None:
+            session = RateLimitedSession()
+            session.headers.update({
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            })
+        self.session = session
+        self.fx_cache = fx_cache
+        self.bank = BankGoldPrice(self.registry, session=session)
+        self.api = GoldPriceAPI(fx_cache=fx_cache, registry=self.registry, session=session)
+        # 共识模式：get_gold_price() 返回多源共识价格
+        self.consensus = consensus
+        self.deadline = deadline
+        # 原始响应归档（RawArchive）：共识模式下归档网页数据源的完整页面，与爬虫的 --capture-raw 一致
+        self.raw_archive = raw_archive
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
 
     def get_fallback_price(self) -> Dict:
         """获取备用价格（当所有数据源都失败时使用）"""
@@ -31,14 +104,19 @@ class RealGoldPriceFetcher:
             'warning': '此为估算数据，仅供参考'
         }
 
-    def get_gold_price(self) -> Dict:
-        """获取黄金价格 - 主要方法"""
+    def get_gold_price(self, use_fallback: bool = True) -> Dict:
+        """获取黄金价格 - 主要方法
+
+        use_fallback 为假时，所有数据源都失败后返回错误而不是估算价格（便于调用方继续尝试其他数据源）。
+        """
+        if self.consensus:
+            return self.get_consensus_price()
+
         logging.info("开始获取真实黄金价格...")
 
         # 尝试银行数据源
         try:
-            from bank_gold_price import get_bank_gold_data
-            bank_data = get_bank_gold_data()
+            bank_data = self.bank.get_shuibei_estimate()
             if bank_data and bank_data.get('price'):
                 logging.info("从银行数据源获取价格: %s元/克", bank_data['price'])
                 return bank_data
@@ -47,24 +125,205 @@ class RealGoldPriceFetcher:
 
         # 尝试API数据源
         try:
-            from gold_api import get_real_gold_price as get_gold_price_from_api
-            api_data = get_gold_price_from_api()
+            api_data = self.api.get_shuibei_approximate_price()
             if api_data and api_data.get('price'):
                 logging.info("从API数据源获取价格: %s元/克", api_data['price'])
                 return api_data
         except Exception as e:
             logging.warning("API数据源失败: %s", e)
 
+        if not use_fallback:
+            return {
+                'source': '银行/API数据源',
+                'price': None,
+                'timestamp': datetime.now().isoformat(),
+                'error': '银行和API数据源均不可用'
+            }
+
         # 当所有数据源都不可用时，返回合理的估算价格
         logging.warning("所有真实数据源均失败，使用估算价格")
         return self.get_fallback_price()
 
+    def _get_executor(self, workers: int) -> ThreadPoolExecutor:
+        """共识模式的线程池，首次使用时创建并在之后复用"""
+        with self._executor_lock:
+            if self._executor is None:
+                # 超过截止时间的请求仍占用线程直到自身超时，多留一倍线程，不拖慢下一轮
+                self._executor = ThreadPoolExecutor(max_workers=max(1, workers * 2),
+                                                     thread_name_prefix='consensus')
+            return self._executor
+
+    def fetch_quote(self, source: CompiledSource, timestamp: Optional[str] = None) -> Dict:
+        """获取一个数据源的报价，换算为水贝金价（元/克）
+
+        启用原始响应归档时，网页数据源读取完整页面并以 timestamp（共识记录的时间戳）归档，
+        之后可用 reprocess 离线重新提取。
+        """
+        body = [] if self.raw_archive is not None and source.group == 'web' else None
+        quote = {'source': source.name, 'group': source.group, 'price': None, 'base_price': None,
+                 'markup': source.markup, 'placeholder': False, 'raw_text': None, 'error': None}
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            result, stats = source.fetch(self.session, fx_cache=self.fx_cache,
+                                         on_bytes=body.append if body is not None else None,
+                                         stop_early=body is None)
+            if body is not None:
+                try:
+                    self.raw_archive.capture(
+                        b''.join(body), source=source.name, url=source.url,
+                        timestamp=timestamp or datetime.now().isoformat(),
+                        encoding=stats.get('encoding'), price=result['price'] if result else None
+                    )
+                except Exception as e:
+                    logger.warning("归档原始响应失败: %s", e, extra={'source': source.name})
+            if result is not None:
+                quote['base_price'] = result['price']
+                raw = result.get('raw_text', result.get('raw_data'))
+                quote['raw_text'] = raw if isinstance(raw, str) else json.dumps(raw, ensure_ascii=False, default=str)
+            elif source.sample_price is not None:
+                # 页面可以访问但未能解析：示例价格只作记录，不参与估计
+                quote['base_price'] = source.sample_price
+                quote['placeholder'] = True
+                outcome = 'no_price'
+            else:
+                quote['error'] = '页面中没有找到价格'
+                outcome = 'no_price'
+            if quote['base_price'] is not None:
+                quote['price'] = source.estimate(quote['base_price'])
+        except RateLimitExceeded as e:
+            quote['error'] = str(e)
+            outcome = 'throttled'
+        except Exception as e:
+            quote['error'] = f"{type(e).__name__}: {e}"
+            outcome = 'error'
+
+        quote['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        logger.info("共识报价 %s: %s", source.name, quote['price'] if outcome == 'ok' else quote['error'] or '示例价格',
+                    extra={'source': source.name, 'outcome': outcome, 'latency_ms': quote['latency_ms'],
+                           'price': quote['price']})
+        return quote
+
+    def collect_quotes(self, deadline: Optional[float] = None, timestamp: Optional[str] = None) -> List[Dict]:
+        """并发获取全部数据源的报价，最多等待 deadline 秒（全部返回后立即结束）"""
+        deadline = self.deadline if deadline is None else deadline
+        sources = list(self.registry)
+        executor = self._get_executor(len(sources))
+        futures = [(source, executor.submit(self.fetch_quote, source, timestamp)) for source in sources]
+        wait([future for _, future in futures], timeout=deadline)
+
+        quotes = []
+        for source, future in futures:
+            if future.done():
+                quotes.append(future.result())
+                continue
+            # 超时的请求在后台结束，结果丢弃
+            future.cancel()
+            quotes.append({'source': source.name, 'group': source.group, 'price': None, 'base_price': None,
+                           'markup': source.markup, 'placeholder': False, 'raw_text': None,
+                           'error': f"超过截止时间 {deadline} 秒", 'latency_ms': None})
+            logger.warning("共识报价 %s 超过截止时间 %s 秒", source.name, deadline,
+                           extra={'source': source.name, 'outcome': 'error'})
+        return quotes
+
+    def get_consensus_price(self, deadline: Optional[float] = None) -> Dict:
+        """多源共识价格
+
+        返回的共识记录带 quotes：参与估计的各数据源报价记录（含离群报价及其标记），
+        调度器把共识记录和这些报价一次批量写入存储。
+        """
+        started = time.perf_counter()
+        timestamp = datetime.now().isoformat()
+        quotes = self.collect_quotes(deadline, timestamp)
+        valid = [quote for quote in quotes if quote['price'] is not None and not quote['placeholder']]
+        failed = [quote['source'] for quote in quotes if quote['price'] is None or quote['placeholder']]
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+
+        if not valid:
+            logger.error("共识模式没有可用的报价", extra={'source': CONSENSUS_SOURCE, 'outcome': 'error',
+                                                    'latency_ms': elapsed_ms})
+            return {
+                'source': CONSENSUS_SOURCE,
+                'price': None,
+                'timestamp': timestamp,
+                'error': '没有数据源在截止时间内返回有效价格',
+                'sources_total': len(quotes),
+                'failed': failed,
+                'elapsed_ms': elapsed_ms
+            }
+
+        result = robust_consensus([quote['price'] for quote in valid])
+        records = []
+        outliers = []
+        for quote, weight, outlier in zip(valid, result['weights'], result['outliers']):
+            record = {
+                'source': quote['source'] + ESTIMATE_SUFFIXES.get(quote['group'], ''),
+                'price': quote['price'],
+                'timestamp': timestamp,
+                'raw_text': quote['raw_text'],
+                'base_price': quote['base_price'],
+                'markup': quote['markup'],
+                'latency_ms': quote['latency_ms'],
+                'weight': round(float(weight), 4),
+                'outlier': bool(outlier),
+                'deviation_percent': round((quote['price'] / result['median'] - 1) * 100, 3),
+                'note': '离群报价，未计入共识价格' if outlier else f"共识权重 {weight:.2f}"
+            }
+            records.append(record)
+            if outlier:
+                outliers.append(quote['source'])
+
+        used = len(valid) - len(outliers)
+        price = round(result['price'], 2)
+        logger.info("共识价格: %s元/克（%s/%s 个数据源）", price, used, len(quotes),
+                    extra={'source': CONSENSUS_SOURCE, 'outcome': 'ok', 'latency_ms': elapsed_ms, 'price': price})
+        return {
+            'source': CONSENSUS_SOURCE,
+            'price': price,
+            'timestamp': timestamp,
+            'raw_text': f"中位数 {result['median']:.2f}，MAD {result['mad']:.2f}",
+            'note': f"{used} 个数据源的稳健估计" + (f"，{len(outliers)} 个离群报价未计入" if outliers else ''),
+            'median': round(result['median'], 2),
+            'mad': round(result['mad'], 4),
+            'sources_used': used,
+            'sources_total': len(quotes),
+            'outliers': outliers,
+            'failed': failed,
+            'elapsed_ms': elapsed_ms,
+            'quotes': records
+        }
+
+    def close(self):
+        """关闭共识模式的线程池"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_default_fetcher: Optional[RealGoldPriceFetcher] = None
+_default_lock = threading.Lock()
+
+
+def get_default_fetcher() -> RealGoldPriceFetcher:
+    """进程内共享的真实价格获取器（复用 Session 和连接池）"""
+    global _default_fetcher
+    with _default_lock:
+        if _default_fetcher is None:
+            _default_fetcher = RealGoldPriceFetcher()
+        return _default_fetcher
+
 
 # 主要接口函数
 def get_real_gold_price():
     """获取真实黄金价格"""
-    fetcher = RealGoldPriceFetcher()
-    return fetcher.get_gold_price()
+    return get_default_fetcher().get_gold_price()
+
+
+def split_quotes(price_data: Dict) -> List[Dict]:
+    """把共识记录和它附带的各数据源报价拆成待写入的记录列表（共识记录在前）"""
+    quotes = price_data.pop('quotes', None) or []
+    return [price_data] + quotes
 
 
 if __name__ == "__main__":
@@ -0,0 +1,179 @@
+"""
+最近价格的内存缓存
+每个数据源一个环形缓冲区，保存最近 N 条记录：本进程写入时直接放入缓存，
+启动后第一次读取时从 CSV 末尾向前按块读取预热（不读取整个文件）。
+读取只需 O(limit) 的内存操作，外加一次 os.stat 检查其他进程是否写入了数据：
+文件只是变长时只解析新追加的部分，被整体替换（轮转、清理、重新提取）时重新预热。
+"""
+
+import csv
+import heapq
+import io
+import itertools
+import os
+import re
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+# 每条记录以 ISO 时间戳开头，用它识别记录边界（字段中带引号的换行不会被误判）
+RECORD_START = re.compile(rb'\n(?=\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2})')
+
+
+def _parse_rows(data: bytes, columns: Sequence[str]) -> List[Dict]:
+    """把若干完整的 CSV 行解析为记录，空字符串转为 None，价格转为浮点数"""
+    records = []
+    for row in csv.reader(io.StringIO(data.decode('utf-8', errors='replace'))):
+        if len(row) != len(columns):
+            continue
+        record = {column: (value if value != '' else None) for column, value in zip(columns, row)}
+        if record.get('price') is not None:
+            try:
+                record['price'] = float(record['price'])
+            except ValueError:
+                record['price'] = None
+        records.append(record)
+    return records
+
+
+def read_csv_tail(path: str, max_rows: int, columns: Sequence[str],
+                  block_size: int = 64 * 1024) -> Tuple[List[Dict], int]:
+    """从文件末尾向前按块读取最后 max_rows 条记录，返回 (记录, 已解析到的文件偏移)
+
+    只解析以换行结尾的完整记录，正在被追加的最后一行留到下次读取。
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        pos = size
+        data = b''
+        while pos > 0:
+            read = min(block_size, pos)
+            pos -= read
+            f.seek(pos)
+            data = f.read(read) + data
+            if len(RECORD_START.findall(data)) > max_rows:
+                break
+            # 记录较长时逐步加大块的大小，减少读取次数
+            block_size *= 2
+
+    end = data.rfind(b'\n') + 1
+    boundaries = [match.start() + 1 for match in RECORD_START.finditer(data, 0, end)]
+    if pos == 0 and data[:1].isdigit():
+        boundaries.insert(0, 0)
+    if not boundaries:
+        return [], pos + end
+    start = boundaries[max(0, len(boundaries) - max_rows)]
+    return _parse_rows(data[start:end], columns)[-max_rows:], pos + end
+
+
+class RecentPriceCache:
+    """按数据源的最近记录环形缓冲区"""
+
+    def __init__(self, csv_file: str, columns: Sequence[str], capacity: int = 1000,
+                 warm_rows: Optional[int] = None, older_records: Optional[Callable[[int], List[Dict]]] = None):
+        self.csv_file = csv_file
+        self.columns = list(columns)
+        # 每个数据源保留的记录数
+        self.capacity = capacity
+        # 预热时读取的记录总数
+        self.warm_rows = warm_rows or capacity
+        # CSV 中的记录不够时，用于补充更早记录（例如已轮转的分段）的函数
+        self.older_records = older_records
+        self._buffers: Dict[str, Deque[Tuple[int, Dict]]] = {}
+        self._seq = itertools.count()
+        self._lock = threading.RLock()
+        self._warmed = False
+        # 已解析到的 CSV 位置，以及上次检查时的 (inode, 大小, 修改时间)
+        self._offset = 0
+        self._stat: Optional[Tuple[int, int, int]] = None
+
+    def _push(self, record: Dict):
+        source = str(record.get('source'))
+        buffer = self._buffers.get(source)
+        if buffer is None:
+            buffer = self._buffers[source] = deque(maxlen=self.capacity)
+        buffer.append((next(self._seq), record))
+
+    def _file_stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.csv_file)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _warm(self):
+        """从 CSV 末尾（不够时再加上更早的记录）重新填充缓存"""
+        self._buffers = {}
+        self._seq = itertools.count()
+        stat = self._file_stat()
+        records, offset = ([], 0) if stat is None else read_csv_tail(self.csv_file, self.warm_rows, self.columns)
+        if len(records) < self.warm_rows and self.older_records is not None:
+            records = self.older_records(self.warm_rows - len(records)) + records
+        for record in records:
+            self._push(record)
+        self._offset = offset
+        self._stat = stat
+        self._warmed = True
+
+    def sync(self):
+        """检查文件是否被其他进程修改：追加时只解析新增部分，被替换或截断时重新预热"""
+        with self._lock:
+            if not self._warmed:
+                return
+            stat = self._file_stat()
+            if stat == self._stat:
+                return
+            if stat is None or self._stat is None or stat[0] != self._stat[0] or stat[1] < self._offset:
+                self._warm()
+                return
+
+            with open(self.csv_file, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read(stat[1] - self._offset)
+            end = data.rfind(b'\n') + 1
+            for record in _parse_rows(data[:end], self.columns):
+                self._push(record)
+            self._offset += end
+            self._stat = stat
+
+    def on_write(self, records: List[Dict]):
+        """本进程刚把 records 追加到 CSV 之后调用（需在写锁内，且写入前已调用 sync）"""
+        with self._lock:
+            if not self._warmed:
+                return
+            for record in records:
+                self._push(record)
+            self._stat = self._file_stat()
+            self._offset = self._stat[1] if self._stat else 0
+
+    def recent(self, limit: int = 10, source: Optional[str] = None) -> List[Dict]:
+        """最近 limit 条记录（按写入顺序），可只取一个数据源"""
+        with self._lock:
+            if not self._warmed:
+                self._warm()
+            else:
+                self.sync()
+
+            if source is not None:
+                buffer = self._buffers.get(source, ())
+                items = list(itertools.islice(reversed(buffer), limit))
+            else:
+                # 各数据源的缓冲区按序号倒序归并，只取前 limit 条
+                merged = heapq.merge(*(reversed(buffer) for buffer in self._buffers.values()),
+                                     key=lambda item: item[0], reverse=True)
+                items = list(itertools.islice(merged, limit))
+            return [dict(record) for _, record in reversed(items)]
+
+    def timestamps(self, source: str) -> Set[str]:
+        """缓存中某个数据源最近记录的时间戳集合（用于按 (timestamp, source) 去重）"""
+        with self._lock:
+            if not self._warmed:
+                self._warm()
+            else:
+                self.sync()
+            return {str(record.get('timestamp')) for _, record in self._buffers.get(source, ())}
+
+    def sources(self) -> List[str]:
+        with self._lock:
+            return list(self._buffers)
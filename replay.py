@@ -0,0 +1,386 @@
+"""
+历史回放引擎
+把已存储的历史价格（压缩分段 + CSV）按时间顺序分块读出，依次送入与实时监控相同的处理阶段：
+
+- estimation：用候选加价系数由银行/API 价格估算水贝金价，与同一时刻的实际水贝报价比较误差，
+  并给出最小二乘意义下的最优加价系数
+- analytics：各数据源的运行统计（计数、均值、标准差、最值、涨跌幅）
+- alerts：用告警规则引擎逐条评估，统计各规则的触发次数
+
+能整体处理一批数据的阶段（估算、统计）按 numpy 数组向量化处理；告警规则依赖逐条的状态（冷却、窗口），
+逐条评估。默认尽可能快地回放，也可以按指定倍速（例如 60 倍实时）回放。
+"""
+
+import json
+import logging
+import time
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from alerts import AlertEngine, load_alert_rules
+from data_storage import GoldPriceStorage
+from price_stats import RunningStats
+from source_registry import ESTIMATE_SUFFIXES, SourceRegistry, get_registry
+
+# 参考价（实际水贝报价）距离被估算记录超过该秒数时不参与误差统计
+DEFAULT_MAX_REFERENCE_AGE = 3600.0
+
+# 报告中保留的告警条数
+MAX_REPORTED_ALERTS = 100
+
+
+class ReplayBatch:
+    """按时间排序的一批价格记录（列式存储）
+
+    数据源以整数编码保存（codes 索引 names），各阶段按编码分组，不需要逐条比较字符串。
+    """
+
+    def __init__(self, times: np.ndarray, codes: np.ndarray, names: np.ndarray, prices: np.ndarray,
+                 timestamps: np.ndarray):
+        # times 为秒（浮点数），timestamps 为原始 ISO 时间字符串
+        self.times = times
+        self.codes = codes
+        self.names = names
+        self.prices = prices
+        self.timestamps = timestamps
+
+    @property
+    def sources(self) -> np.ndarray:
+        return self.names[self.codes]
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'ReplayBatch':
+        """由存储读出的数据表构造，丢弃无效的时间和价格，按时间稳定排序"""
+        timestamps = pd.to_datetime(df['timestamp'], errors='coerce', format='ISO8601')
+        prices = pd.to_numeric(df['price'], errors='coerce')
+        valid = (timestamps.notna() & prices.notna()).to_numpy()
+        times = timestamps.to_numpy()[valid].astype('datetime64[ns]').astype('int64') / 1e9
+        order = np.argsort(times, kind='stable')
+        codes, names = pd.factorize(df['source'].astype(str).to_numpy()[valid][order])
+        return cls(times[order], codes, np.asarray(names, dtype=object),
+                   prices.to_numpy(dtype=float)[valid][order],
+                   df['timestamp'].astype(str).to_numpy()[valid][order])
+
+    @classmethod
+    def from_tick(cls, price_data: Dict) -> 'ReplayBatch':
+        return cls(np.array([pd.Timestamp(price_data['timestamp']).value / 1e9]), np.zeros(1, dtype=np.intp),
+                   np.array([str(price_data['source'])], dtype=object), np.array([float(price_data['price'])]),
+                   np.array([price_data['timestamp']], dtype=object))
+
+    def __len__(self):
+        return len(self.times)
+
+    def slice(self, start: int, end: int) -> 'ReplayBatch':
+        return ReplayBatch(self.times[start:end], self.codes[start:end], self.names,
+                           self.prices[start:end], self.timestamps[start:end])
+
+    def ticks(self) -> Iterator[Dict]:
+        """逐条产出与实时监控相同格式的价格数据"""
+        names = self.names.tolist()
+        for code, price, timestamp in zip(self.codes.tolist(), self.prices.tolist(), self.timestamps.tolist()):
+            yield {'source': names[code], 'price': price, 'timestamp': timestamp}
+
+
+class ReplayStage:
+    """回放阶段的基类：默认逐条处理，能向量化的阶段重写 process_batch"""
+
+    name = ''
+    vectorized = False
+
+    def process_batch(self, batch: ReplayBatch):
+        for tick in batch.ticks():
+            self.on_tick(tick)
+
+    def on_tick(self, price_data: Dict):
+        raise NotImplementedError
+
+    def report(self) -> Dict:
+        raise NotImplementedError
+
+
+class EstimationStage(ReplayStage):
+    """评估加价系数：用候选系数由基准价估算水贝金价，与同一时刻最近的实际水贝报价比较"""
+
+    name = 'estimation'
+    vectorized = True
+
+    def __init__(self, markups: Optional[Sequence[float]] = None, reference_sources: Optional[Sequence[str]] = None,
+                 registry: Optional[SourceRegistry] = None, max_reference_age: float = DEFAULT_MAX_REFERENCE_AGE):
+        self.registry = registry or get_registry()
+        # 基准数据源（银行、API）-> 当前配置的加价系数
+        self.configured = {source.name: source.markup for source in self.registry if source.markup != 1.0}
+        self.markups = np.array(sorted(set(markups or []) | set(self.configured.values())), dtype=float)
+        # 默认以网页数据源（实际水贝报价）作为参考价
+        self.reference_sources = set(reference_sources or [source.name for source in self.registry.group('web')])
+        self.max_reference_age = max_reference_age
+        self._last_reference: Optional[tuple] = None
+        # 基准数据源 -> 各候选系数的 [样本数, 误差和, 绝对误差和, 误差平方和]，以及最小二乘用的 Σ(基准×参考)、Σ(基准²)
+        self._errors: Dict[str, np.ndarray] = {}
+        self._fit: Dict[str, List[float]] = {}
+
+    def _base_names(self, names: np.ndarray):
+        """按数据源名称（每个名称只算一次）找出基准数据源：返回 (基准数据源名, 加价系数, 是否为已加价的估算记录)
+
+        不是基准数据源的名称系数为 NaN。
+        """
+        base_names, markups, estimated = [], [], []
+        for name in names.tolist():
+            base_name = name
+            # 估算记录（gold_api / bank_gold_price 写入的已加价记录）的名称带有分组后缀
+            for suffix in ESTIMATE_SUFFIXES.values():
+                base_name = base_name.removesuffix(suffix)
+            base_names.append(base_name)
+            markups.append(self.configured.get(base_name, np.nan))
+            estimated.append(base_name != name)
+        return np.array(base_names, dtype=object), np.array(markups, dtype=float), np.array(estimated)
+
+    def process_batch(self, batch: ReplayBatch):
+        if not len(batch):
+            return
+        is_reference = np.isin(batch.codes, [code for code, name in enumerate(batch.names.tolist())
+                                             if name in self.reference_sources])
+        ref_times = batch.times[is_reference]
+        ref_prices = batch.prices[is_reference]
+        if self._last_reference is not None:
+            ref_times = np.concatenate(([self._last_reference[0]], ref_times))
+            ref_prices = np.concatenate(([self._last_reference[1]], ref_prices))
+        if len(ref_times):
+            self._last_reference = (ref_times[-1], ref_prices[-1])
+
+        base_names, markups, estimated = self._base_names(batch.names)
+        is_base = ~np.isnan(markups)[batch.codes]
+        if not is_base.any() or not len(ref_times):
+            return
+        # 已加价的估算记录按配置的系数还原为基准价
+        codes = batch.codes[is_base]
+        base = batch.prices[is_base] / np.where(estimated, markups, 1.0)[codes]
+
+        # 每条基准记录取此刻（含）之前最近的一条参考价
+        times = batch.times[is_base]
+        index = np.searchsorted(ref_times, times, side='right') - 1
+        usable = (index >= 0) & (times - ref_times[np.maximum(index, 0)] <= self.max_reference_age)
+        codes, base = codes[usable], base[usable]
+        reference = ref_prices[index[usable]]
+
+        # 同一基准数据源的估算记录和原始记录合并统计
+        present = np.unique(codes)
+        for name in sorted(set(base_names[present].tolist())):
+            mask = np.isin(codes, present[base_names[present] == name])
+            b, r = base[mask], reference[mask]
+            # 误差矩阵：行为记录，列为候选系数
+            errors = np.round(b[:, None] * self.markups[None, :], 2) - r[:, None]
+            sums = np.stack([np.full(len(self.markups), len(b), dtype=float), errors.sum(axis=0),
+                             np.abs(errors).sum(axis=0), (errors ** 2).sum(axis=0)])
+            if name in self._errors:
+                self._errors[name] += sums
+            else:
+                self._errors[name] = sums
+            fit = self._fit.setdefault(name, [0.0, 0.0])
+            fit[0] += float((b * r).sum())
+            fit[1] += float((b * b).sum())
+
+    def on_tick(self, price_data: Dict):
+        self.process_batch(ReplayBatch.from_tick(price_data))
+
+    def report(self) -> Dict:
+        result = {}
+        for name, (counts, error_sum, abs_sum, sq_sum) in self._errors.items():
+            candidates = {}
+            for markup, count, e, a, s in zip(self.markups.tolist(), counts, error_sum, abs_sum, sq_sum):
+                candidates[f"{markup:g}"] = {'samples': int(count), 'bias': round(e / count, 4),
+                                             'mae': round(a / count, 4), 'rmse': round(float(np.sqrt(s / count)), 4)}
+            best = min(candidates, key=lambda key: candidates[key]['mae'])
+            numerator, denominator = self._fit[name]
+            result[name] = {
+                'configured_markup': self.configured.get(name),
+                'best_candidate': float(best),
+                'fitted_markup': round(numerator / denominator, 4) if denominator else None,
+                'candidates': candidates
+            }
+        return result
+
+
+class AnalyticsStage(ReplayStage):
+    """各数据源的运行统计（可合并，按批向量化更新）"""
+
+    name = 'analytics'
+    vectorized = True
+
+    def __init__(self):
+        self.stats: Dict[str, RunningStats] = {}
+        self.first: Dict[str, float] = {}
+        self.last: Dict[str, float] = {}
+
+    def process_batch(self, batch: ReplayBatch):
+        if not len(batch):
+            return
+        for code, name in enumerate(batch.names.tolist()):
+            prices = batch.prices[batch.codes == code]
+            if not len(prices):
+                continue
+            self.stats.setdefault(name, RunningStats()).update_batch(prices)
+            self.first.setdefault(name, float(prices[0]))
+            self.last[name] = float(prices[-1])
+
+    def on_tick(self, price_data: Dict):
+        name, price = str(price_data['source']), float(price_data['price'])
+        self.stats.setdefault(name, RunningStats()).update(price)
+        self.first.setdefault(name, price)
+        self.last[name] = price
+
+    def report(self) -> Dict:
+        result = {}
+        for name, stats in sorted(self.stats.items()):
+            first, last = self.first[name], self.last[name]
+            result[name] = {
+                'count': stats.count,
+                'mean': round(stats.mean, 4),
+                'std': round(float(np.sqrt(stats.variance(ddof=1))), 4) if stats.count > 1 else None,
+                'min': stats.min,
+                'max': stats.max,
+                'first': first,
+                'last': last,
+                'change_percent': round((last - first) / first * 100, 4) if first else None
+            }
+        return result
+
+
+class AlertStage(ReplayStage):
+    """用告警规则引擎逐条评估（不发送通知，只统计触发情况）"""
+
+    name = 'alerts'
+
+    def __init__(self, engine: AlertEngine, max_alerts: int = MAX_REPORTED_ALERTS):
+        self.engine = engine
+        self.max_alerts = max_alerts
+        self.fired: Dict[str, int] = {}
+        self.alerts: List[Dict] = []
+
+    def process_batch(self, batch: ReplayBatch):
+        on_tick = self.on_tick
+        for tick in batch.ticks():
+            on_tick(tick)
+
+    def on_tick(self, price_data: Dict):
+        for alert in self.engine.on_tick(price_data):
+            self.fired[alert['rule_id']] = self.fired.get(alert['rule_id'], 0) + 1
+            if len(self.alerts) < self.max_alerts:
+                self.alerts.append(alert)
+
+    def report(self) -> Dict:
+        return {'evaluations': self.engine.evaluations, 'fired': self.fired, 'alerts': self.alerts}
+
+
+class ReplayEngine:
+    """把存储的历史数据按时间顺序送入各阶段"""
+
+    def __init__(self, stages: List[ReplayStage], storage: Optional[GoldPriceStorage] = None,
+                 speed: Optional[float] = None, vectorize: bool = True, chunksize: int = 200000):
+        self.stages = stages
+        self.storage = storage or GoldPriceStorage()
+        # speed 为回放倍速（例如 60 表示 1 分钟的数据用 1 秒回放），None 表示尽可能快
+        self.speed = speed
+        # vectorize=False 时所有阶段都逐条处理（用于对比和校验）
+        self.vectorize = vectorize
+        self.chunksize = chunksize
+        self.logger = logging.getLogger(__name__)
+
+    def _feed(self, batch: ReplayBatch):
+        for stage in self.stages:
+            if self.vectorize:
+                stage.process_batch(batch)
+            else:
+                for index in range(len(batch)):
+                    stage.process_batch(batch.slice(index, index + 1))
+
+    def _feed_paced(self, batch: ReplayBatch, origin: float, started: float):
+        """按倍速回放：只送入到期的记录，其余等待"""
+        due = (batch.times - origin) / self.speed
+        position = 0
+        while position < len(batch):
+            elapsed = time.perf_counter() - started
+            end = int(np.searchsorted(due, elapsed, side='right'))
+            if end > position:
+                self._feed(batch.slice(position, end))
+                position = end
+            else:
+                time.sleep(min(due[position] - elapsed, 1.0))
+
+    def run(self, start: Optional[str] = None, end: Optional[str] = None, source: Optional[str] = None) -> Dict:
+        """回放 [start, end] 范围内（可只取一个数据源）的历史数据，返回各阶段的报告"""
+        started = time.perf_counter()
+        origin = None
+        ticks = 0
+        first_time = last_time = None
+
+        for chunk in self.storage.iter_price_chunks(start, end, source, chunksize=self.chunksize):
+            batch = ReplayBatch.from_frame(chunk)
+            if not len(batch):
+                continue
+            if origin is None:
+                origin = batch.times[0]
+                first_time = batch.timestamps[0]
+            last_time = batch.timestamps[-1]
+            ticks += len(batch)
+            if self.speed:
+                self._feed_paced(batch, origin, started)
+            else:
+                self._feed(batch)
+
+        elapsed = time.perf_counter() - started
+        return {
+            'ticks': ticks,
+            'first': first_time,
+            'last': last_time,
+            'elapsed_s': round(elapsed, 3),
+            'ticks_per_second': round(ticks / elapsed) if elapsed > 0 else None,
+            'speed': self.speed,
+            'vectorized': self.vectorize,
+            'stages': {stage.name: stage.report() for stage in self.stages}
+        }
+
+
+def build_stages(markups: Optional[Sequence[float]] = None, reference_sources: Optional[Sequence[str]] = None,
+                 alerts_file: Optional[str] = None) -> List[ReplayStage]:
+    """构造默认的阶段：估算、统计，以及指定了规则文件时的告警"""
+    stages: List[ReplayStage] = [EstimationStage(markups, reference_sources), AnalyticsStage()]
+    if alerts_file:
+        rules, cooldown = load_alert_rules(alerts_file)
+        stages.append(AlertStage(AlertEngine(rules, default_cooldown=cooldown)))
+    return stages
+
+
+def run_replay(start: Optional[str] = None, end: Optional[str] = None, source: Optional[str] = None,
+               markups: Optional[Sequence[float]] = None, reference_sources: Optional[Sequence[str]] = None,
+               alerts_file: Optional[str] = None, speed: Optional[float] = None, as_json: bool = False) -> Dict:
+    """回放历史数据并打印报告"""
+    engine = ReplayEngine(build_stages(markups, reference_sources, alerts_file), speed=speed)
+    report = engine.run(start, end, source)
+    if as_json:
+        print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+        return report
+
+    print(f"⏪ 回放 {report['ticks']} 条记录（{report['first']} ~ {report['last']}），"
+          f"用时 {report['elapsed_s']} 秒，每秒 {report['ticks_per_second']} 条")
+
+    estimation = report['stages']['estimation']
+    if estimation:
+        print("\n💹 加价系数评估（与同一时刻的实际水贝报价比较）:")
+        for name, result in estimation.items():
+            best = result['candidates'][f"{result['best_candidate']:g}"]
+            print(f"  {name}: 当前系数 {result['configured_markup']}，最小二乘最优 {result['fitted_markup']}，"
+                  f"候选中最优 {result['best_candidate']:g}（平均绝对误差 {best['mae']} 元/克，{best['samples']} 个样本）")
+
+    print("\n📊 各数据源统计:")
+    for name, stats in report['stages']['analytics'].items():
+        print(f"  {name}: {stats['count']} 条，均值 {stats['mean']}，最低 {stats['min']}，最高 {stats['max']}，"
+              f"涨跌 {stats['change_percent']}%")
+
+    if 'alerts' in report['stages']:
+        alerts = report['stages']['alerts']
+        print(f"\n🔔 告警: 评估 {alerts['evaluations']} 次")
+        for rule_id, count in alerts['fired'].items():
+            print(f"  {rule_id}: 触发 {count} 次")
+    return report
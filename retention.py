@@ -0,0 +1,383 @@
+"""
+分层保留与自动降采样
+原始价格只保留 N 天，并逐级汇总为 1 分钟、1 小时、1 天的 OHLC+count K线，
+每一层有各自的保留期。查询时自动选择能满足时间范围和分辨率的最粗一层，
+较新的、尚未汇总的部分由更细的层（最终是原始数据）补齐。
+"""
+
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from data_storage import GoldPriceStorage
+
+# 汇总层（名称, pandas 频率），从细到粗
+TIERS = [('1min', '1min'), ('1h', '1h'), ('1d', '1D')]
+
+# 各层默认保留天数（None 表示永久保留）
+DEFAULT_RETENTION_DAYS = {'raw': 30, '1min': 90, '1h': 730, '1d': None}
+
+# K线文件的列
+BAR_COLUMNS = ['time', 'source', 'open', 'high', 'low', 'close', 'count']
+
+
+def aggregate_bars(bars: pd.DataFrame, freq) -> pd.DataFrame:
+    """把（更细的）K线按 freq 聚合为更粗的 K线，bars 需要按 time 排序"""
+    if bars.empty:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    grouped = bars.groupby(['source', bars['time'].dt.floor(freq)], sort=True)
+    result = grouped.agg(open=('open', 'first'), high=('high', 'max'), low=('low', 'min'),
+                         close=('close', 'last'), count=('count', 'sum'))
+    return result.reset_index()[BAR_COLUMNS]
+
+
+def ticks_to_bars(ticks: pd.DataFrame) -> pd.DataFrame:
+    """把原始价格记录转换为每条一根的 K线（无效价格被丢弃），按时间排序"""
+    timestamps = pd.to_datetime(ticks['timestamp'], errors='coerce', format='ISO8601')
+    prices = pd.to_numeric(ticks['price'], errors='coerce')
+    bars = pd.DataFrame({
+        'time': timestamps, 'source': ticks['source'].astype(str),
+        'open': prices, 'high': prices, 'low': prices, 'close': prices, 'count': 1
+    }).dropna(subset=['time', 'open'])
+    return bars.sort_values('time', kind='stable')
+
+
+class TieredRetention:
+    """分层汇总、保留期清理和按分辨率查询"""
+
+    def __init__(self, storage: Optional[GoldPriceStorage] = None,
+                 retention_days: Optional[Dict[str, Optional[int]]] = None, grace_seconds: float = 60):
+        self.storage = storage or GoldPriceStorage()
+        self.retention_days = dict(DEFAULT_RETENTION_DAYS)
+        self.retention_days.update(retention_days or {})
+        # 原始数据可能延迟写入，只汇总早于 now - grace 的完整时间桶
+        self.grace = pd.Timedelta(seconds=grace_seconds)
+        self.rollup_dir = os.path.join(self.storage.data_dir, "rollups")
+        self.state_file = os.path.join(self.rollup_dir, "state.json")
+        self.logger = logging.getLogger(__name__)
+
+        os.makedirs(self.rollup_dir, exist_ok=True)
+
+    def _tier_file(self, tier: str) -> str:
+        return os.path.join(self.rollup_dir, f"bars_{tier}.csv")
+
+    def load_state(self) -> Dict:
+        """汇总状态
+
+        各层的水位：该时间之前的时间桶都已汇总到这一层；
+        dirty：水位之前补录了数据、需要重新汇总的原始数据时间范围 [[start, end], ...]；
+        pruned：各层实际清理到的时间，早于它的数据已被删除。
+        """
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, state: Dict):
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    def _watermark(self, state: Dict, tier: str) -> Optional[pd.Timestamp]:
+        return pd.Timestamp(state[tier]) if state.get(tier) else None
+
+    def read_tier(self, tier: str, start: Optional[pd.Timestamp] = None,
+                  end: Optional[pd.Timestamp] = None, source: Optional[str] = None) -> pd.DataFrame:
+        """读取一层的 K线，可按时间桶范围 [start, end) 和数据源过滤"""
+        path = self._tier_file(tier)
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=BAR_COLUMNS)
+        bars = pd.read_csv(path)
+        bars['time'] = pd.to_datetime(bars['time'], format='ISO8601')
+        bars['source'] = bars['source'].astype(str)
+        if start is not None:
+            bars = bars[bars['time'] >= start]
+        if end is not None:
+            bars = bars[bars['time'] < end]
+        if source:
+            bars = bars[bars['source'] == source]
+        return bars.sort_values('time', kind='stable')
+
+    def _append_bars(self, tier: str, bars: pd.DataFrame):
+        path = self._tier_file(tier)
+        output = bars.assign(time=bars['time'].map(lambda value: value.isoformat()))
+        output.to_csv(path, mode='a', header=not os.path.exists(path), index=False, encoding='utf-8')
+
+    def _rewrite_tier(self, tier: str, bars: pd.DataFrame):
+        """原子地重写一层的 K线文件（调用方需持有写锁）"""
+        path = self._tier_file(tier)
+        output = bars.sort_values(['time', 'source'], kind='stable')
+        output = output.assign(time=output['time'].map(lambda value: value.isoformat()))
+        tmp_file = path + '.tmp'
+        output[BAR_COLUMNS].to_csv(tmp_file, index=False, encoding='utf-8')
+        os.replace(tmp_file, path)
+
+    def mark_dirty(self, start, end) -> bool:
+        """登记一段补录（或改写）了原始数据的时间范围，下次汇总时重新汇总受影响的时间桶
+
+        只有范围落在 1 分钟层水位之前时才需要登记（之后的数据会被正常的增量汇总覆盖），
+        返回是否登记。
+        """
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        with self.storage.write_lock():
+            state = self.load_state()
+            watermark = self._watermark(state, TIERS[0][0])
+            if watermark is None or start >= watermark:
+                return False
+            state.setdefault('dirty', []).append([start.isoformat(), end.isoformat()])
+            self._save_state(state)
+        self.logger.info("登记待重新汇总的范围: %s ~ %s", start, end)
+        return True
+
+    def _read_source(self, name: str, spans) -> pd.DataFrame:
+        """读取源层（原始数据或更细的汇总层）在各时间范围 [start, end) 内的 K线"""
+        parts = []
+        for start, end in spans:
+            if name == 'raw':
+                chunks = [chunk[['timestamp', 'source', 'price']]
+                          for chunk in self.storage.iter_price_chunks(start.isoformat(), end.isoformat())]
+                if chunks:
+                    ticks = ticks_to_bars(pd.concat(chunks))
+                    parts.append(ticks[(ticks['time'] >= start) & (ticks['time'] < end)])
+            else:
+                parts.append(self.read_tier(name, start, end))
+        parts = [part for part in parts if not part.empty]
+        if not parts:
+            return pd.DataFrame(columns=BAR_COLUMNS)
+        return pd.concat(parts, ignore_index=True).sort_values('time', kind='stable')
+
+    def _rebuild_dirty(self, state: Dict) -> Dict[str, int]:
+        """重新汇总水位之前补录了数据的时间桶，返回各层重建的 K线数（调用方需持有写锁）
+
+        源层数据仍完整的时间桶直接用源层重新聚合；源层已按保留期清理的时间桶无法重算，
+        把补录的数据合并进已有的 K线，合并后删除这部分源数据，避免下次重复合并。
+        """
+        ranges = [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in state.get('dirty', [])]
+        pruned = state.get('pruned', {})
+        rebuilt = {}
+        source_name = 'raw'
+        for tier, freq in TIERS:
+            watermark = self._watermark(state, tier)
+            if watermark is None:
+                break
+            step = pd.Timedelta(freq)
+            spans = sorted((start.floor(freq), min(end.floor(freq) + step, watermark))
+                           for start, end in ranges if start.floor(freq) < watermark)
+            if not spans:
+                break
+
+            bars = self.read_tier(tier)
+            in_span = pd.Series(False, index=bars.index)
+            for start, end in spans:
+                in_span |= (bars['time'] >= start) & (bars['time'] < end)
+            floor = pd.Timestamp(pruned[source_name]) if pruned.get(source_name) else None
+            merge_old = in_span & (bars['time'] < floor) if floor is not None else in_span & False
+
+            source_bars = self._read_source(source_name, spans)
+            combined = pd.concat([bars[merge_old], source_bars], ignore_index=True).sort_values('time', kind='stable')
+            merged = aggregate_bars(combined, freq)
+            self._rewrite_tier(tier, pd.concat([bars[~in_span], merged], ignore_index=True))
+            rebuilt[tier] = len(merged)
+
+            # 已合并进 K线的源层数据早于源层的清理时间，删除它（原始数据由调用方在释放写锁后删除）
+            if source_name != 'raw' and floor is not None:
+                source_tier = self.read_tier(source_name)
+                if (source_tier['time'] < floor).any():
+                    self._rewrite_tier(source_name, source_tier[source_tier['time'] >= floor])
+
+            ranges = spans
+            source_name = tier
+
+        state['dirty'] = []
+        return rebuilt
+
+    def rollup(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """增量汇总：原始数据 -> 1 分钟 -> 1 小时 -> 1 天，返回各层新增（含重建）的 K线数
+
+        每层只汇总上一层已经完整覆盖的时间桶；水位之前补录的数据需要先用 mark_dirty 登记，
+        汇总时会重新汇总受影响的时间桶。
+        """
+        now = pd.Timestamp(now or datetime.now())
+        added = {}
+
+        with self.storage.write_lock():
+            state = self.load_state()
+            rebuilt = self._rebuild_dirty(state) if state.get('dirty') else {}
+            previous_watermark = None
+            for index, (tier, freq) in enumerate(TIERS):
+                start = self._watermark(state, tier)
+                if index == 0:
+                    horizon = (now - self.grace).floor(freq)
+                    chunks = [chunk[['timestamp', 'source', 'price']]
+                              for chunk in self.storage.iter_price_chunks(
+                                  start.isoformat() if start is not None else None)]
+                    source_bars = ticks_to_bars(pd.concat(chunks)) if chunks else pd.DataFrame(columns=BAR_COLUMNS)
+                else:
+                    if previous_watermark is None:
+                        break
+                    horizon = previous_watermark.floor(freq)
+                    source_bars = self.read_tier(TIERS[index - 1][0], start, horizon)
+
+                if start is not None and horizon <= start:
+                    added[tier] = rebuilt.get(tier, 0)
+                    previous_watermark = start
+                    continue
+
+                if not source_bars.empty:
+                    source_bars = source_bars[source_bars['time'] < horizon]
+                bars = aggregate_bars(source_bars, freq)
+                if not bars.empty:
+                    self._append_bars(tier, bars)
+                added[tier] = len(bars) + rebuilt.get(tier, 0)
+
+                # 还没有任何数据时不推进水位，之后导入的历史数据仍会被汇总
+                if start is not None or not bars.empty:
+                    state[tier] = horizon.isoformat()
+                previous_watermark = self._watermark(state, tier)
+
+            self._save_state(state)
+
+        # 早于原始数据清理时间的补录数据已经合并进 K线
+        if rebuilt and state.get('pruned', {}).get('raw'):
+            self.storage.delete_before(state['pruned']['raw'])
+
+        self.logger.info("分层汇总完成: %s", added)
+        return added
+
+    def enforce_retention(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """按各层保留期删除过期数据，返回各层删除的行数
+
+        尚未汇总到下一层的数据（包括登记为待重新汇总的补录数据）即使过期也会保留，
+        保证降采样链条不断裂；清理时间按下一层的时间桶取整，时间桶不会被清理一半。
+        """
+        now = pd.Timestamp(now or datetime.now())
+        state = self.load_state()
+        dirty = [pd.Timestamp(start) for start, _ in state.get('dirty', [])]
+        removed, pruned = {}, {}
+        names = ['raw'] + [tier for tier, _ in TIERS]
+
+        for index, name in enumerate(names):
+            days = self.retention_days.get(name)
+            if days is None:
+                continue
+            cutoff = now - pd.Timedelta(days=days)
+            if index + 1 < len(names):
+                next_watermark = self._watermark(state, names[index + 1])
+                if next_watermark is None:
+                    continue
+                cutoff = min([cutoff, next_watermark] + dirty).floor(TIERS[index][1])
+
+            if name == 'raw':
+                removed[name] = self.storage.delete_before(cutoff)
+            else:
+                removed[name] = self._prune_tier(name, cutoff)
+            pruned[name] = cutoff
+
+        if pruned:
+            with self.storage.write_lock():
+                state = self.load_state()
+                recorded = state.setdefault('pruned', {})
+                for name, cutoff in pruned.items():
+                    if not recorded.get(name) or pd.Timestamp(recorded[name]) < cutoff:
+                        recorded[name] = cutoff.isoformat()
+                self._save_state(state)
+
+        self.logger.info("保留期清理完成: %s", removed)
+        return removed
+
+    def _prune_tier(self, tier: str, cutoff: pd.Timestamp) -> int:
+        if not os.path.exists(self._tier_file(tier)):
+            return 0
+        with self.storage.write_lock():
+            bars = self.read_tier(tier)
+            keep = bars['time'] >= cutoff
+            if keep.all():
+                return 0
+            self._rewrite_tier(tier, bars[keep])
+        return int((~keep).sum())
+
+    def run(self, now: Optional[datetime] = None) -> Dict:
+        """先汇总再清理"""
+        return {'rollup': self.rollup(now), 'removed': self.enforce_retention(now)}
+
+    def get_version(self) -> str:
+        """汇总状态的版本标识，汇总或清理后随之变化"""
+        parts = []
+        for path in [self.state_file] + [self._tier_file(tier) for tier, _ in TIERS]:
+            try:
+                stat = os.stat(path)
+                parts.append(f"{stat.st_mtime_ns:x}")
+            except OSError:
+                parts.append("0")
+        return '-'.join(parts)
+
+    def query(self, start: Optional[str] = None, end: Optional[str] = None, resolution: str = '1h',
+              source: Optional[str] = None) -> pd.DataFrame:
+        """按分辨率查询 K线，自动选择满足分辨率的最粗一层
+
+        resolution 必须是所选层周期的整数倍；较早的部分来自粗层，
+        粗层水位之后的部分依次由更细的层和原始数据补齐。
+        汇总层按时间桶的起始时间与 [start, end] 比较。
+        返回的数据表 attrs['tiers'] 记录实际使用的层。
+        """
+        step = pd.Timedelta(resolution)
+        start_ts = pd.Timestamp(start) if start else None
+        end_ts = pd.Timestamp(end) if end else None
+        state = self.load_state()
+
+        # 能整除分辨率的汇总层，从粗到细
+        eligible = [(tier, freq) for tier, freq in reversed(TIERS)
+                    if step >= pd.Timedelta(freq) and step % pd.Timedelta(freq) == pd.Timedelta(0)]
+
+        parts: List[pd.DataFrame] = []
+        used = []
+        cursor = start_ts
+        for tier, _ in eligible:
+            watermark = self._watermark(state, tier)
+            if watermark is None or (cursor is not None and watermark <= cursor):
+                continue
+            upper = watermark if end_ts is None else min(watermark, end_ts + pd.Timedelta(1))
+            bars = self.read_tier(tier, cursor, upper, source)
+            if not bars.empty:
+                parts.append(bars)
+                used.append(tier)
+            cursor = watermark
+
+        chunks = [chunk[['timestamp', 'source', 'price']] for chunk in self.storage.iter_price_chunks(
+            cursor.isoformat() if cursor is not None else None, end, source)]
+        if chunks:
+            ticks = ticks_to_bars(pd.concat(chunks))
+            if cursor is not None:
+                ticks = ticks[ticks['time'] >= cursor]
+            if not ticks.empty:
+                parts.append(ticks)
+                used.append('raw')
+
+        if parts:
+            combined = pd.concat(parts, ignore_index=True).sort_values('time', kind='stable')
+            result = aggregate_bars(combined, step)
+        else:
+            result = pd.DataFrame(columns=BAR_COLUMNS)
+        result.attrs['tiers'] = used
+        return result
+
+
+def note_backfill(storage: GoldPriceStorage, start, end) -> bool:
+    """补录或改写了 [start, end] 范围的原始数据后调用：范围落在已汇总的部分时登记并立即重新汇总"""
+    retention = TieredRetention(storage)
+    if not retention.mark_dirty(start, end):
+        return False
+    retention.rollup()
+    return True
+
+
+def run_retention(data_dir: str = "data", retention_days: Optional[Dict[str, Optional[int]]] = None) -> Dict:
+    """执行一次分层汇总和保留期清理"""
+    retention = TieredRetention(GoldPriceStorage(data_dir), retention_days)
+    return retention.run()
@@ -1,21 +1,42 @@
+import random
 import schedule
 import time
 import threading
 from datetime import datetime
 import logging
+from typing import Callable, Dict, List, Optional
 
 from gold_price_scraper import ShuiBeiGoldPriceScraper
-from data_storage import GoldPriceStorage
+from data_storage import DEFAULT_DURABILITY, GoldPriceStorage
+from ingest_daemon import create_storage
+from real_gold_price import split_quotes
 
 class GoldPriceScheduler:
     """黄金价格定时调度器"""
 
-    def __init__(self, interval_minutes: int = 1):
+    def __init__(self, interval_minutes: int = 1, scraper=None, storage=None,
+                 jitter_seconds: Optional[float] = None, interval_seconds: Optional[float] = None,
+                 socket_path: Optional[str] = None, durability: str = DEFAULT_DURABILITY):
         self.interval_minutes = interval_minutes
-        self.scraper = ShuiBeiGoldPriceScraper()
-        self.storage = GoldPriceStorage()
+        # 以秒为单位的获取间隔，设置后代替 interval_minutes（浸泡测试用加速的间隔）
+        self.interval_seconds = interval_seconds if interval_seconds is not None else interval_minutes * 60
+        # 每次定时获取前随机延迟 0~jitter_seconds 秒，避免多个进程同时请求同一批主机
+        # （默认取间隔的 10%，最多 10 秒）
+        self.jitter_seconds = min(self.interval_seconds / 10, 10) if jitter_seconds is None else jitter_seconds
+        # 允许注入爬虫和存储（例如压测时使用模拟数据源和临时目录）
+        self.scraper = scraper or ShuiBeiGoldPriceScraper()
+        # 接收服务运行时经由它写入（socket_path 为其套接字路径），否则直接写本地文件（带文件锁）
+        self.storage = storage or create_storage(socket_path=socket_path, durability=durability)
         self.is_running = False
+        # 每个调度器使用自己的任务表，停止时清空，重复启动不会在全局任务表中累积重复任务
+        self.jobs = schedule.Scheduler()
         self.scheduler_thread: Optional[threading.Thread] = None
+        # 每次获取价格后通知的监听器（推送服务、告警等）
+        self.listeners: List[Callable[[Dict], None]] = []
+        # 是否在控制台逐次打印获取结果（看板模式下关闭）
+        self.echo = True
+        # 最新价格共享内存段的写入者（publish_shared_memory 开启后才有）
+        self.shm_writer = None
 
         # 配置日志
         self.logger = logging.getLogger(__name__)
@@ -28,29 +49,112 @@ class GoldPriceScheduler:
             # 获取价格数据
             price_data = self.scraper.get_gold_price()
 
-            # 存储数据
-            self.storage.save_price_data(price_data)
+            # 存储数据（共识模式下共识价格和各数据源报价一次批量写入）
+            records = split_quotes(price_data)
+            if len(records) > 1:
+                self.storage.save_price_batch(records)
+            else:
+                self.storage.save_price_data(price_data)
+
+            # 通知监听器
+            for record in records:
+                self._notify_listeners(record)
 
             # 打印当前价格信息
-            if price_data.get('price'):
-                print(f"🟢 [{datetime.now().strftime('%H:%M:%S')}] 水贝金价: {price_data['price']}元/克 (来源: {price_data['source']})")
-            else:
-                print(f"🔴 [{datetime.now().strftime('%H:%M:%S')}] 获取失败: {price_data.get('error', '未知错误')}")
+            if self.echo:
+                if price_data.get('price'):
+                    print(f"🟢 [{datetime.now().strftime('%H:%M:%S')}] 水贝金价: {price_data['price']}元/克 (来源: {price_data['source']})")
+                else:
+                    print(f"🔴 [{datetime.now().strftime('%H:%M:%S')}] 获取失败: {price_data.get('error', '未知错误')}")
 
         except Exception as e:
             self.logger.error("获取和存储金价时发生错误: %s", e)
-            print(f"🔴 [{datetime.now().strftime('%H:%M:%S')}] 错误: {e}")
+            if self.echo:
+                print(f"🔴 [{datetime.now().strftime('%H:%M:%S')}] 错误: {e}")
+
+    def _jittered_fetch(self):
+        """随机延迟后获取价格（定时任务使用）"""
+        if self.jitter_seconds > 0:
+            time.sleep(random.uniform(0, self.jitter_seconds))
+        if self.is_running:
+            self.fetch_and_store_price()
+
+    def log_rate_budget(self):
+        """记录各主机的请求预算使用情况"""
+        try:
+            from rate_limit import get_default_limiter
+            self.logger.info("请求预算: %s", get_default_limiter().report())
+        except Exception as e:
+            self.logger.error("统计请求预算失败: %s", e)
+
+    def rotate_history(self):
+        """把已结束日期的历史数据轮转为压缩分段"""
+        try:
+            report = self.storage.rotate_segments()
+            if report['segments']:
+                self.logger.info("历史数据已轮转: %s", report)
+        except Exception as e:
+            self.logger.error("轮转历史数据失败: %s", e)
+
+    def rollup_history(self):
+        """把新数据增量汇总为 1 分钟 / 1 小时 / 1 天 K线"""
+        try:
+            from retention import TieredRetention
+            TieredRetention(self.storage).rollup()
+        except Exception as e:
+            self.logger.error("汇总历史数据失败: %s", e)
+
+    def add_listener(self, callback: Callable[[Dict], None]):
+        """注册价格监听器，每次获取到价格数据后调用 callback(price_data)"""
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[Dict], None]):
+        """移除价格监听器"""
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def publish_shared_memory(self, name: Optional[str] = None):
+        """把每个数据源的最新价格发布到共享内存段，本机其他进程可用 PriceSegmentReader 直接读取"""
+        from shm_price import DEFAULT_SEGMENT_NAME, PriceSegmentWriter
+
+        if self.shm_writer is None:
+            self.shm_writer = PriceSegmentWriter(name or DEFAULT_SEGMENT_NAME)
+            self.add_listener(self.shm_writer.publish)
+            self.logger.info("最新价格发布到共享内存段 %s", self.shm_writer.name)
+            print(f"🧠 最新价格发布到共享内存段: {self.shm_writer.name}")
+        return self.shm_writer
+
+    def _notify_listeners(self, price_data: Dict):
+        """依次通知所有监听器，单个监听器出错不影响其他监听器"""
+        for listener in list(self.listeners):
+            try:
+                listener(price_data)
+            except Exception as e:
+                self.logger.error("价格监听器执行失败: %s", e)
 
     def setup_schedule(self):
         """设置定时任务"""
-        # 每分钟执行一次
-        schedule.every(self.interval_minutes).minutes.do(self.fetch_and_store_price)
+        # 按获取间隔执行（默认每分钟一次）
+        self.jobs.clear()
+        self.jobs.every(self.interval_seconds).seconds.do(self._jittered_fetch)
+
+        # 每天凌晨把前一天的数据轮转为压缩分段
+        self.jobs.every().day.at("00:05").do(self.rotate_history)
+
+        # 每小时增量汇总 K线（只汇总，不删除数据）
+        self.jobs.every().hour.do(self.rollup_history)
+
+        # 每小时记录一次请求预算
+        self.jobs.every().hour.do(self.log_rate_budget)
 
         # 立即执行一次
         self.fetch_and_store_price()
 
-        self.logger.info("定时任务已设置，每 %s 分钟执行一次", self.interval_minutes)
-        print(f"⏰ 定时任务已启动，每 {self.interval_minutes} 分钟获取一次水贝金价")
+        self.logger.info("定时任务已设置，每 %s 秒执行一次", self.interval_seconds)
+        if self.echo:
+            every = (f"{self.interval_seconds // 60:g} 分钟" if self.interval_seconds % 60 == 0
+                     else f"{self.interval_seconds:g} 秒")
+            print(f"⏰ 定时任务已启动，每 {every}获取一次水贝金价")
 
     def run_scheduler(self):
         """运行调度器"""
@@ -59,8 +163,10 @@ class GoldPriceScheduler:
 
         try:
             while self.is_running:
-                schedule.run_pending()
-                time.sleep(1)  # 每秒检查一次是否有待执行的任务
+                self.jobs.run_pending()
+                # 每秒检查一次是否有待执行的任务（间隔不足 1 秒时按下一个任务的时间）
+                idle = self.jobs.idle_seconds
+                time.sleep(min(1.0, max(idle, 0.001)) if idle is not None else 1.0)
         except KeyboardInterrupt:
             self.logger.info("收到中断信号，停止调度器")
             print("\n🛑 收到中断信号，停止调度器...")
@@ -69,6 +175,7 @@ class GoldPriceScheduler:
             print(f"❌ 调度器错误: {e}")
         finally:
             self.is_running = False
+            self.jobs.clear()
 
     def start(self):
         """启动调度器（在新线程中）"""
@@ -87,6 +194,16 @@ class GoldPriceScheduler:
         self.is_running = False
         if self.scheduler_thread and self.scheduler_thread.is_alive():
             self.scheduler_thread.join(timeout=5)
+        # 提交尚未落盘的写入
+        try:
+            self.storage.close()
+        except Exception as e:
+            self.logger.error("关闭存储失败: %s", e)
+        # 停止后删除共享内存段，读取者不会读到不再更新的价格
+        if self.shm_writer is not None:
+            self.remove_listener(self.shm_writer.publish)
+            self.shm_writer.close()
+            self.shm_writer = None
         self.logger.info("调度器已停止")
         print("🛑 调度器已停止")
 
@@ -95,15 +212,16 @@ class GoldPriceScheduler:
         return {
             'is_running': self.is_running,
             'interval_minutes': self.interval_minutes,
-            'next_run': str(schedule.next_run()) if schedule.jobs else None,
-            'pending_jobs': len(schedule.jobs)
+            'interval_seconds': self.interval_seconds,
+            'next_run': str(self.jobs.next_run) if self.jobs.jobs else None,
+            'pending_jobs': len(self.jobs.jobs)
         }
 
 
-def run_single_fetch():
+def run_single_fetch(scraper=None, socket_path=None, durability=DEFAULT_DURABILITY):
     """单次获取价格（用于测试）"""
-    scraper = ShuiBeiGoldPriceScraper()
-    storage = GoldPriceStorage()
+    scraper = scraper or ShuiBeiGoldPriceScraper()
+    storage = create_storage(socket_path=socket_path, durability=durability)
 
     print("🔍 正在获取水贝金价...")
     price_data = scraper.get_gold_price()
@@ -113,8 +231,17 @@ def run_single_fetch():
         print(f"📊 数据来源: {price_data['source']}")
         print(f"⏰ 更新时间: {price_data['timestamp']}")
 
-        # 保存数据
-        storage.save_price_data(price_data)
+        # 保存数据（退出前提交写入）
+        records = split_quotes(price_data)
+        if len(records) > 1:
+            print(f"🧮 参与共识的数据源: {price_data['sources_used']}/{price_data['sources_total']}")
+            for record in records[1:]:
+                flag = ' ⚠️ 离群' if record['outlier'] else ''
+                print(f"   - {record['source']}: {record['price']}元/克 ({record['deviation_percent']:+}%){flag}")
+            storage.save_price_batch(records)
+        else:
+            storage.save_price_data(price_data)
+        storage.close()
 
         # 显示统计信息
         stats = storage.get_price_statistics()
@@ -157,6 +284,9 @@ def show_statistics():
 
 if __name__ == "__main__":
     import argparse
+    from log_config import setup_logging
+
+    setup_logging()
 
     parser = argparse.ArgumentParser(description='水贝金价监控工具')
     parser.add_argument('--mode', choices=['single', 'schedule', 'stats'],
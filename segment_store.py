@@ -0,0 +1,255 @@
+"""
+不可变压缩历史分段
+把已经结束的每一天的历史数据轮转为 zstd 压缩的不可变分段文件，并维护一个小索引
+（时间范围、数据源集合、最低/最高价、记录数）。查询时先用索引跳过不相关的分段，
+只解压真正需要的分段。
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+# 分段文件后缀（zstd 压缩的 CSV）
+SEGMENT_SUFFIX = '.csv.zst'
+
+# 索引文件名
+INDEX_FILE = 'index.json'
+
+
+def filter_frame(df: pd.DataFrame, start: Optional[pd.Timestamp] = None, end: Optional[pd.Timestamp] = None,
+                 source: Optional[str] = None, min_price: Optional[float] = None,
+                 max_price: Optional[float] = None) -> pd.DataFrame:
+    """按时间范围、数据源和价格区间过滤数据表"""
+    if start is not None or end is not None:
+        timestamps = pd.to_datetime(df['timestamp'], errors='coerce', format='ISO8601')
+        mask = timestamps.notna()
+        if start is not None:
+            mask &= timestamps >= start
+        if end is not None:
+            mask &= timestamps <= end
+        df = df[mask]
+    if source:
+        df = df[df['source'] == source]
+    if min_price is not None or max_price is not None:
+        prices = pd.to_numeric(df['price'], errors='coerce')
+        mask = prices.notna()
+        if min_price is not None:
+            mask &= prices >= min_price
+        if max_price is not None:
+            mask &= prices <= max_price
+        df = df[mask]
+    return df
+
+
+class SegmentStore:
+    """按天划分的不可变压缩分段及其索引"""
+
+    def __init__(self, segment_dir: str, compression_level: int = 10):
+        self.segment_dir = segment_dir
+        self.index_file = os.path.join(segment_dir, INDEX_FILE)
+        self.compression_level = compression_level
+        self.logger = logging.getLogger(__name__)
+
+        self._index: List[Dict] = []
+        self._index_stamp = None
+
+    def load_index(self) -> List[Dict]:
+        """读取分段索引（索引文件未变化时使用内存中的副本）"""
+        try:
+            stat = os.stat(self.index_file)
+        except OSError:
+            self._index, self._index_stamp = [], None
+            return []
+
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self._index_stamp:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                self._index = json.load(f)
+            self._index_stamp = stamp
+        return self._index
+
+    def _write_index(self, entries: List[Dict]):
+        """原子地替换索引文件"""
+        os.makedirs(self.segment_dir, exist_ok=True)
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.index_file)
+        self._index_stamp = None
+
+    def _segment_path(self, entry: Dict) -> str:
+        return os.path.join(self.segment_dir, entry['file'])
+
+    def write_segment(self, day: str, df: pd.DataFrame) -> Dict:
+        """把一天的数据写成一个新的不可变分段，并登记到索引
+
+        同一天已有分段时（例如补录的数据）写入新的分段文件，已有分段不会被修改。
+        """
+        entry = self._write_segment_file(day, df)
+        self._update_index(add=entry)
+        self.logger.info("已写入历史分段 %s: %s 条记录, %s 字节", entry['file'], entry['count'], entry['bytes'])
+        return entry
+
+    def write_segments(self, days: Iterable[Tuple[str, pd.DataFrame]]) -> List[Dict]:
+        """批量写入多天的分段，全部文件写完后只更新一次索引"""
+        entries = [self._write_segment_file(day, df) for day, df in days]
+        if entries:
+            added = {entry['file'] for entry in entries}
+            kept = [item for item in self.load_index() if item['file'] not in added]
+            self._write_index(sorted(kept + entries, key=lambda item: (item['start'], item['file'])))
+            self.logger.info("已写入 %s 个历史分段: %s 条记录", len(entries), sum(entry['count'] for entry in entries))
+        return entries
+
+    def replace_segment(self, entry: Dict, df: pd.DataFrame) -> Dict:
+        """用新内容替换一个分段：写入新的分段文件并在索引中替换，再删除旧文件"""
+        new_entry = self._write_segment_file(entry['day'], df)
+        self._update_index(add=new_entry, remove=entry['file'])
+        try:
+            os.remove(self._segment_path(entry))
+        except OSError as e:
+            self.logger.warning("删除旧历史分段 %s 失败: %s", entry['file'], e)
+        self.logger.info("已重写历史分段 %s -> %s", entry['file'], new_entry['file'])
+        return new_entry
+
+    def _update_index(self, add: Dict, remove: Optional[str] = None):
+        entries = [item for item in self.load_index() if item['file'] != remove]
+        entries.append(add)
+        entries.sort(key=lambda item: (item['start'], item['file']))
+        self._write_index(entries)
+
+    def _write_segment_file(self, day: str, df: pd.DataFrame) -> Dict:
+        """写入分段文件并返回其索引项（尚未登记）"""
+        os.makedirs(self.segment_dir, exist_ok=True)
+        file_name = f"{day}{SEGMENT_SUFFIX}"
+        part = 0
+        while os.path.exists(os.path.join(self.segment_dir, file_name)):
+            part += 1
+            file_name = f"{day}.{part}{SEGMENT_SUFFIX}"
+
+        # 先写临时文件再改名，读者永远不会看到写了一半的分段
+        path = os.path.join(self.segment_dir, file_name)
+        tmp_path = path + '.tmp'
+        df.to_csv(tmp_path, index=False, encoding='utf-8',
+                  compression={'method': 'zstd', 'level': self.compression_level})
+        os.replace(tmp_path, path)
+        # 内容摘要：同名文件被替换后（旧文件删除后文件名可能被复用）据此区分不同的内容
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+
+        timestamps = pd.to_datetime(df['timestamp'], errors='coerce', format='ISO8601')
+        prices = pd.to_numeric(df['price'], errors='coerce')
+        entry = {
+            'file': file_name,
+            'day': day,
+            'start': timestamps.min().isoformat(),
+            'end': timestamps.max().isoformat(),
+            'count': len(df),
+            'sources': sorted(df['source'].dropna().astype(str).unique().tolist()),
+            'min_price': None if prices.isna().all() else float(prices.min()),
+            'max_price': None if prices.isna().all() else float(prices.max()),
+            'bytes': os.path.getsize(path),
+            'digest': digest
+        }
+        return entry
+
+    def select(self, start: Optional[str] = None, end: Optional[str] = None, source: Optional[str] = None,
+               min_price: Optional[float] = None, max_price: Optional[float] = None) -> List[Dict]:
+        """只根据索引选出可能包含匹配记录的分段"""
+        start_ts = pd.to_datetime(start) if start else None
+        end_ts = pd.to_datetime(end) if end else None
+
+        selected = []
+        for entry in self.load_index():
+            if start_ts is not None and pd.Timestamp(entry['end']) < start_ts:
+                continue
+            if end_ts is not None and pd.Timestamp(entry['start']) > end_ts:
+                continue
+            if source and source not in entry['sources']:
+                continue
+            if min_price is not None or max_price is not None:
+                if entry['min_price'] is None:
+                    continue
+                if min_price is not None and entry['max_price'] < min_price:
+                    continue
+                if max_price is not None and entry['min_price'] > max_price:
+                    continue
+            selected.append(entry)
+        return selected
+
+    def read_segment(self, entry: Dict, columns: Optional[List[str]] = None, **read_options) -> pd.DataFrame:
+        """解压并读取一个分段，read_options 透传给 pd.read_csv"""
+        return pd.read_csv(self._segment_path(entry), usecols=columns, compression='zstd', **read_options)
+
+    def query(self, start: Optional[str] = None, end: Optional[str] = None, source: Optional[str] = None,
+              min_price: Optional[float] = None, max_price: Optional[float] = None,
+              columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+        """按条件查询历史分段，逐个分段产出过滤后的数据"""
+        start_ts = pd.to_datetime(start) if start else None
+        end_ts = pd.to_datetime(end) if end else None
+
+        for entry in self.select(start, end, source, min_price, max_price):
+            df = filter_frame(self.read_segment(entry, columns), start_ts, end_ts, source, min_price, max_price)
+            if not df.empty:
+                yield df
+
+    def drop_before(self, cutoff) -> int:
+        """删除时间早于 cutoff 的数据，返回删除的记录数
+
+        结束时间早于 cutoff 的分段整段删除；跨越 cutoff 的分段重写为只含 cutoff 及之后记录的新分段，
+        删除后不会留下任何早于 cutoff 的记录。
+        """
+        cutoff_ts = pd.Timestamp(cutoff)
+        kept, removed, straddling = [], [], []
+        for entry in self.load_index():
+            if pd.Timestamp(entry['end']) < cutoff_ts:
+                removed.append(entry)
+            else:
+                kept.append(entry)
+                if pd.Timestamp(entry['start']) < cutoff_ts:
+                    straddling.append(entry)
+        count = 0
+        if removed:
+            # 先更新索引再删除文件，查询不会引用到已删除的分段
+            self._write_index(kept)
+            for entry in removed:
+                try:
+                    os.remove(self._segment_path(entry))
+                except OSError as e:
+                    self.logger.warning("删除历史分段 %s 失败: %s", entry['file'], e)
+            count = sum(entry['count'] for entry in removed)
+
+        for entry in straddling:
+            df = self.read_segment(entry, dtype=str, keep_default_na=False)
+            keep = pd.to_datetime(df['timestamp'], errors='coerce', format='ISO8601') >= cutoff_ts
+            if keep.all():
+                continue
+            self.replace_segment(entry, df[keep])
+            count += int((~keep).sum())
+        return count
+
+    def clear(self):
+        """删除所有分段"""
+        self.drop_before(pd.Timestamp.max)
+
+    def get_version(self) -> str:
+        """索引的版本标识，分段增删时随之变化"""
+        try:
+            stat = os.stat(self.index_file)
+            return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        except OSError:
+            return "0-0"
+
+    def get_status(self) -> Dict:
+        """分段概况"""
+        entries = self.load_index()
+        return {
+            'segments': len(entries),
+            'records': sum(entry['count'] for entry in entries),
+            'compressed_bytes': sum(entry.get('bytes', 0) for entry in entries),
+            'first_day': entries[0]['day'] if entries else None,
+            'last_day': entries[-1]['day'] if entries else None
+        }
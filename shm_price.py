@@ -0,0 +1,329 @@
+"""
+共享内存最新价格段
+调度器把每个数据源的最新报价写入一个 multiprocessing.shared_memory 段，
+同一台机器上的其他进程（收银服务、定价脚本等）挂载后直接读内存，不需要重新联网获取或解析 CSV。
+
+布局固定（小端）：
+    头部 64 字节: 魔数 'GPSH' | 版本 u16 | 保留 u16 | 槽位数 u32 | 已用槽位数 u32 | 写入进程号 u32 |
+                 保留 u32 | 代数 u64
+    槽位 128 字节: 序号 u64 | 数据源名称 64 字节 UTF-8 | 价格 f64 | 行情时间 f64（Unix 秒）|
+                  发布时间 i64（Unix 纳秒）| 更新次数 u64
+
+每个槽位用序号锁（seqlock）保护：写入者先把序号加一（奇数表示正在写），写完字段后再加一；
+读取者读取前后两次序号一致且为偶数才接受这次读取，否则重读。读取不加锁、不经过系统调用，
+任意数量的读取者可以并发读取，得到的每个槽位都是一致的快照。只支持一个写入进程。
+
+写入者每次（重新）初始化段时换一个新的代数，关闭时把代数清零；读取者发现代数变化后丢弃缓存的槽位映射，
+代数为零时重新挂载，因此异常退出后复用的段或重新创建的段都不会让读取者读到其他数据源的价格。
+"""
+
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+# 默认共享内存段名称
+DEFAULT_SEGMENT_NAME = 'goldenpress_prices'
+
+# 默认槽位数（每个数据源一个槽位）
+DEFAULT_SLOTS = 64
+
+MAGIC = b'GPSH'
+LAYOUT_VERSION = 2
+
+# 头部: 魔数, 版本, 保留, 槽位数, 已用槽位数, 写入进程号
+HEADER = struct.Struct('<4sHHIII')
+HEADER_SIZE = 64
+USED_OFFSET = 12
+
+# 代数: 写入者每次初始化时更新，为 0 表示正在初始化或写入者已关闭
+GENERATION = struct.Struct('<Q')
+GENERATION_OFFSET = 24
+
+# 槽位: 序号 + 正文（名称, 价格, 行情时间, 发布时间, 更新次数）
+SEQ = struct.Struct('<Q')
+SLOT_BODY = struct.Struct('<64sddqQ')
+SLOT_SIZE = 128
+NAME_BYTES = 64
+
+# 读取者遇到正在写入的槽位时最多重试的次数（每次重试前让出 CPU，写入者被抢占时才能尽快写完）
+MAX_READ_RETRIES = 10000
+
+
+def _encode_name(name: str) -> bytes:
+    """把名称编码为不超过 64 字节的 UTF-8（在字符边界截断）"""
+    data = name.encode('utf-8')[:NAME_BYTES]
+    return data.decode('utf-8', errors='ignore').encode('utf-8')
+
+
+def _tick_time(timestamp) -> float:
+    """行情时间转换为 Unix 秒（不带时区的时间按本地时间）"""
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    try:
+        return datetime.fromisoformat(str(timestamp)).timestamp()
+    except ValueError:
+        return time.time()
+
+
+def _map_readonly(name: str):
+    """以只读方式映射已有的共享内存段，返回 (缓冲区, 关闭函数)
+
+    POSIX 下直接 shm_open + mmap，不经过 SharedMemory：读取者不会登记到 resource_tracker
+    （否则读取者退出时会删除写入者的段），也无法误写价格。
+    """
+    try:
+        import _posixshmem
+    except ImportError:
+        # Windows 没有 POSIX 共享内存，段随最后一个句柄关闭而释放，也没有 resource_tracker
+        segment = shared_memory.SharedMemory(name=name)
+        return segment.buf, segment.close
+
+    import mmap
+    fd = _posixshmem.shm_open('/' + name, os.O_RDONLY)
+    try:
+        mapping = mmap.mmap(fd, os.fstat(fd).st_size, prot=mmap.PROT_READ)
+    finally:
+        os.close(fd)
+    return memoryview(mapping), mapping.close
+
+
+class PriceSegmentWriter:
+    """共享内存段的写入者，publish 可直接作为 GoldPriceScheduler 的监听器"""
+
+    def __init__(self, name: str = DEFAULT_SEGMENT_NAME, slots: int = DEFAULT_SLOTS):
+        self.name = name
+        self.slots = slots
+        size = HEADER_SIZE + slots * SLOT_SIZE
+        try:
+            self.segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # 上次运行异常退出留下的段：大小合适则重新初始化后复用，否则删除重建
+            self.segment = shared_memory.SharedMemory(name=name)
+            if self.segment.size < size:
+                self.segment.close()
+                self.segment.unlink()
+                self.segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.buffer = self.segment.buf
+        previous = GENERATION.unpack_from(self.buffer, GENERATION_OFFSET)[0]
+        # 先清零（代数为 0），已挂载的读取者在初始化期间不会接受任何槽位；最后才写入新的代数
+        self.buffer[:size] = bytes(size)
+        HEADER.pack_into(self.buffer, 0, MAGIC, LAYOUT_VERSION, 0, slots, 0, os.getpid())
+        self.generation = max(time.time_ns(), previous + 1)
+        GENERATION.pack_into(self.buffer, GENERATION_OFFSET, self.generation)
+        self._index: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def _slot_for(self, source: str) -> Optional[int]:
+        index = self._index.get(source)
+        if index is None:
+            if len(self._index) >= self.slots:
+                return None
+            index = self._index[source] = len(self._index)
+        return index
+
+    def publish(self, price_data: Dict) -> bool:
+        """写入一条价格数据（没有价格的记录跳过），返回是否写入"""
+        price = price_data.get('price')
+        if price is None:
+            return False
+        source = str(price_data.get('source'))
+        with self._lock:
+            index = self._slot_for(source)
+            if index is None:
+                self.dropped += 1
+                return False
+            offset = HEADER_SIZE + index * SLOT_SIZE
+            seq = SEQ.unpack_from(self.buffer, offset)[0]
+            updates = SLOT_BODY.unpack_from(self.buffer, offset + SEQ.size)[4]
+            # 奇数序号：正在写入
+            SEQ.pack_into(self.buffer, offset, seq + 1)
+            SLOT_BODY.pack_into(self.buffer, offset + SEQ.size, _encode_name(source), float(price),
+                                _tick_time(price_data.get('timestamp')), time.time_ns(), updates + 1)
+            SEQ.pack_into(self.buffer, offset, seq + 2)
+            # 槽位写好后再公开，读取者不会看到未初始化的槽位
+            if index + 1 > struct.unpack_from('<I', self.buffer, USED_OFFSET)[0]:
+                struct.pack_into('<I', self.buffer, USED_OFFSET, index + 1)
+            self.published += 1
+        return True
+
+    def close(self, unlink: bool = True):
+        """关闭共享内存段，unlink 为真时同时删除（之后读取者无法再挂载）"""
+        if unlink:
+            # 代数清零，仍映射着这个段的读取者据此得知写入者已关闭
+            GENERATION.pack_into(self.buffer, GENERATION_OFFSET, 0)
+        self.buffer.release()
+        self.segment.close()
+        if unlink:
+            try:
+                self.segment.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class PriceSegmentReader:
+    """共享内存段的读取者：挂载一次，之后每次读取只访问内存"""
+
+    def __init__(self, name: str = DEFAULT_SEGMENT_NAME):
+        self.name = name
+        self._index: Dict[str, int] = {}
+        self._used = 0
+        self._map()
+
+    def _map(self):
+        """映射共享内存段并校验格式"""
+        self.buffer, self._unmap = _map_readonly(self.name)
+        magic, version, _, slots, _, writer_pid = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            self.close()
+            raise ValueError(f"共享内存段 {self.name} 的格式不兼容: {magic!r} v{version}")
+        self.slots = slots
+        self.writer_pid = writer_pid
+        self._reset(GENERATION.unpack_from(self.buffer, GENERATION_OFFSET)[0])
+
+    def _reset(self, generation: int):
+        """丢弃缓存的槽位映射"""
+        self.generation = generation
+        self.writer_pid = HEADER.unpack_from(self.buffer, 0)[5]
+        self._index = {}
+        self._used = 0
+
+    def _check_generation(self) -> bool:
+        """确认段仍属于同一次写入，返回当前是否有可读的价格
+
+        代数变化（写入者异常退出后被新的写入者复用）时丢弃槽位映射；
+        代数为零（写入者已关闭或正在初始化）时尝试重新挂载同名的段，这时才会产生系统调用。
+        """
+        generation = GENERATION.unpack_from(self.buffer, GENERATION_OFFSET)[0]
+        if generation == self.generation and generation:
+            return True
+        if generation:
+            self._reset(generation)
+            return True
+        try:
+            buffer, unmap = _map_readonly(self.name)
+        except FileNotFoundError:
+            self._reset(0)
+            return False
+        self.buffer.release()
+        self._unmap()
+        self.buffer, self._unmap = buffer, unmap
+        generation = GENERATION.unpack_from(self.buffer, GENERATION_OFFSET)[0]
+        self._reset(generation)
+        return bool(generation)
+
+    def _read_slot(self, index: int) -> Optional[Dict]:
+        """按序号锁读取一个槽位的一致快照，槽位尚未写入时返回 None"""
+        offset = HEADER_SIZE + index * SLOT_SIZE
+        buffer = self.buffer
+        for _ in range(MAX_READ_RETRIES):
+            before = SEQ.unpack_from(buffer, offset)[0]
+            if before & 1:
+                time.sleep(0)
+                continue
+            name, price, tick_time, published_ns, updates = SLOT_BODY.unpack_from(buffer, offset + SEQ.size)
+            if SEQ.unpack_from(buffer, offset)[0] == before:
+                # 读取期间段被重新初始化：这次读到的内容不属于当前代数
+                if not before or GENERATION.unpack_from(buffer, GENERATION_OFFSET)[0] != self.generation:
+                    return None
+                return {
+                    'source': name.rstrip(b'\0').decode('utf-8', errors='replace'),
+                    'price': price,
+                    'timestamp': tick_time,
+                    'published_ns': published_ns,
+                    'updates': updates,
+                    'seq': before
+                }
+            time.sleep(0)
+        raise TimeoutError(f"共享内存段 {self.name} 的槽位 {index} 持续处于写入状态")
+
+    def _refresh_index(self):
+        """有新槽位时更新名称到槽位的映射"""
+        used = struct.unpack_from('<I', self.buffer, USED_OFFSET)[0]
+        for index in range(self._used, used):
+            slot = self._read_slot(index)
+            if slot is not None:
+                self._index[slot['source']] = index
+        self._used = used
+
+    def get(self, source: str) -> Optional[Dict]:
+        """某个数据源的最新报价（写入者已关闭时返回 None）"""
+        if not self._check_generation():
+            return None
+        index = self._index.get(source)
+        slot = self._read_slot(index) if index is not None else None
+        if slot is None or slot['source'] != source:
+            # 槽位映射过期（或尚未建立）：按当前段重新建立后再读一次
+            self._reset(self.generation)
+            self._refresh_index()
+            index = self._index.get(source)
+            slot = self._read_slot(index) if index is not None else None
+            if slot is None or slot['source'] != source:
+                return None
+        return slot
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """全部数据源的最新报价（每个槽位各自一致）"""
+        if not self._check_generation():
+            return {}
+        self._refresh_index()
+        result = {}
+        for index in range(self._used):
+            slot = self._read_slot(index)
+            if slot is not None:
+                result[slot['source']] = slot
+        return result
+
+    def latest(self) -> Optional[Dict]:
+        """最近发布的一条报价"""
+        slots = self.snapshot().values()
+        return max(slots, key=lambda slot: slot['published_ns'], default=None)
+
+    def sources(self) -> List[str]:
+        if not self._check_generation():
+            return []
+        self._refresh_index()
+        return sorted(self._index)
+
+    def close(self):
+        self.buffer.release()
+        self._unmap()
+
+    def __enter__(self) -> 'PriceSegmentReader':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_latest_prices(name: str = DEFAULT_SEGMENT_NAME) -> Dict[str, Dict]:
+    """挂载共享内存段并读取一次全部最新报价（只读一次时使用，频繁读取请保留 PriceSegmentReader）"""
+    with PriceSegmentReader(name) as reader:
+        return reader.snapshot()
+
+
+def show_segment(name: str = DEFAULT_SEGMENT_NAME, as_json: bool = False) -> Dict[str, Dict]:
+    """打印共享内存段中的最新报价"""
+    try:
+        prices = read_latest_prices(name)
+    except FileNotFoundError:
+        print(f"❌ 共享内存段 {name} 不存在，请先以 --shm 启动定时监控")
+        return {}
+
+    if as_json:
+        import json
+        print(json.dumps(prices, ensure_ascii=False, indent=2))
+        return prices
+
+    print(f"🧠 共享内存段 {name}: {len(prices)} 个数据源")
+    now_ns = time.time_ns()
+    for source, slot in prices.items():
+        tick_time = datetime.fromtimestamp(slot['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
+        age = (now_ns - slot['published_ns']) / 1e9
+        print(f"  {source}: {slot['price']}元/克  行情时间 {tick_time}  {age:.1f} 秒前发布  (更新 {slot['updates']} 次)")
+    return prices
@@ -0,0 +1,323 @@
+"""
+调度器长时间浸泡测试
+在本地桩服务上以加速的间隔长时间运行 GoldPriceScheduler，定期采样进程的常驻内存（RSS）、
+gc 跟踪的对象数、tracemalloc 统计的 Python 分配、线程数和打开的文件描述符；
+预热结束后任一指标的增长超出预算即判定失败，并列出增长最多的分配位置，便于定位泄漏。
+
+桩服务按注册表中各数据源的声明生成页面（HTML 数据源带匹配其提取规则的元素，JSON 数据源按 path 构造响应），
+价格随机游走。爬虫、限流、流式解析、存储和监听器走的都是生产代码路径，只是不访问外网。
+"""
+
+import contextlib
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from rate_limit import HostRateLimiter
+from source_registry import SOURCE_SPECS, SourceRegistry
+
+# 桩服务监听的地址
+STUB_HOST = '127.0.0.1'
+
+# 加速后的获取间隔（秒）
+DEFAULT_TICK_SECONDS = 0.2
+
+# 采样间隔（秒）
+DEFAULT_SAMPLE_SECONDS = 5.0
+
+# 预热结束后允许的增长（常驻内存 MB、Python 分配 MB、对象数、线程数、文件描述符数）
+DEFAULT_BUDGETS = {
+    'rss_mb': 32.0,
+    'traced_mb': 8.0,
+    'objects': 20000,
+    'threads': 2,
+    'fds': 8
+}
+
+# 最多保留的采样点（超出后丢弃最早的，浸泡测试本身不能无限增长）
+MAX_SAMPLES = 2000
+
+# 超出预算时列出的增长最多的分配位置数
+TOP_ALLOCATIONS = 10
+
+# 页面中价格元素之后的填充，使页面大小接近真实页面（流式解析找到价格后即停止读取）
+PAGE_PADDING = '<p>' + '行情资讯 ' * 2000 + '</p>'
+
+
+class StubPriceServer(ThreadingHTTPServer):
+    """本地桩服务：/<序号> 返回注册表中第 序号 个数据源的页面"""
+
+    daemon_threads = True
+
+    def __init__(self, specs=None, base_price: float = 920.0):
+        super().__init__((STUB_HOST, 0), _StubHandler)
+        self.specs = list(SOURCE_SPECS if specs is None else specs)
+        self.price = base_price
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # 流式解析找到价格后客户端会提前断开连接，不打印堆栈
+        pass
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{STUB_HOST}:{self.server_address[1]}"
+
+    def next_price(self) -> float:
+        """随机游走的元/克价格"""
+        with self._lock:
+            self.price = round(max(100.0, self.price + random.uniform(-0.5, 0.5)), 2)
+            self.requests += 1
+            return self.price
+
+    def registry(self) -> SourceRegistry:
+        """指向桩服务的注册表（各数据源的提取规则、单位和加价系数不变）"""
+        specs = []
+        for index, spec in enumerate(self.specs):
+            spec = dict(spec)
+            spec['url'] = f"{self.base_url}/{index}"
+            spec['timeout'] = 5
+            specs.append(spec)
+        return SourceRegistry(specs)
+
+    def render(self, index: int) -> Tuple[bytes, str]:
+        """生成一个数据源的响应体和内容类型"""
+        spec = self.specs[index]
+        # 银行 / API 数据源报基准价，按加价系数估算后与网页数据源的水贝金价一致
+        price = self.next_price() / float(spec.get('markup', 1.0))
+        if spec.get('kind') == 'json':
+            value = price
+            if spec.get('unit') == 'cny_per_ounce':
+                value = price * 31.1035
+            elif spec.get('unit') == 'usd_per_ounce':
+                value = price * 31.1035 / 7.2
+            data: object = {}
+            if spec.get('path'):
+                data = f"{value:.2f}"
+                for key in reversed(spec['path']):
+                    data = {key: data}
+            return json.dumps(data).encode('utf-8'), 'application/json'
+
+        rules = spec.get('extract') or {}
+        keyword = (rules.get('keywords') or ['黄金'])[0]
+        text = f"{keyword} 今日金价 {price:.2f}元/克"
+        element = f"<div>{text}</div>"
+        for tag, css_class in rules.get('selectors') or ():
+            element = f'<{tag} class="{css_class}">{text}</{tag}>'
+            break
+        page = (f"<html><head><meta charset=\"utf-8\"><title>{spec['name']}</title></head>"
+                f"<body>{element}{PAGE_PADDING}</body></html>")
+        return page.encode('utf-8'), 'text/html; charset=utf-8'
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        try:
+            index = int(self.path.split('?')[0].strip('/'))
+            body, content_type = self.server.render(index)
+            status = 200
+        except (ValueError, IndexError):
+            body, content_type, status = b'not found', 'text/plain', 404
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _rss_bytes() -> int:
+    """当前常驻内存字节数（Linux 读 /proc，其他平台退化为峰值 RSS）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _open_fds() -> int:
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return 0
+
+
+def take_sample(elapsed: float, ticks: int) -> Dict:
+    """采样一次进程的内存和资源使用"""
+    gc.collect()
+    return {
+        'elapsed_s': round(elapsed, 1),
+        'ticks': ticks,
+        'rss_mb': round(_rss_bytes() / 1048576, 2),
+        'traced_mb': round(tracemalloc.get_traced_memory()[0] / 1048576, 2) if tracemalloc.is_tracing() else 0.0,
+        'objects': len(gc.get_objects()),
+        'threads': threading.active_count(),
+        'fds': _open_fds()
+    }
+
+
+def _top_allocations(baseline: tracemalloc.Snapshot, limit: int = TOP_ALLOCATIONS) -> List[Dict]:
+    """与基线快照相比增长最多的分配位置"""
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    current = tracemalloc.take_snapshot().filter_traces(ignore)
+    top = []
+    for stat in current.compare_to(baseline.filter_traces(ignore), 'lineno')[:limit]:
+        frame = stat.traceback[0]
+        top.append({
+            'location': f"{frame.filename}:{frame.lineno}",
+            'size_diff_kb': round(stat.size_diff / 1024, 1),
+            'count_diff': stat.count_diff
+        })
+    return top
+
+
+def evaluate(baseline: Dict, recent: List[Dict], budgets: Dict) -> Tuple[Dict, List[str]]:
+    """用最近几次采样的中位数与基线比较，返回 (各指标增长, 超出预算的说明)"""
+    growth = {key: round(statistics.median(sample[key] for sample in recent) - baseline[key], 2)
+              for key in budgets}
+    violations = [f"{key} 增长 {growth[key]}，超出预算 {budget}"
+                  for key, budget in budgets.items() if growth[key] > budget]
+    return growth, violations
+
+
+def run_soak(duration: float = 3600.0, tick_seconds: float = DEFAULT_TICK_SECONDS,
+             sample_seconds: float = DEFAULT_SAMPLE_SECONDS, warmup_seconds: Optional[float] = None,
+             budgets: Optional[Dict] = None, data_dir: Optional[str] = None, verbose: bool = True,
+             consensus: bool = False) -> Dict:
+    """以加速的间隔运行调度器 duration 秒，返回内存增长报告（report['passed'] 为是否在预算内）
+
+    consensus 为真时使用多源共识模式，每次并发查询全部数据源（汇率使用本地固定汇率）。
+    """
+    from data_storage import GoldPriceStorage
+    from fx_rate import FXRateCache, StaticFXRateProvider
+    from gold_price_scraper import ShuiBeiGoldPriceScraper
+    from real_gold_price import RealGoldPriceFetcher
+    from scheduler import GoldPriceScheduler
+
+    budgets = {**DEFAULT_BUDGETS, **(budgets or {})}
+    # 预热期内缓存、连接池和环形缓冲区逐渐填满，之后的内存应保持平稳
+    warmup_seconds = min(120.0, duration * 0.2) if warmup_seconds is None else warmup_seconds
+
+    server = StubPriceServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    temp_dir = tempfile.TemporaryDirectory(prefix='gold_soak_') if data_dir is None else None
+
+    counts = {'ticks': 0, 'prices': 0, 'last_timestamp': None}
+
+    def on_tick(price_data: Dict):
+        # 共识模式下一次获取通知多条记录（共识价格和各数据源报价），它们的时间戳相同
+        if price_data.get('timestamp') != counts['last_timestamp']:
+            counts['last_timestamp'] = price_data.get('timestamp')
+            counts['ticks'] += 1
+        if price_data.get('price'):
+            counts['prices'] += 1
+
+    if consensus:
+        fx_cache = FXRateCache(StaticFXRateProvider())
+        scraper = RealGoldPriceFetcher(registry=server.registry(), fx_cache=fx_cache, consensus=True)
+    else:
+        scraper = ShuiBeiGoldPriceScraper(registry=server.registry())
+    # 桩服务在本机，不受各提供方的限额约束
+    scraper.session.limiter = HostRateLimiter(host_limits={STUB_HOST: {'rate_per_minute': 600000, 'burst': 1000}})
+    storage = GoldPriceStorage(data_dir=data_dir or temp_dir.name)
+    scheduler = GoldPriceScheduler(scraper=scraper, storage=storage, interval_seconds=tick_seconds,
+                                   jitter_seconds=0)
+    scheduler.echo = False
+    scheduler.add_listener(on_tick)
+
+    tracemalloc.start()
+    samples: deque = deque(maxlen=MAX_SAMPLES)
+    baseline: Optional[Dict] = None
+    baseline_snapshot: Optional[tracemalloc.Snapshot] = None
+    # 存储每次写入都会打印一行，浸泡期间屏蔽，采样结果仍输出到原来的标准输出
+    console = sys.stdout
+    started = time.monotonic()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            scheduler.start()
+            try:
+                while True:
+                    elapsed = time.monotonic() - started
+                    sample = take_sample(elapsed, counts['ticks'])
+                    samples.append(sample)
+                    if baseline is None and elapsed >= warmup_seconds:
+                        baseline = sample
+                        baseline_snapshot = tracemalloc.take_snapshot()
+                    if verbose:
+                        print(f"⏳ {sample['elapsed_s']:>7.0f}秒  获取 {sample['ticks']:>7} 次  "
+                              f"RSS {sample['rss_mb']:>7.1f}MB  Python分配 {sample['traced_mb']:>6.1f}MB  "
+                              f"对象 {sample['objects']:>8}  线程 {sample['threads']}  文件描述符 {sample['fds']}",
+                              file=console)
+                    if elapsed >= duration or not scheduler.is_running:
+                        break
+                    time.sleep(min(sample_seconds, max(0.0, duration - elapsed)))
+            finally:
+                scheduler.stop()
+                if consensus:
+                    scraper.close()
+                    fx_cache.stop()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+        recent = list(samples)[-3:]
+        report = {
+            'duration_s': round(time.monotonic() - started, 1),
+            'tick_seconds': tick_seconds,
+            'warmup_s': warmup_seconds,
+            'ticks': counts['ticks'],
+            'prices': counts['prices'],
+            'stub_requests': server.requests,
+            'budgets': budgets,
+            'baseline': baseline,
+            'final': samples[-1] if samples else None,
+            'samples': list(samples)
+        }
+        if baseline is None:
+            report.update({'growth': None, 'violations': ['运行时间短于预热期，未能评估内存增长'],
+                           'top_allocations': []})
+        else:
+            growth, violations = evaluate(baseline, recent, budgets)
+            report.update({'growth': growth, 'violations': violations,
+                           'top_allocations': _top_allocations(baseline_snapshot) if violations else []})
+        report['passed'] = not report['violations']
+        tracemalloc.stop()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+    return report
+
+
+def print_report(report: Dict):
+    """打印浸泡测试结论"""
+    print(f"\n🧪 浸泡测试: {report['duration_s']} 秒，获取 {report['ticks']} 次"
+          f"（间隔 {report['tick_seconds']} 秒，有效价格记录 {report['prices']} 条）")
+    if report['growth']:
+        print("📈 预热后增长:")
+        for key, value in report['growth'].items():
+            print(f"  {key:<10} {value:>10}  (预算 {report['budgets'][key]})")
+    if report['passed']:
+        print("✅ 内存在预算内保持平稳")
+        return
+    for violation in report['violations']:
+        print(f"❌ {violation}")
+    if report['top_allocations']:
+        print("🔍 增长最多的分配位置:")
+        for item in report['top_allocations']:
+            print(f"  {item['location']}  {item['size_diff_kb']:+} KB  ({item['count_diff']:+} 个)")
@@ -0,0 +1,216 @@
+"""
+数据源延迟探测与基准测试
+并发探测注册表中的全部数据源（网页、银行、金融 API），进行多轮测量，
+把每次请求拆分为 DNS、TCP 连接、TLS 握手、首字节（TTFB）、下载和解析时间，
+汇总 p50/p95/p99、响应大小和提取成功率，并按中位耗时给出各分组的推荐尝试顺序。
+
+为了拿到各阶段的时间，探测直接使用 socket/ssl/http.client 完成请求（不经过代理），
+每次请求前仍经过按主机的限流器，不会超出各提供方的限额。
+"""
+
+import http.client
+import json
+import socket
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlencode, urljoin, urlsplit
+
+import numpy as np
+
+from rate_limit import HostRateLimiter, get_default_limiter
+from source_registry import CompiledSource, SourceRegistry, get_registry
+
+# 各阶段的名称（毫秒）
+PHASES = ('dns_ms', 'connect_ms', 'tls_ms', 'ttfb_ms', 'download_ms', 'parse_ms', 'total_ms')
+
+# 汇总的分位数
+PERCENTILES = (50, 95, 99)
+
+# 最多跟随的重定向次数
+MAX_REDIRECTS = 3
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36')
+
+
+def _elapsed_ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+def _request_once(url: str, timeout: float, max_bytes: int, timings: Dict[str, float]):
+    """完成一次 HTTP 请求并把各阶段耗时累加到 timings，返回 (状态码, 响应头, 响应体)"""
+    parts = urlsplit(url)
+    https = parts.scheme == 'https'
+    host = parts.hostname
+    port = parts.port or (443 if https else 80)
+
+    started = time.perf_counter()
+    address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][4]
+    timings['dns_ms'] += _elapsed_ms(started)
+
+    started = time.perf_counter()
+    sock = socket.create_connection(address[:2], timeout=timeout)
+    timings['connect_ms'] += _elapsed_ms(started)
+
+    try:
+        if https:
+            started = time.perf_counter()
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+            timings['tls_ms'] += _elapsed_ms(started)
+
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        conn.sock = sock
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        started = time.perf_counter()
+        conn.request('GET', path, headers={
+            'Host': parts.netloc,
+            'User-Agent': USER_AGENT,
+            'Accept': '*/*',
+            # 不压缩，响应大小即传输大小
+            'Accept-Encoding': 'identity',
+            'Connection': 'close'
+        })
+        response = conn.getresponse()
+        timings['ttfb_ms'] += _elapsed_ms(started)
+
+        started = time.perf_counter()
+        body = response.read(max_bytes)
+        timings['download_ms'] += _elapsed_ms(started)
+        return response.status, response.headers, body
+    finally:
+        sock.close()
+
+
+def probe_source(source: CompiledSource, limiter: Optional[HostRateLimiter] = None) -> Dict:
+    """探测一个数据源一次，返回各阶段耗时、响应大小和提取结果"""
+    limiter = limiter or get_default_limiter()
+    sample = {phase: 0.0 for phase in PHASES}
+    sample.update({'source': source.name, 'status': None, 'bytes': 0, 'redirects': 0,
+                   'price': None, 'ok': False, 'error': None})
+
+    url = source.url
+    if source.params:
+        url += ('&' if '?' in url else '?') + urlencode(source.params)
+
+    try:
+        started = time.perf_counter()
+        for _ in range(MAX_REDIRECTS + 1):
+            host = urlsplit(url).hostname or ''
+            # 等待令牌的时间不计入探测结果
+            wait_started = time.perf_counter()
+            limiter.acquire(host, max_wait=120)
+            started += time.perf_counter() - wait_started
+
+            status, headers, body = _request_once(url, source.timeout, source.max_bytes, sample)
+            limiter.record_response(host, status, headers.get('Retry-After'))
+            if status in (301, 302, 303, 307, 308) and headers.get('Location'):
+                url = urljoin(url, headers['Location'])
+                sample['redirects'] += 1
+                continue
+            break
+
+        sample['status'] = status
+        sample['bytes'] = len(body)
+        parse_started = time.perf_counter()
+        if status == 200:
+            if source.kind == 'html':
+                charset = headers.get_content_charset() or 'utf-8'
+                extracted = source.extract_html(body.decode(charset, errors='replace'))
+            else:
+                extracted = source.extract_json(json.loads(body))
+            if extracted is not None:
+                sample['price'] = source.to_cny_per_gram(extracted[0])[0]
+                sample['ok'] = True
+        else:
+            sample['error'] = f"HTTP {status}"
+        sample['parse_ms'] = _elapsed_ms(parse_started)
+        sample['total_ms'] = _elapsed_ms(started)
+    except Exception as e:
+        sample['error'] = f"{type(e).__name__}: {e}"
+        sample['total_ms'] = _elapsed_ms(started)
+
+    for phase in PHASES:
+        sample[phase] = round(sample[phase], 2)
+    return sample
+
+
+def summarize(samples: List[Dict]) -> Dict:
+    """汇总一个数据源的多次探测：各阶段分位数、响应大小和提取成功率"""
+    answered = [sample for sample in samples if sample['status'] is not None]
+    summary = {
+        'rounds': len(samples),
+        'success_rate': round(sum(sample['ok'] for sample in samples) / len(samples), 3) if samples else 0.0,
+        'errors': sorted({sample['error'] for sample in samples if sample['error']}),
+        'avg_bytes': int(np.mean([sample['bytes'] for sample in answered])) if answered else 0,
+        'last_price': next((sample['price'] for sample in reversed(samples) if sample['ok']), None)
+    }
+    for phase in PHASES:
+        values = np.array([sample[phase] for sample in answered])
+        summary[phase] = ({f'p{p}': round(float(np.percentile(values, p)), 2) for p in PERCENTILES}
+                          if len(values) else None)
+    return summary
+
+
+def run_probe(rounds: int = 3, registry: Optional[SourceRegistry] = None,
+              limiter: Optional[HostRateLimiter] = None, max_workers: Optional[int] = None) -> Dict:
+    """并发探测所有数据源 rounds 轮，返回可直接输出为 JSON 的报告"""
+    registry = registry or get_registry()
+    limiter = limiter or get_default_limiter()
+    sources = list(registry)
+    samples: Dict[str, List[Dict]] = {source.name: [] for source in sources}
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(sources))) as executor:
+        for _ in range(rounds):
+            # 每轮内各数据源并发探测，轮与轮之间依次进行
+            for sample in executor.map(lambda source: probe_source(source, limiter), sources):
+                samples[sample['source']].append(sample)
+
+    report_sources = {}
+    ranking: Dict[str, List[str]] = {}
+    for source in sources:
+        summary = summarize(samples[source.name])
+        summary.update({'group': source.group, 'url': source.url, 'priority': source.priority})
+        report_sources[source.name] = summary
+        ranking.setdefault(source.group, []).append(source.name)
+
+    def order_key(name: str):
+        summary = report_sources[name]
+        total = summary['total_ms']['p50'] if summary['total_ms'] else float('inf')
+        # 能提取到价格的数据源优先，其次按中位耗时
+        return (-summary['success_rate'], total)
+
+    return {
+        'generated_at': datetime.now().isoformat(),
+        'rounds': rounds,
+        'elapsed_s': round(time.perf_counter() - started, 2),
+        'sources': report_sources,
+        'recommended_order': {group: sorted(names, key=order_key) for group, names in ranking.items()}
+    }
+
+
+def print_report(report: Dict):
+    """以表格形式打印探测报告"""
+    print(f"📡 数据源探测结果（{report['rounds']} 轮，用时 {report['elapsed_s']} 秒）")
+    print("=" * 60)
+    for name, summary in report['sources'].items():
+        total = summary['total_ms']
+        icon = '✅' if summary['success_rate'] > 0 else ('⚠️ ' if total else '❌')
+        print(f"\n{icon} {name} [{summary['group']}]")
+        print(f"   网址: {summary['url']}")
+        print(f"   提取成功率: {summary['success_rate']:.0%}，平均响应 {summary['avg_bytes']} 字节")
+        if total:
+            phases = '  '.join(f"{phase[:-3]} {summary[phase]['p50']}" for phase in PHASES[:-1])
+            print(f"   p50 分阶段(ms): {phases}")
+            print(f"   总耗时(ms): p50 {total['p50']}  p95 {total['p95']}  p99 {total['p99']}")
+        for error in summary['errors']:
+            print(f"   ❌ {error}")
+
+    print("\n🏁 推荐尝试顺序:")
+    for group, names in report['recommended_order'].items():
+        print(f"   {group}: {' > '.join(names)}")
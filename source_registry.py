@@ -0,0 +1,365 @@
+"""
+声明式数据源注册表
+每个数据源都用一段数据声明：地址、请求参数、提取规则（HTML 选择器/关键词或 JSON 路径）、
+价格单位、估算加价系数、优先级和超时。声明在启动时编译一次，得到可直接使用的提取器；
+爬虫、银行和金融 API 模块共用同一个注册表，按分组和优先级统一调度，不再为每个网站单独写方法。
+"""
+
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import requests
+
+from fx_rate import GRAMS_PER_TROY_OUNCE, FXRateCache, get_default_fx_cache
+from streaming_fetch import DEFAULT_MAX_BYTES, StreamingPriceExtractor, stream_extract_price
+
+# 匹配价格模式：数字+可能的小数点+可能的后缀
+PRICE_PATTERNS = [re.compile(pattern) for pattern in (
+    r'(\d+\.?\d*)\s*元/克',
+    r'¥\s*(\d+\.?\d*)',
+    r'(\d+\.?\d*)\s*元',
+    r'价格\s*[:：]\s*(\d+\.?\d*)'
+)]
+
+# 支持的价格单位，统一换算为元/克
+UNITS = ('cny_per_gram', 'cny_per_ounce', 'usd_per_ounce')
+
+# 由银行 / 金融 API 报价估算的水贝金价记录，其数据源名称按分组加的后缀
+ESTIMATE_SUFFIXES = {'bank': ' (水贝估算)', 'api': ' (估算)'}
+
+# 数据源声明
+# group:    web（网页爬虫）、bank（银行）、api（金融 API）
+# kind:     html 使用 StreamingPriceExtractor 的 selectors/keywords 规则流式提取，
+#           json 按 path（逐级的键）取值
+# priority: 同一分组内数值越小越先尝试
+# markup:   由该数据源价格估算水贝金价时的加价系数
+# sample_price: 页面可以访问但尚未实现解析规则时返回的示例价格
+SOURCE_SPECS: List[Dict[str, Any]] = [
+    {
+        'name': '金投网-实时金价',
+        'group': 'web',
+        'kind': 'html',
+        'url': 'https://quote.cngold.org/gold/cngold.html',
+        'description': '金投网实时金价',
+        'priority': 10,
+        'extract': {
+            # 查找黄金价格相关文本，只检查前几个
+            'keywords': ['黄金', '金价', 'Au'],
+            'keyword_scope': 'node',
+            'max_candidates': 5
+        }
+    },
+    {
+        'name': '中国黄金网',
+        'group': 'web',
+        'kind': 'html',
+        'url': 'https://www.gold.org.cn/',
+        'description': '中国黄金网实时金价',
+        'priority': 20,
+        'extract': {
+            # 查找包含水贝金价的元素，取其所在元素的全部文本
+            'keywords': ['水贝'],
+            'keyword_scope': 'parent'
+        }
+    },
+    {
+        'name': '上海黄金交易所',
+        'group': 'web',
+        'kind': 'html',
+        'url': 'https://www.sge.com.cn/goldPrice',
+        'description': '上海黄金交易所官方价格',
+        'priority': 30,
+        'extract': {
+            'selectors': [('div', 'gold-price'), ('span', 'price')],
+            'keywords': ['水贝']
+        }
+    },
+    {
+        'name': '新浪财经-黄金',
+        'group': 'web',
+        'kind': 'html',
+        'url': 'https://finance.sina.com.cn/money/nmetal/hjzx/',
+        'description': '新浪财经黄金行情（备选）',
+        'priority': 40,
+        'note': '可能不是水贝特定价格，仅供参考',
+        'extract': {
+            'keywords': ['黄金', '金价'],
+            'keyword_scope': 'node',
+            'max_candidates': 5
+        }
+    },
+    {
+        'name': '工商银行纸黄金',
+        'group': 'bank',
+        'kind': 'json',
+        'url': 'https://mybank.icbc.com.cn/servlet/AsynGetDataServlet',
+        'description': '工商银行贵金属行情',
+        'priority': 10,
+        # 响应格式需要根据工商银行实际接口确定
+        'path': None,
+        'markup': 1.03,
+        'sample_price': 915.5,
+        'note': '工商银行纸黄金价格，仅供参考'
+    },
+    {
+        'name': '中国银行黄金',
+        'group': 'bank',
+        'kind': 'html',
+        'url': 'https://www.boc.cn/finadata/gold/',
+        'description': '中国银行贵金属行情',
+        'priority': 20,
+        'extract': {
+            'selectors': [('td', 'gold-price')]
+        },
+        'markup': 1.03,
+        'sample_price': 916.8,
+        'note': '中国银行黄金价格，仅供参考'
+    },
+    {
+        'name': '建设银行黄金',
+        'group': 'bank',
+        'kind': 'html',
+        'url': 'https://www.ccb.com/cn/personal/wealth/gold_silver.html',
+        'description': '建设银行贵金属行情',
+        'priority': 30,
+        'extract': {
+            'selectors': [('td', 'gold-price')]
+        },
+        'markup': 1.03,
+        'sample_price': 917.2,
+        'note': '建设银行黄金价格，仅供参考'
+    },
+    {
+        'name': 'Alpha Vantage黄金价格',
+        'group': 'api',
+        'kind': 'json',
+        'url': 'https://www.alphavantage.co/query',
+        'description': 'Alpha Vantage 黄金期货报价',
+        'priority': 10,
+        'params': {
+            'function': 'GLOBAL_QUOTE',
+            'symbol': 'GC=F',
+            'apikey': 'demo'  # 免费API密钥，有调用限制
+        },
+        'path': ['Global Quote', '05. price'],
+        'unit': 'usd_per_ounce',
+        'markup': 1.08,
+        'note': '国际黄金价格，仅供参考'
+    },
+    {
+        'name': '金属价格API',
+        'group': 'api',
+        'kind': 'json',
+        'url': 'https://api.metalpriceapi.com/v1/latest',
+        'description': 'MetalPriceAPI 黄金报价',
+        'priority': 20,
+        'params': {
+            'api_key': 'demo',  # 需要注册获取真实API密钥
+            'base': 'XAU',
+            'currencies': 'CNY'
+        },
+        'path': ['rates', 'CNY'],
+        'unit': 'cny_per_ounce',
+        'markup': 1.08,
+        'note': '国际黄金价格，仅供参考'
+    }
+]
+
+
+def extract_price(text: str, patterns: Sequence[re.Pattern] = PRICE_PATTERNS) -> Optional[float]:
+    """从文本中提取价格数字"""
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            try:
+                return float(match.group(1))
+            except ValueError:
+                continue
+
+    return None
+
+
+class CompiledSource:
+    """编译后的数据源：声明中的规则已预先处理，可直接用于获取和提取价格"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        if not spec.get('name') or not spec.get('url'):
+            raise ValueError(f"数据源声明缺少 name 或 url: {spec}")
+        self.spec = dict(spec)
+        self.name: str = spec['name']
+        self.url: str = spec['url']
+        self.group: str = spec.get('group', 'web')
+        self.kind: str = spec.get('kind', 'html')
+        self.description: str = spec.get('description', '')
+        self.params: Dict[str, Any] = dict(spec.get('params') or {})
+        self.priority: int = int(spec.get('priority', 100))
+        self.timeout: float = float(spec.get('timeout', 10))
+        self.max_bytes: int = int(spec.get('max_bytes', DEFAULT_MAX_BYTES))
+        self.unit: str = spec.get('unit', 'cny_per_gram')
+        self.markup: float = float(spec.get('markup', 1.0))
+        self.note: Optional[str] = spec.get('note')
+        self.sample_price: Optional[float] = spec.get('sample_price')
+
+        if self.kind not in ('html', 'json'):
+            raise ValueError(f"数据源 {self.name} 的类型无效: {self.kind}")
+        if self.unit not in UNITS:
+            raise ValueError(f"数据源 {self.name} 的价格单位无效: {self.unit}，可选: {', '.join(UNITS)}")
+
+        patterns = spec.get('patterns')
+        self.patterns = [re.compile(pattern) for pattern in patterns] if patterns else PRICE_PATTERNS
+
+        rules = spec.get('extract') or {}
+        self.extract_rules = {
+            'selectors': tuple((tag, css_class) for tag, css_class in rules.get('selectors', ())),
+            'keywords': tuple(rules.get('keywords', ())),
+            'keyword_scope': rules.get('keyword_scope', 'parent'),
+            'max_candidates': rules.get('max_candidates')
+        }
+        path = spec.get('path')
+        self.path: Optional[Tuple[str, ...]] = tuple(path) if path else None
+
+    def __repr__(self) -> str:
+        return f"CompiledSource({self.name!r}, group={self.group!r}, priority={self.priority})"
+
+    @property
+    def markup_percentage(self) -> float:
+        return round((self.markup - 1) * 100, 2)
+
+    def estimate(self, base_price: float) -> float:
+        """按加价系数由该数据源的价格估算水贝金价"""
+        return round(base_price * self.markup, 2)
+
+    def _extract_price(self, text: str) -> Optional[float]:
+        return extract_price(text, self.patterns)
+
+    def new_extractor(self) -> StreamingPriceExtractor:
+        """创建一个新的增量 HTML 提取器（提取器有状态，每次获取使用一个）"""
+        return StreamingPriceExtractor(self._extract_price, **self.extract_rules)
+
+    def extract_html(self, html: str) -> Optional[Tuple[float, str]]:
+        """按提取规则从完整页面中提取价格，返回 (价格, 原始文本) 或 None
+
+        与在线流式提取使用相同的规则，用于离线重新提取已归档的页面。
+        """
+        extractor = self.new_extractor()
+        extractor.feed(html)
+        extractor.close()
+        return extractor.result
+
+    def extract_json(self, data: Any) -> Optional[Tuple[float, Any]]:
+        """按 path 从 JSON 响应中取出价格，返回 (价格, 价格所在的对象) 或 None"""
+        if self.path is None:
+            return None
+        container = value = data
+        for key in self.path:
+            if not isinstance(value, dict) or key not in value:
+                return None
+            container, value = value, value[key]
+        try:
+            price = float(value)
+        except (TypeError, ValueError):
+            return None
+        return (price, container) if price > 0 else None
+
+    def to_cny_per_gram(self, value: float, fx_cache: Optional[FXRateCache] = None) -> Tuple[float, Optional[Dict]]:
+        """把数据源单位的价格换算为元/克，返回 (价格, 使用的汇率信息或 None)"""
+        if self.unit == 'usd_per_ounce':
+            # 使用缓存的实时汇率换算（不会阻塞在汇率请求上）
+            fx = (fx_cache or get_default_fx_cache()).get_rate_info('USD', 'CNY')
+            return round(value * fx['rate'] / GRAMS_PER_TROY_OUNCE, 2), fx
+        if self.unit == 'cny_per_ounce':
+            return round(value / GRAMS_PER_TROY_OUNCE, 2), None
+        return value, None
+
+    def fetch(self, session: requests.Session, fx_cache: Optional[FXRateCache] = None,
+              on_bytes=None, stop_early: bool = True) -> Tuple[Optional[Dict], Dict]:
+        """获取并提取价格，返回 (结果或 None, 下载统计)
+
+        结果中的 price 已换算为元/克（未加价）；HTML 数据源带 raw_text，JSON 数据源带 raw_data。
+        网络或 HTTP 错误直接抛出，页面中没有价格时返回 None。
+        """
+        if self.kind == 'html':
+            result, stats = stream_extract_price(
+                session, self.url, self.new_extractor(), max_bytes=self.max_bytes, timeout=self.timeout,
+                on_bytes=on_bytes, stop_early=stop_early, params=self.params or None
+            )
+            if result is None:
+                return None, stats
+            price, raw_text = result
+            return {'price': price, 'raw_text': raw_text}, stats
+
+        started = time.perf_counter()
+        response = session.get(self.url, params=self.params or None, timeout=self.timeout)
+        stats = {
+            'url': self.url,
+            'status_code': response.status_code,
+            'bytes_read': len(response.content),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+        response.raise_for_status()
+        if on_bytes is not None:
+            on_bytes(response.content)
+        try:
+            extracted = self.extract_json(response.json())
+        except ValueError:
+            extracted = None
+        if extracted is None:
+            return None, stats
+
+        value, raw_data = extracted
+        price, fx = self.to_cny_per_gram(value, fx_cache)
+        result = {'price': price, 'raw_data': raw_data}
+        if fx is not None:
+            result['fx_rate'] = fx['rate']
+            result['fx_source'] = fx['source']
+        return result, stats
+
+
+class SourceRegistry:
+    """编译后数据源的注册表，按名称查找，按分组和优先级遍历"""
+
+    def __init__(self, specs: Optional[Sequence[Dict[str, Any]]] = None):
+        self._sources: Dict[str, CompiledSource] = {}
+        self._groups: Dict[str, List[CompiledSource]] = {}
+        for spec in (SOURCE_SPECS if specs is None else specs):
+            self.register(spec)
+
+    def register(self, spec: Dict[str, Any]) -> CompiledSource:
+        """编译并注册一个数据源声明，名称不能重复"""
+        source = CompiledSource(spec)
+        if source.name in self._sources:
+            raise ValueError(f"数据源名称重复: {source.name}")
+        self._sources[source.name] = source
+        self._groups = {}
+        return source
+
+    def get(self, name: str) -> Optional[CompiledSource]:
+        return self._sources.get(name)
+
+    def group(self, group: str) -> List[CompiledSource]:
+        """一个分组中的数据源，按优先级排序"""
+        if group not in self._groups:
+            self._groups[group] = sorted((source for source in self._sources.values() if source.group == group),
+                                         key=lambda source: source.priority)
+        return list(self._groups[group])
+
+    def __iter__(self) -> Iterator[CompiledSource]:
+        return iter(sorted(self._sources.values(), key=lambda source: (source.group, source.priority)))
+
+    def __len__(self) -> int:
+        return len(self._sources)
+
+
+_default_registry: Optional[SourceRegistry] = None
+_default_lock = threading.Lock()
+
+
+def get_registry() -> SourceRegistry:
+    """进程内共享的默认注册表（首次使用时编译 SOURCE_SPECS）"""
+    global _default_registry
+    with _default_lock:
+        if _default_registry is None:
+            _default_registry = SourceRegistry()
+        return _default_registry
@@ -0,0 +1,237 @@
+"""
+流式下载与增量解析
+网页数据源不再下载完整页面后整体解析：响应体按块读取，边读边交给增量 HTML 解析器，
+一旦找到有效价格立即关闭连接；每个数据源还有最大读取字节数的硬上限。
+"""
+
+import codecs
+import re
+import time
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+# 默认每个数据源最多读取的字节数
+DEFAULT_MAX_BYTES = 512 * 1024
+
+# 每次从套接字读取的块大小
+DEFAULT_CHUNK_SIZE = 8192
+
+# 不包含可见文本的标签
+_SKIP_TAGS = {'script', 'style', 'noscript', 'template'}
+
+# 没有结束标签的空元素
+_VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+              'link', 'meta', 'param', 'source', 'track', 'wbr'}
+
+_META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+
+
+class _Frame:
+    """解析栈中的一个元素"""
+
+    __slots__ = ('tag', 'classes', 'parts', 'keyword_hit')
+
+    def __init__(self, tag: str, classes: Tuple[str, ...]):
+        self.tag = tag
+        self.classes = classes
+        self.parts: List[str] = []
+        self.keyword_hit = False
+
+
+class StreamingPriceExtractor(HTMLParser):
+    """增量 HTML 价格提取器
+
+    selectors: [(标签, class)]，元素闭合时取其全部文本作为候选
+    keywords:  文本包含关键词时的候选规则；keyword_scope='parent' 取所在元素的全部文本，
+               'node' 只取该文本节点本身
+    extract_price: 从候选文本中提取价格的函数，返回 None 表示不是有效价格
+    max_candidates: 最多检查的候选文本数
+    """
+
+    def __init__(self, extract_price: Callable[[str], Optional[float]],
+                 selectors: Sequence[Tuple[str, str]] = (),
+                 keywords: Sequence[str] = (), keyword_scope: str = 'parent',
+                 max_candidates: Optional[int] = None):
+        super().__init__(convert_charrefs=True)
+        self.extract_price = extract_price
+        self.selectors = list(selectors)
+        self.keywords = list(keywords)
+        self.keyword_scope = keyword_scope
+        self.max_candidates = max_candidates
+
+        self._stack: List[_Frame] = [_Frame('#document', ())]
+        self._skip_depth = 0
+        self.candidates_checked = 0
+        self.result: Optional[Tuple[float, str]] = None
+
+    @property
+    def done(self) -> bool:
+        """已找到价格或候选数已用完"""
+        return self.result is not None or (
+            self.max_candidates is not None and self.candidates_checked >= self.max_candidates
+        )
+
+    def _check(self, text: str):
+        if self.done:
+            return
+        text = text.strip()
+        if not text:
+            return
+        self.candidates_checked += 1
+        price = self.extract_price(text)
+        if price:
+            self.result = (price, text)
+
+    def _matches_selector(self, frame: _Frame) -> bool:
+        return any(frame.tag == tag and css_class in frame.classes for tag, css_class in self.selectors)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+            return
+        if tag in _VOID_TAGS:
+            return
+        classes = ()
+        for name, value in attrs:
+            if name == 'class' and value:
+                classes = tuple(value.split())
+                break
+        self._stack.append(_Frame(tag, classes))
+
+    def handle_startendtag(self, tag, attrs):
+        # 自闭合标签不含文本
+        pass
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+            return
+        if tag in _VOID_TAGS:
+            return
+
+        # 容忍未闭合的子元素：一直弹出到匹配的标签
+        if not any(frame.tag == tag for frame in self._stack[1:]):
+            return
+        while len(self._stack) > 1:
+            if self._pop_frame().tag == tag:
+                break
+
+    def _pop_frame(self) -> _Frame:
+        frame = self._stack.pop()
+        text = ''.join(frame.parts)
+        if self._matches_selector(frame) or frame.keyword_hit:
+            self._check(text)
+        # 子元素文本并入父元素（与 get_text() 的语义一致）
+        self._stack[-1].parts.append(text)
+        return frame
+
+    def close(self):
+        """文档结束：处理剩余数据和所有未闭合的元素"""
+        super().close()
+        while len(self._stack) > 1:
+            self._pop_frame()
+
+    def handle_data(self, data):
+        if self._skip_depth or self.done:
+            return
+        frame = self._stack[-1]
+        frame.parts.append(data)
+        if self.keywords and any(keyword in data for keyword in self.keywords):
+            if self.keyword_scope == 'node':
+                self._check(data)
+            else:
+                frame.keyword_hit = True
+
+
+def _detect_encoding(response: requests.Response, first_chunk: bytes) -> str:
+    """从响应头或页面 meta 中确定编码"""
+    content_type = response.headers.get('Content-Type', '')
+    if 'charset=' in content_type.lower():
+        return response.encoding or 'utf-8'
+    match = _META_CHARSET.search(first_chunk)
+    if match:
+        encoding = match.group(1).decode('ascii', 'ignore')
+        try:
+            codecs.lookup(encoding)
+            return encoding
+        except LookupError:
+            pass
+    return 'utf-8'
+
+
+def stream_fetch(session: requests.Session, url: str, on_text: Callable[[str], bool],
+                 max_bytes: int = DEFAULT_MAX_BYTES, timeout: float = 10,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, on_bytes: Optional[Callable[[bytes], None]] = None,
+                 **kwargs) -> Dict:
+    """流式读取响应体，把解码后的文本逐块交给 on_text
+
+    on_text 返回 True 时立即停止读取并关闭连接；读取量达到 max_bytes 时同样停止。
+    on_bytes 可选，接收原始字节块（例如用于保存原始响应）。
+    返回本次下载的统计信息。
+    """
+    start = time.perf_counter()
+    bytes_read = 0
+    stopped_early = False
+    truncated = False
+    encoding = None
+
+    response = session.get(url, stream=True, timeout=timeout, **kwargs)
+    try:
+        response.raise_for_status()
+        decoder = None
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if not chunk:
+                continue
+            if bytes_read + len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes - bytes_read]
+                truncated = True
+            bytes_read += len(chunk)
+
+            if on_bytes is not None:
+                on_bytes(chunk)
+            if decoder is None:
+                encoding = _detect_encoding(response, chunk)
+                decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+            if on_text(decoder.decode(chunk)):
+                stopped_early = True
+                break
+            if truncated:
+                break
+        else:
+            if decoder is not None:
+                on_text(decoder.decode(b'', final=True))
+    finally:
+        # 提前结束时不读取剩余内容，直接关闭连接
+        response.close()
+
+    return {
+        'url': url,
+        'status_code': response.status_code,
+        'bytes_read': bytes_read,
+        'stopped_early': stopped_early,
+        'truncated': truncated,
+        'encoding': encoding,
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+    }
+
+
+def stream_extract_price(session: requests.Session, url: str, extractor: StreamingPriceExtractor,
+                         max_bytes: int = DEFAULT_MAX_BYTES, timeout: float = 10,
+                         on_bytes: Optional[Callable[[bytes], None]] = None,
+                         stop_early: bool = True, **kwargs) -> Tuple[Optional[Tuple[float, str]], Dict]:
+    """流式下载页面并增量提取价格，返回 ((价格, 原始文本) 或 None, 下载统计)
+
+    stop_early=False 时找到价格后继续读取剩余内容（例如需要归档完整页面时）。
+    其余参数（例如 params）传给 session.get。
+    """
+    def feed(text: str) -> bool:
+        if not extractor.done:
+            extractor.feed(text)
+        return stop_early and extractor.done
+
+    stats = stream_fetch(session, url, feed, max_bytes=max_bytes, timeout=timeout, on_bytes=on_bytes, **kwargs)
+    if not extractor.done:
+        extractor.close()
+    return extractor.result, stats
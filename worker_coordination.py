@@ -0,0 +1,308 @@
+"""
+多工作进程分片获取
+多个工作进程（可以在不同机器上，共享同一个协调数据库文件）通过租约分摊数据源：
+每个工作进程定期心跳并续租自己持有的分片，按存活进程数计算公平份额，
+多出的分片主动释放，空闲或过期的分片由其他进程接管。某个进程退出或宕机后，
+它的租约在 lease_ttl 秒后过期，工作自动重新分配。
+
+分片的单位是主机：同一主机上的数据源总由同一个进程获取，按主机的限流（rate_limit）因此仍然准确。
+获取结果经由 create_storage() 批量写入，数据接收服务运行时所有进程共用这一个写入者。
+"""
+
+import hashlib
+import logging
+import math
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from data_storage import DEFAULT_DURABILITY
+from fx_rate import FXRateCache, get_default_fx_cache
+from ingest_daemon import create_storage
+from rate_limit import RateLimitedSession, RateLimitExceeded, host_of
+from source_registry import ESTIMATE_SUFFIXES, CompiledSource, SourceRegistry, get_registry
+
+# 默认的协调数据库（位于数据目录下）
+DEFAULT_COORDINATION_DB = os.path.join("data", "coordination.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    task TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class LeaseCoordinator:
+    """基于 SQLite 的租约协调：心跳、公平份额、续租、释放和接管"""
+
+    def __init__(self, db_path: str = DEFAULT_COORDINATION_DB, worker_id: Optional[str] = None,
+                 lease_ttl: float = 30.0):
+        self.db_path = db_path
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_ttl = lease_ttl
+        self.logger = logging.getLogger(__name__)
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None：手动用 BEGIN IMMEDIATE 串行化各进程的重新分配
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA busy_timeout = 30000')
+        return conn
+
+    def _preference(self, task: str) -> str:
+        """同一任务在各进程间的稳定偏好（最高随机权重），减少重新分配时的抖动"""
+        return hashlib.sha1(f"{self.worker_id}:{task}".encode('utf-8')).hexdigest()
+
+    def rebalance(self, tasks: List[str], now: Optional[float] = None) -> List[str]:
+        """心跳、续租并按公平份额调整持有的任务，返回本进程当前持有的任务"""
+        now = time.time() if now is None else now
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT OR REPLACE INTO workers (worker_id, heartbeat) VALUES (?, ?)',
+                         (self.worker_id, now))
+            conn.execute('DELETE FROM workers WHERE heartbeat < ?', (now - self.lease_ttl,))
+            live = conn.execute('SELECT COUNT(*) FROM workers').fetchone()[0]
+            share = math.ceil(len(tasks) / max(1, live))
+
+            leases = {task: (owner, expires) for task, owner, expires in
+                      conn.execute('SELECT task, owner, expires FROM leases')}
+            task_set = set(tasks)
+            mine = [task for task in tasks
+                    if task in leases and leases[task][0] == self.worker_id and leases[task][1] > now]
+
+            # 超出份额的任务主动释放，让新加入的进程接管
+            if len(mine) > share:
+                mine.sort(key=self._preference, reverse=True)
+                released = mine[share:]
+                mine = mine[:share]
+                conn.executemany('DELETE FROM leases WHERE task = ? AND owner = ?',
+                                 [(task, self.worker_id) for task in released])
+                self.logger.info("释放 %s 个分片: %s", len(released), released)
+
+            free = [task for task in tasks if task not in leases or leases[task][1] <= now]
+            free.sort(key=self._preference, reverse=True)
+            acquired = free[:max(0, share - len(mine))]
+            if acquired:
+                self.logger.info("接管 %s 个分片: %s", len(acquired), acquired)
+            mine.extend(acquired)
+
+            expires = now + self.lease_ttl
+            conn.executemany('INSERT OR REPLACE INTO leases (task, owner, expires) VALUES (?, ?, ?)',
+                             [(task, self.worker_id, expires) for task in mine])
+            # 已不存在的任务的租约一并清除
+            stale = [task for task in leases if task not in task_set]
+            if stale:
+                conn.executemany('DELETE FROM leases WHERE task = ?', [(task,) for task in stale])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return sorted(mine)
+
+    def release_all(self):
+        """退出前释放全部租约并注销，其他进程无需等待租约过期即可接管"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM leases WHERE owner = ?', (self.worker_id,))
+            conn.execute('DELETE FROM workers WHERE worker_id = ?', (self.worker_id,))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def get_status(self) -> Dict:
+        """存活的工作进程及各自持有的分片"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            workers = {worker_id: round(now - heartbeat, 1) for worker_id, heartbeat in
+                       conn.execute('SELECT worker_id, heartbeat FROM workers WHERE heartbeat >= ?',
+                                    (now - self.lease_ttl,))}
+            assignments = defaultdict(list)
+            for task, owner in conn.execute('SELECT task, owner FROM leases WHERE expires > ? ORDER BY task',
+                                            (now,)):
+                assignments[owner].append(task)
+        finally:
+            conn.close()
+        return {'workers': workers, 'assignments': dict(assignments)}
+
+
+def shard_sources(registry: SourceRegistry) -> Dict[str, List[CompiledSource]]:
+    """按主机把数据源分组为分片"""
+    shards: Dict[str, List[CompiledSource]] = defaultdict(list)
+    for source in registry:
+        shards[host_of(source.url)].append(source)
+    return dict(shards)
+
+
+class ShardedWorker:
+    """按租约获取自己负责的分片并写入共享存储的工作进程"""
+
+    def __init__(self, coordinator: Optional[LeaseCoordinator] = None, registry: Optional[SourceRegistry] = None,
+                 storage=None, interval_seconds: float = 60.0, jitter_seconds: Optional[float] = None,
+                 fx_cache: Optional[FXRateCache] = None, socket_path: Optional[str] = None,
+                 durability: str = DEFAULT_DURABILITY):
+        self.coordinator = coordinator or LeaseCoordinator()
+        self.registry = registry or get_registry()
+        self.shards = shard_sources(self.registry)
+        self.storage = storage or create_storage(socket_path=socket_path, durability=durability)
+        self.interval_seconds = interval_seconds
+        self.jitter_seconds = min(interval_seconds * 0.1, 10) if jitter_seconds is None else jitter_seconds
+        self.fx_cache = fx_cache or get_default_fx_cache()
+        self.session = RateLimitedSession()
+        self.owned: List[str] = []
+        self.fetched = 0
+        self._stop = threading.Event()
+        self._lease_thread: Optional[threading.Thread] = None
+        self.logger = logging.getLogger(__name__)
+
+    def _lease_loop(self):
+        """独立线程定期续租，获取耗时较长时租约也不会过期"""
+        renew_interval = self.coordinator.lease_ttl / 3
+        while not self._stop.is_set():
+            self._renew()
+            self._stop.wait(renew_interval)
+
+    def _renew(self):
+        try:
+            owned = self.coordinator.rebalance(sorted(self.shards))
+            if owned != self.owned:
+                self.logger.info("工作进程 %s 负责的分片: %s", self.coordinator.worker_id, owned)
+            self.owned = owned
+        except Exception as e:
+            # 无法续租时停止获取，避免与接管的进程重复
+            self.logger.error("续租失败: %s", e)
+            self.owned = []
+
+    def fetch_source(self, source: CompiledSource) -> Dict:
+        """获取一个数据源的价格，换算为水贝金价（元/克），失败时返回带 error 的记录
+
+        与调度器和共识模式一致：银行和 API 的价格按加价系数估算，数据源名称带上估算后缀；
+        页面可以访问但未能解析的银行数据源记录其示例价格。
+        """
+        name = source.name + ESTIMATE_SUFFIXES.get(source.group, '')
+        timestamp = datetime.now().isoformat()
+        try:
+            result, _ = source.fetch(self.session, fx_cache=self.fx_cache)
+        except RateLimitExceeded as e:
+            return {'source': name, 'price': None, 'timestamp': timestamp, 'error': str(e)}
+        except Exception as e:
+            self.logger.error("获取 %s 失败: %s", source.name, e, extra={'source': source.name, 'outcome': 'error'})
+            return {'source': name, 'price': None, 'timestamp': timestamp, 'error': str(e)}
+
+        if result is None and source.sample_price is None:
+            return {'source': name, 'price': None, 'timestamp': timestamp, 'error': '页面中没有找到价格'}
+        base_price = result['price'] if result else source.sample_price
+        price_data = {
+            'source': name,
+            'price': source.estimate(base_price),
+            'timestamp': timestamp,
+            'raw_text': result.get('raw_text') if result else None
+        }
+        if source.group != 'web':
+            price_data['base_price'] = base_price
+            price_data['markup'] = source.markup
+        if source.note:
+            price_data['note'] = source.note
+        return price_data
+
+    def run_once(self) -> List[Dict]:
+        """获取本进程当前负责的全部分片，批量写入存储"""
+        records = []
+        for shard in list(self.owned):
+            for source in self.shards.get(shard, []):
+                records.append(self.fetch_source(source))
+        if records:
+            self.storage.save_price_batch(records)
+            self.fetched += len(records)
+        return records
+
+    def start(self):
+        """开始续租（在后台线程中）"""
+        self._renew()
+        self._lease_thread = threading.Thread(target=self._lease_loop, daemon=True)
+        self._lease_thread.start()
+
+    def run(self, duration: Optional[float] = None):
+        """按间隔循环获取，直到 stop() 或达到 duration 秒"""
+        self.start()
+        deadline = time.monotonic() + duration if duration else None
+        next_tick = time.monotonic()
+        try:
+            while not self._stop.is_set() and (deadline is None or time.monotonic() < deadline):
+                # 随机延迟，避免所有工作进程在同一时刻发出请求
+                if self._stop.wait(random.uniform(0, self.jitter_seconds) if self.jitter_seconds > 0 else 0):
+                    break
+                self.run_once()
+                next_tick += self.interval_seconds
+                delay = next_tick - time.monotonic()
+                if delay < 0:
+                    # 一轮获取超过了间隔，从现在重新计时
+                    next_tick = time.monotonic()
+                    delay = 0
+                if deadline is not None:
+                    delay = min(delay, max(0.0, deadline - time.monotonic()))
+                self._stop.wait(delay)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """停止获取并释放租约"""
+        self._stop.set()
+        if self._lease_thread is not None and self._lease_thread is not threading.current_thread():
+            self._lease_thread.join(timeout=5)
+        try:
+            self.coordinator.release_all()
+        except Exception as e:
+            self.logger.error("释放租约失败: %s", e)
+        try:
+            self.storage.close()
+        except Exception as e:
+            self.logger.error("关闭存储失败: %s", e)
+
+    def get_status(self) -> Dict:
+        return {
+            'worker_id': self.coordinator.worker_id,
+            'owned': list(self.owned),
+            'fetched': self.fetched,
+            'interval_seconds': self.interval_seconds
+        }
+
+
+def run_worker(db_path: str = DEFAULT_COORDINATION_DB, worker_id: Optional[str] = None,
+               interval_seconds: float = 60.0, lease_ttl: float = 30.0, jitter_seconds: Optional[float] = None,
+               socket_path: Optional[str] = None, durability: str = DEFAULT_DURABILITY):
+    """运行一个分片工作进程（阻塞）"""
+    worker = ShardedWorker(LeaseCoordinator(db_path, worker_id, lease_ttl),
+                           interval_seconds=interval_seconds, jitter_seconds=jitter_seconds,
+                           socket_path=socket_path, durability=durability)
+    print(f"👷 工作进程 {worker.coordinator.worker_id} 已启动，共 {len(worker.shards)} 个分片，"
+          f"每 {interval_seconds} 秒获取一次")
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        print("\n🛑 正在停止工作进程并释放租约...")
+        worker.stop()